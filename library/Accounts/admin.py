@@ -5,4 +5,7 @@ from . import models
 @admin.register(models.CustomUser)
 class UserAdmin(admin.ModelAdmin):
     list_display = ['id', 'username', 'email', 'phone_number', 'is_staff', 'is_active']
+    # لازم برای autocomplete_fields کاربر در ادمین تراکنش‌ها
+    search_fields = ['username', 'email', 'phone_number']
+    show_full_result_count = False
 # Register your models here.
@@ -3,6 +3,8 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from . import models
 from django.db import IntegrityError
+from Book.models import UserSummary
+from Book.serializers import UserSummarySerializer
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -57,6 +59,16 @@ class UserSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({'phone_number': ['این شماره تلفن قبلاً ثبت شده است']})
             raise serializers.ValidationError('خطا در ایجاد کاربر')
 
+class UserProfileSerializer(UserSerializer):
+    """کاربر به همراه خلاصه قرض و خرید (از جدول UserSummary، بدون aggregate روی تراکنش‌ها)"""
+    summary = serializers.SerializerMethodField()
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ('summary',)
+
+    def get_summary(self, obj):
+        return UserSummarySerializer(UserSummary.for_user(obj)).data
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
@@ -6,13 +6,13 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import login, logout
 from . import models
-from .serializers import UserSerializer, LoginSerializer
+from .serializers import UserSerializer, UserProfileSerializer, LoginSerializer
 from Book.permissions import IsAdmin # برای دسترسی ادمین به UserViewSet
 
 class UserViewSet(viewsets.ModelViewSet):
     """مدیریت کاربران توسط ادمین"""
-    queryset = models.CustomUser.objects.all()
-    serializer_class = UserSerializer
+    queryset = models.CustomUser.objects.select_related('summary')
+    serializer_class = UserProfileSerializer
     permission_classes = [IsAdmin] 
     
     # perform_create حذف شد (توسط serializer.create مدیریت می‌شود)
@@ -63,7 +63,7 @@ def user_profile(request):
     user = request.user
     
     if request.method == 'GET':
-        serializer = UserSerializer(user)
+        serializer = UserProfileSerializer(user)
         return Response(serializer.data)
         
     elif request.method in ['PUT', 'PATCH']:
@@ -72,7 +72,7 @@ def user_profile(request):
         data.pop('password', None)
         data.pop('password_confirm', None)
         
-        serializer = UserSerializer(user, data=data, partial=(request.method == 'PATCH'))
+        serializer = UserProfileSerializer(user, data=data, partial=(request.method == 'PATCH'))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
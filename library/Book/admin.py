@@ -1,33 +1,84 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from .models import Category, Book, Transaction, Inventory
 
+
+class EstimatedCountPaginator(Paginator):
+    """
+    در لیست فیلتر نشده روی PostgreSQL به جای COUNT(*) کامل جدول از تخمین pg_class.reltuples
+    استفاده می‌کند؛ برای جدول‌های کوچک و لیست‌های فیلتر شده همان شمارش دقیق انجام می‌شود.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        object_list = self.object_list
+        if isinstance(object_list, QuerySet) and not object_list.query.where:
+            connection = connections[object_list.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                        [object_list.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= self.exact_count_threshold:
+                    return row[0]
+        return super().count
+
+
+class UpdateFieldsAdminMixin:
+    """ذخیره فقط فیلدهای تغییر کرده فرم (مثلاً در list_editable) به جای ذخیره کل ردیف"""
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        if not form.changed_data:
+            return
+        update_fields = list(form.changed_data)
+        if any(field.name == 'updated_at' for field in obj._meta.concrete_fields):
+            update_fields.append('updated_at')
+        obj.save(update_fields=update_fields)
+
+
+class LargeTableAdminMixin:
+    """تنظیمات changelist برای جدول‌های بزرگ: بدون شمارش کامل دوم و با شمارش تخمینی"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(UpdateFieldsAdminMixin, admin.ModelAdmin):
+    # books_count فیلد شمارنده خود مدل است و برای هر ردیف کوئری COUNT ندارد
     list_display = ['name', 'books_count', 'created_at']
     list_filter = ['created_at']
     search_fields = ['name', 'description']
-    
-    def books_count(self, obj):
-        return obj.books.count()
-    books_count.short_description = 'تعداد کتاب‌ها'
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(LargeTableAdminMixin, UpdateFieldsAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'author', 'category', 'available_count', 'total_count', 'price']
     list_filter = ['category', 'created_at']
     search_fields = ['title', 'author', 'isbn']
     list_editable = ['available_count', 'total_count', 'price']
-    raw_id_fields = ['category']
+    list_select_related = ['category']
+    autocomplete_fields = ['category']
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(LargeTableAdminMixin, UpdateFieldsAdminMixin, admin.ModelAdmin):
     list_display = ['user', 'book', 'transaction_type', 'quantity', 'total_price', 'created_at', 'is_completed']
     list_filter = ['transaction_type', 'created_at', 'is_completed']
     search_fields = ['user__username', 'book__title']
     readonly_fields = ['created_at']
+    list_select_related = ['user', 'book']
+    autocomplete_fields = ['user', 'book']
 
 @admin.register(Inventory)
-class InventoryAdmin(admin.ModelAdmin):
+class InventoryAdmin(LargeTableAdminMixin, UpdateFieldsAdminMixin, admin.ModelAdmin):
     list_display = ['book', 'min_stock_level', 'max_stock_level', 'auto_replenish', 'last_replenished']
     list_filter = ['auto_replenish']
-    search_fields = ['book__title']
\ No newline at end of file
+    search_fields = ['book__title']
+    list_select_related = ['book']
+    autocomplete_fields = ['book']
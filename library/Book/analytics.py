@@ -0,0 +1,130 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import RollupWatermark, Transaction, TransactionRollup
+
+ROLLUP_BATCH_SIZE = 5000
+# تراکنش‌های جوان‌تر از این مقدار هنوز پردازش نمی‌شوند تا تراکنشی که id کوچک‌تر دارد
+# ولی دیرتر commit شده از قلم نیفتد
+ROLLUP_SAFETY_LAG = timedelta(minutes=5)
+# id گم شده (rollback یا تراکنش هنوز commit نشده) فقط وقتی رد می‌شود که ردیف بعد از آن
+# حداقل این مدت قبل ساخته شده باشد؛ تراکنش دیتابیسی باز طولانی‌تر از این، rollback شده فرض می‌شود
+ROLLUP_GAP_TIMEOUT = timedelta(minutes=30)
+
+GROUP_BY_FIELDS = {
+    'none': [],
+    'book': ['book_id'],
+    'category': ['category_id'],
+    'type': ['transaction_type'],
+}
+
+
+def bucket_start(value, granularity):
+    """شروع بازه ساعتی یا روزانه (روز بر اساس منطقه زمانی پروژه)"""
+    local = timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+    if granularity == TransactionRollup.DAY:
+        local = local.replace(hour=0)
+    return local
+
+
+def _merge(rows):
+    totals = {}
+    for _, book_id, category_id, transaction_type, quantity, total_price, created_at in rows:
+        for granularity, _label in TransactionRollup.GRANULARITIES:
+            key = (granularity, bucket_start(created_at, granularity), book_id, transaction_type)
+            count, quantity_sum, price_sum, _category = totals.get(key, (0, 0, Decimal('0'), category_id))
+            totals[key] = (count + 1, quantity_sum + quantity, price_sum + total_price, category_id)
+    return totals
+
+
+def _contiguous_prefix(rows, last_id, now, safety_lag, gap_timeout):
+    """
+    ردیف‌هایی که نشانگر می‌تواند از رویشان عبور کند: از ابتدا تا اولین ردیف جوان‌تر از safety_lag
+    یا اولین id گم شده‌ای که هنوز ممکن است commit شود. بعد از عبور نشانگر، ردیفی با id کوچک‌تر دیگر خوانده نمی‌شود.
+    """
+    ready = []
+    expected_id = last_id + 1
+    for row in rows:
+        transaction_id, created_at = row[0], row[-1]
+        if created_at > now - safety_lag:
+            break
+        if transaction_id != expected_id and created_at > now - gap_timeout:
+            break
+        ready.append(row)
+        expected_id = transaction_id + 1
+    return ready
+
+
+@transaction.atomic
+def rollup_next_batch(batch_size=ROLLUP_BATCH_SIZE, safety_lag=ROLLUP_SAFETY_LAG, gap_timeout=ROLLUP_GAP_TIMEOUT):
+    """
+    اعمال دسته بعدی تراکنش‌های جدید (بعد از نشانگر) در TransactionRollup.
+    قفل ردیف نشانگر باعث می‌شود فقط یک worker در هر لحظه خلاصه‌ها را تغییر دهد.
+    """
+    watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(pk=1)
+    rows = list(
+        Transaction.objects.filter(id__gt=watermark.last_transaction_id)
+        .order_by('id')
+        .values_list('id', 'book_id', 'book__category_id', 'transaction_type', 'quantity', 'total_price', 'created_at')
+        [:batch_size]
+    )
+    rows = _contiguous_prefix(rows, watermark.last_transaction_id, timezone.now(), safety_lag, gap_timeout)
+    if not rows:
+        return 0
+
+    totals = _merge(rows)
+    existing = {}
+    for granularity, _label in TransactionRollup.GRANULARITIES:
+        keys = [key for key in totals if key[0] == granularity]
+        queryset = TransactionRollup.objects.filter(
+            granularity=granularity,
+            bucket__in={key[1] for key in keys},
+            book_id__in={key[2] for key in keys},
+        )
+        for rollup in queryset:
+            existing[(rollup.granularity, rollup.bucket, rollup.book_id, rollup.transaction_type)] = rollup
+
+    created, updated = [], []
+    for key, (count, quantity, total_price, category_id) in totals.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            granularity, bucket, book_id, transaction_type = key
+            created.append(TransactionRollup(
+                granularity=granularity, bucket=bucket, book_id=book_id, category_id=category_id,
+                transaction_type=transaction_type, count=count, quantity=quantity, total_price=total_price,
+            ))
+        else:
+            rollup.count += count
+            rollup.quantity += quantity
+            rollup.total_price += total_price
+            updated.append(rollup)
+
+    TransactionRollup.objects.bulk_create(created, batch_size=1000)
+    TransactionRollup.objects.bulk_update(updated, ['count', 'quantity', 'total_price'], batch_size=1000)
+
+    watermark.last_transaction_id = rows[-1][0]
+    watermark.save(update_fields=['last_transaction_id', 'updated_at'])
+    return len(rows)
+
+
+def query_rollups(granularity, start, end, group_by='none', filters=None):
+    """
+    جمع خلاصه‌ها در بازه [start, end) به تفکیک bucket و بعد گروه‌بندی دلخواه؛
+    فقط روی TransactionRollup و ایندکس‌های (granularity, ..., bucket) اجرا می‌شود.
+    """
+    fields = ['bucket', *GROUP_BY_FIELDS[group_by]]
+    return (
+        TransactionRollup.objects.filter(granularity=granularity, bucket__gte=start, bucket__lt=end, **(filters or {}))
+        .values(*fields)
+        .annotate(count=Sum('count'), quantity=Sum('quantity'), total_price=Sum('total_price'))
+        .order_by(*fields)
+    )
+
+
+def rollup_watermark():
+    watermark = RollupWatermark.objects.filter(pk=1).first()
+    return watermark.last_transaction_id if watermark else 0
@@ -0,0 +1,65 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # اگر کلید نسخه پاک شده باشد، مقدار جدید نباید با نسخه‌های قبلی برخورد کند
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """باطل کردن همه پاسخ‌های کش شده کاتالوگ با افزایش نسخه"""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def bump_catalog_version_on_commit():
+    # بعد از commit اجرا می‌شود تا درخواستی که داده قدیمی را خوانده، آن را با نسخه جدید ذخیره نکند
+    transaction.on_commit(bump_catalog_version)
+
+
+def catalog_cache_key(endpoint, request, version):
+    params = sorted(
+        (key, sorted(values)) for key, values in request.query_params.lists()
+    )
+    role = getattr(request.user, 'user_type', None) or 'anonymous'
+    # لینک‌های next/previous صفحه‌بندی مطلق‌اند، پس پاسخ هر میزبان و scheme جداگانه کش می‌شود
+    origin = f'{request.scheme}://{request.get_host()}'
+    digest = hashlib.md5(repr((origin, params)).encode('utf-8')).hexdigest()
+    return f'catalog:{version}:{endpoint}:{role}:{digest}'
+
+
+def cached_catalog_response(endpoint):
+    """
+    کش پاسخ endpoint های لیستی کاتالوگ بر اساس (endpoint، میزبان، پارامترها، نقش کاربر).
+    با هر تغییر Book/Category/Inventory نسخه عوض می‌شود و کلیدهای قبلی دیگر خوانده نمی‌شوند.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = catalog_cache_key(endpoint, request, get_catalog_version())
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
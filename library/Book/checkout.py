@@ -0,0 +1,130 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+
+from .cache import bump_catalog_version_on_commit
+from .models import Book, ReplenishRequest, StockMovement, Transaction, UserSummary
+from .stock import StockChange, record_stock_changes, stock_change_reason
+from .tasks import schedule_loan_expiry
+
+LOCKING = 'locking'
+CONDITIONAL = 'conditional'
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def checkout_locking(book_id, quantity):
+    """
+    کم کردن موجودی با قفل ردیف (select_for_update) و بررسی در پایتون.
+    باید داخل transaction.atomic صدا زده شود.
+    """
+    book = Book.objects.select_for_update().get(id=book_id)
+    if book.available_count < quantity:
+        raise InsufficientStock()
+
+    book.available_count -= quantity
+    with stock_change_reason(StockMovement.CHECKOUT):
+        book.save(update_fields=['available_count', 'updated_at'])
+    return book
+
+
+def checkout_conditional(book_id, quantity):
+    """
+    کم کردن موجودی با یک UPDATE شرطی اتمیک:
+    UPDATE ... SET available_count = available_count - q WHERE id = ? AND available_count >= q
+    بدون SELECT ... FOR UPDATE و بدون بررسی در پایتون؛ تعداد ردیف‌های تغییر کرده نتیجه را مشخص می‌کند.
+    """
+    updated = Book.objects.filter(pk=book_id, available_count__gte=quantity).update(
+        available_count=F('available_count') - quantity,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        if not Book.objects.filter(pk=book_id).exists():
+            raise Book.DoesNotExist()
+        raise InsufficientStock()
+
+    # ردیف تا پایان تراکنش توسط همین UPDATE قفل است، پس مقدار قبلی دقیقاً new + quantity است
+    book = Book.objects.get(pk=book_id)
+    # queryset.update سیگنال post_save ندارد
+    record_stock_changes(
+        [StockChange(book.pk, book.available_count + quantity, book.available_count)],
+        reason=StockMovement.CHECKOUT,
+    )
+    bump_catalog_version_on_commit()
+    return book
+
+
+CHECKOUT_ENGINES = {
+    LOCKING: checkout_locking,
+    CONDITIONAL: checkout_conditional,
+}
+
+
+def get_checkout_engine(name=None):
+    return CHECKOUT_ENGINES[name or settings.LIBRARY_CHECKOUT_ENGINE]
+
+
+class CartCheckoutError(Exception):
+    def __init__(self, results):
+        super().__init__('cart checkout failed')
+        self.results = results
+
+
+def checkout_cart(user, lines, engine=None):
+    """
+    ثبت همه خطوط سبد در یک تراکنش اتمیک (همه یا هیچ).
+    موجودی هر کتاب فقط یک بار و به ترتیب id کم می‌شود تا بین درخواست‌های هم‌زمان deadlock رخ ندهد،
+    سپس همه تراکنش‌ها با یک bulk_create ساخته می‌شوند.
+    """
+    checkout = get_checkout_engine(engine)
+    demand = defaultdict(int)
+    for line in lines:
+        demand[line['book_id']] += line['quantity']
+
+    with transaction.atomic():
+        books, errors = {}, {}
+        for book_id in sorted(demand):
+            try:
+                books[book_id] = checkout(book_id, demand[book_id])
+            except Book.DoesNotExist:
+                errors[book_id] = 'کتاب مورد نظر یافت نشد!'
+            except InsufficientStock:
+                errors[book_id] = 'تعداد کتاب درخواستی بیش از حد موجود است!'
+
+        if errors:
+            # خروج با استثنا باعث rollback همه کم‌کردن‌های انجام شده می‌شود
+            raise CartCheckoutError([
+                {
+                    'book_id': line['book_id'],
+                    'status': 'error',
+                    'message': errors.get(line['book_id'], 'به دلیل خطای سایر اقلام سبد ثبت نشد'),
+                }
+                for line in lines
+            ])
+
+        prefetch_related_objects(list(books.values()), 'category')
+        transactions = []
+        for line in lines:
+            item = Transaction(
+                user=user,
+                book=books[line['book_id']],
+                transaction_type=line['transaction_type'],
+                quantity=line['quantity'],
+            )
+            item.set_computed_fields()
+            transactions.append(item)
+        Transaction.objects.bulk_create(transactions)
+        UserSummary.apply_deltas(UserSummary.transaction_deltas(transactions))
+        schedule_loan_expiry(transactions)
+
+        # bulk_create سیگنال post_save ندارد؛ درخواست بررسی انبار بعد از خرید همین‌جا ثبت می‌شود
+        purchased = {item.book_id for item in transactions if item.transaction_type == Book.PURCHASE}
+        if purchased:
+            ReplenishRequest.record(purchased)
+
+    return transactions
@@ -0,0 +1,80 @@
+import csv
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+EXPORT_FORMAT_PARAM = 'export_format'
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """بافر ساختگی برای csv.writer که به جای نوشتن، همان خط را برمی‌گرداند"""
+
+    def write(self, value):
+        return value
+
+
+def iter_serialized_rows(queryset, serializer_class, chunk_size=DEFAULT_CHUNK_SIZE, context=None):
+    """
+    پیمایش کوئری با iterator و سریالایز کردن تکه به تکه؛
+    در هر لحظه حداکثر chunk_size شیء در حافظه است.
+    """
+    if not queryset.ordered:
+        queryset = queryset.order_by('pk')
+
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield from serializer_class(chunk, many=True, context=context).data
+            chunk = []
+    if chunk:
+        yield from serializer_class(chunk, many=True, context=context).data
+
+
+def _ndjson_lines(rows):
+    encoder = JSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def _csv_lines(rows, header):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([row.get(column) for column in header])
+
+
+def get_export_format(request):
+    export_format = request.query_params.get(EXPORT_FORMAT_PARAM, 'ndjson').lower()
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise ValidationError({
+            EXPORT_FORMAT_PARAM: f'فرمت خروجی باید یکی از {", ".join(EXPORT_CONTENT_TYPES)} باشد'
+        })
+    return export_format
+
+
+def streaming_export_response(request, queryset, serializer_class, filename, context=None):
+    """ساخت پاسخ استریم NDJSON یا CSV از یک کوئری بدون بارگذاری کامل آن در حافظه"""
+    export_format = get_export_format(request)
+    rows = iter_serialized_rows(queryset, serializer_class, context=context)
+
+    if export_format == 'csv':
+        header = [
+            name for name, field in serializer_class(context=context).fields.items()
+            if not field.write_only
+        ]
+        lines = _csv_lines(rows, header)
+    else:
+        lines = _ndjson_lines(rows)
+
+    response = StreamingHttpResponse(lines, content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
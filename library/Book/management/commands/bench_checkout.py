@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import Counter
+
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.core.management.base import BaseCommand
+
+from Accounts.models import CustomUser
+from Book.checkout import CHECKOUT_ENGINES, InsufficientStock, get_checkout_engine
+from Book.models import Book, Inventory, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'بنچمارک هم‌زمانی موتورهای کم کردن موجودی: چند thread روی یک کتاب پرتقاضا '
+        'درخواست می‌دهند و توان عملیاتی و عدم فروش بیش از موجودی مقایسه می‌شود'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', choices=[*CHECKOUT_ENGINES, 'all'], default='all')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=50, help='تعداد درخواست هر thread')
+        parser.add_argument('--stock', type=int, default=200, help='موجودی اولیه کتاب')
+        parser.add_argument('--quantity', type=int, default=1)
+
+    def handle(self, *args, **options):
+        engines = list(CHECKOUT_ENGINES) if options['engine'] == 'all' else [options['engine']]
+        user, _ = CustomUser.objects.get_or_create(
+            username='bench-checkout', defaults={'user_type': CustomUser.UserType.ADMIN}
+        )
+        try:
+            for name in engines:
+                self._run(name, user, options)
+        finally:
+            user.delete()
+
+    def _run(self, name, user, options):
+        stock, quantity = options['stock'], options['quantity']
+        book = Book.objects.create(
+            title=f'bench-{name}', author='bench', total_count=stock, available_count=stock
+        )
+        # پر کردن خودکار انبار موجودی را تغییر می‌دهد و مقایسه فروش با موجودی اولیه را بی‌معنی می‌کند
+        Inventory.objects.filter(book=book).update(auto_replenish=False)
+        checkout = get_checkout_engine(name)
+        outcomes = Counter()
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+
+        def worker():
+            local = Counter()
+            start_barrier.wait()
+            for _ in range(options['requests']):
+                try:
+                    with transaction.atomic():
+                        locked_book = checkout(book.pk, quantity)
+                        Transaction.objects.create(
+                            user=user, book=locked_book,
+                            transaction_type=Book.PURCHASE, quantity=quantity
+                        )
+                    local['success'] += 1
+                except InsufficientStock:
+                    local['insufficient'] += 1
+                except DatabaseError:
+                    # مثلاً database is locked در SQLite یا deadlock در PostgreSQL
+                    local['db_error'] += 1
+            connection.close()
+            with lock:
+                outcomes.update(local)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        close_old_connections()
+
+        book.refresh_from_db()
+        sold = Transaction.objects.filter(book=book).count() * quantity
+        attempts = options['threads'] * options['requests']
+        consistent = book.available_count == stock - sold and sold <= stock
+
+        self.stdout.write(f'engine={name}')
+        self.stdout.write(
+            f"  attempts={attempts} success={outcomes['success']} "
+            f"insufficient={outcomes['insufficient']} db_errors={outcomes['db_error']}"
+        )
+        self.stdout.write(
+            f'  elapsed={elapsed:.3f}s throughput={attempts / elapsed:.1f} req/s '
+            f"successful={outcomes['success'] / elapsed:.1f} checkouts/s"
+        )
+        self.stdout.write(
+            f'  stock={stock} sold={sold} available={book.available_count} '
+            + (self.style.SUCCESS('no oversell') if consistent else self.style.ERROR('INCONSISTENT'))
+        )
+        book.delete()
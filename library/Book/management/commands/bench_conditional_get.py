@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from Accounts.models import CustomUser
+
+DEFAULT_URLS = ['/api/library/books/', '/api/library/categories/']
+
+
+class Command(BaseCommand):
+    help = 'مقایسه حجم و زمان پاسخ GET کامل با GET شرطی (If-None-Match) روی داده‌های فعلی'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', default=DEFAULT_URLS)
+        parser.add_argument('--username', help='کاربر درخواست‌ها (پیش‌فرض: اولین مدیر)')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['username']:
+            user = CustomUser.objects.filter(username=options['username']).first()
+        else:
+            user = CustomUser.objects.filter(user_type=CustomUser.UserType.ADMIN).first()
+        if user is None:
+            raise CommandError('کاربری برای اجرای بنچمارک پیدا نشد')
+
+        client = APIClient()
+        client.force_authenticate(user)
+        repeat = options['repeat']
+
+        for url in options['urls']:
+            first = client.get(url)
+            if first.status_code != 200 or not first.has_header('ETag'):
+                self.stderr.write(f'{url}: پاسخ {first.status_code} بدون ETag، رد شد')
+                continue
+
+            full = self._measure(client, url, repeat)
+            conditional = self._measure(client, url, repeat, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.stdout.write(url)
+            for label, (status_code, size, wall, cpu) in (('full', full), ('conditional', conditional)):
+                self.stdout.write(
+                    f'  {label:<12} status={status_code} bytes/req={size:>8} '
+                    f'wall={wall * 1000:8.3f}ms cpu={cpu * 1000:8.3f}ms'
+                )
+            saved = full[1] - conditional[1]
+            self.stdout.write(self.style.SUCCESS(
+                f'  saved {saved} bytes/req ({saved * repeat} bytes per {repeat} polls), '
+                f'cpu x{full[3] / conditional[3]:.1f}' if conditional[3] else f'  saved {saved} bytes/req'
+            ))
+
+    @staticmethod
+    def _measure(client, url, repeat, **headers):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        for _ in range(repeat):
+            response = client.get(url, **headers)
+        wall = (time.perf_counter() - wall_start) / repeat
+        cpu = (time.process_time() - cpu_start) / repeat
+        return response.status_code, len(response.content), wall, cpu
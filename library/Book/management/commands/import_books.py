@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Book.importers import DEFAULT_BATCH_SIZE, IMPORT_FORMATS, BookImporter, parse_rows
+
+
+class Command(BaseCommand):
+    help = 'ورود گروهی کتاب‌ها از فایل CSV یا JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='مسیر فایل ورودی')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='پیش‌فرض: از پسوند فایل')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=1, help='تعداد پروسس‌های اعتبارسنجی')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f'فرمت ورودی باید یکی از {", ".join(IMPORT_FORMATS)} باشد')
+
+        try:
+            with open(path, 'rb') as f:
+                rows = parse_rows(f.read(), import_format)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise CommandError(f'فایل قابل خواندن نیست: {e}')
+
+        if not isinstance(rows, list) or not rows:
+            raise CommandError('فایل هیچ ردیفی برای ورود ندارد (JSON باید لیست یا {"books": [...]} باشد)')
+
+        importer = BookImporter(batch_size=options['batch_size'], workers=options['workers'])
+        report = importer.run(rows)
+
+        for error in report['errors']:
+            self.stderr.write(f"ردیف {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['created']} کتاب از {report['total_rows']} ردیف ثبت شد، {report['failed']} ردیف خطا داشت."
+        ))
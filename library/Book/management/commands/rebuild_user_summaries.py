@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from Book.models import UserSummary
+
+
+class Command(BaseCommand):
+    help = 'بازسازی خلاصه قرض و خرید همه کاربران با یک کوئری گروه‌بندی شده روی تراکنش‌ها'
+
+    def handle(self, *args, **options):
+        rebuilt = UserSummary.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'خلاصه {rebuilt} کاربر بازسازی شد.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from Book.models import Category
+
+
+class Command(BaseCommand):
+    help = 'محاسبه مجدد شمارنده books_count همه دسته‌بندی‌ها با یک کوئری گروه‌بندی شده'
+
+    def handle(self, *args, **options):
+        changed = Category.reconcile_books_count()
+        self.stdout.write(self.style.SUCCESS(f'{changed} دسته‌بندی اصلاح شد.'))
@@ -0,0 +1,70 @@
+from django.db import migrations, OperationalError
+
+# نام‌ها و فیلدها عمداً اینجا تکرار شده‌اند (نه import از Book.search) تا تغییرات بعدی آن ماژول
+# تاریخچه مایگریشن‌ها را خراب نکند
+SQLITE_FTS_TABLE = 'book_book_fts'
+POSTGRES_FTS_INDEX = 'book_book_fts_gin'
+SEARCH_COLUMNS = 'title, author, description, isbn'
+NEW_VALUES = 'new.title, new.author, new.description, new.isbn'
+OLD_VALUES = 'old.title, old.author, old.description, old.isbn'
+POSTGRES_DOCUMENT = (
+    "to_tsvector('simple', coalesce(\"title\", '') || ' ' || coalesce(\"author\", '') || ' ' || "
+    "coalesce(\"description\", '') || ' ' || coalesce(\"isbn\", ''))"
+)
+
+
+def _sqlite_statements(book_table):
+    return [
+        f'CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5('
+        f"{SEARCH_COLUMNS}, content='{book_table}', content_rowid='id')",
+        # تریگرها ایندکس را با هر insert/update/delete (حتی bulk و queryset.update) همگام نگه می‌دارند
+        f'CREATE TRIGGER {SQLITE_FTS_TABLE}_ai AFTER INSERT ON "{book_table}" BEGIN '
+        f'INSERT INTO {SQLITE_FTS_TABLE}(rowid, {SEARCH_COLUMNS}) VALUES (new.id, {NEW_VALUES}); END',
+        f'CREATE TRIGGER {SQLITE_FTS_TABLE}_ad AFTER DELETE ON "{book_table}" BEGIN '
+        f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, {SEARCH_COLUMNS}) "
+        f"VALUES ('delete', old.id, {OLD_VALUES}); END",
+        f'CREATE TRIGGER {SQLITE_FTS_TABLE}_au AFTER UPDATE OF {SEARCH_COLUMNS} ON "{book_table}" BEGIN '
+        f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, {SEARCH_COLUMNS}) "
+        f"VALUES ('delete', old.id, {OLD_VALUES}); "
+        f'INSERT INTO {SQLITE_FTS_TABLE}(rowid, {SEARCH_COLUMNS}) VALUES (new.id, {NEW_VALUES}); END',
+        f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    book_table = apps.get_model('Book', 'Book')._meta.db_table
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        try:
+            for statement in _sqlite_statements(book_table):
+                schema_editor.execute(statement)
+        except OperationalError:
+            # SQLite بدون FTS5 کامپایل شده؛ فیلتر جستجو به icontains برمی‌گردد
+            pass
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX {POSTGRES_FTS_INDEX} ON "{book_table}" USING GIN ({POSTGRES_DOCUMENT})'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_FTS_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0002_alter_transaction_options_transaction_deadline_date_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:17
+
+from django.db import migrations, models
+
+
+def populate_books_count(apps, schema_editor):
+    Book = apps.get_model('Book', 'Book')
+    Category = apps.get_model('Book', 'Category')
+    counts = (
+        Book.objects.filter(category__isnull=False)
+        .values_list('category')
+        .annotate(total=models.Count('id'))
+        .order_by()
+    )
+    for category_id, total in counts:
+        Category.objects.filter(pk=category_id).update(books_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='تعداد کتاب\u200cها'),
+        ),
+        migrations.RunPython(populate_books_count, migrations.RunPython.noop),
+    ]
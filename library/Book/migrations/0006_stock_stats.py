@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0005_category_books_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_books', models.IntegerField(default=0, verbose_name='تعداد کل کتاب\u200cها')),
+                ('low_stock_books', models.IntegerField(default=0, verbose_name='کتاب\u200cهای کم\u200cموجود')),
+                ('out_of_stock_books', models.IntegerField(default=0, verbose_name='کتاب\u200cهای ناموجود')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'آمار موجودی',
+                'verbose_name_plural': 'آمار موجودی',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['available_count', 'id'], name='book_available_id_idx'),
+        ),
+    ]
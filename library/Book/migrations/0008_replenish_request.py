@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0007_transaction_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplenishRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان درخواست')),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='replenish_request', to='Book.book', verbose_name='کتاب')),
+            ],
+            options={
+                'verbose_name': 'درخواست پر کردن انبار',
+                'verbose_name_plural': 'درخواست\u200cهای پر کردن انبار',
+            },
+        ),
+    ]
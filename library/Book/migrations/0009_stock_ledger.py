@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0008_replenish_request'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField(verbose_name='تغییر')),
+                ('balance_after', models.IntegerField(verbose_name='موجودی بعد از تغییر')),
+                ('reason', models.CharField(choices=[('create', 'ایجاد کتاب'), ('delete', 'حذف کتاب'), ('checkout', 'قرض یا خرید'), ('return', 'بازگشت قرض'), ('replenish', 'پر کردن انبار'), ('adjust', 'اصلاح دستی'), ('import', 'ورود گروهی')], max_length=20, verbose_name='علت')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان')),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='Book.book', verbose_name='کتاب')),
+            ],
+            options={
+                'verbose_name': 'گردش موجودی',
+                'verbose_name_plural': 'گردش موجودی',
+                'indexes': [models.Index(fields=['book', 'created_at', 'id'], name='stock_move_book_time_idx'), models.Index(fields=['created_at'], name='stock_move_time_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available_count', models.IntegerField(verbose_name='موجودی')),
+                ('taken_at', models.DateTimeField(verbose_name='زمان')),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='Book.book', verbose_name='کتاب')),
+            ],
+            options={
+                'verbose_name': 'عکس موجودی',
+                'verbose_name_plural': 'عکس\u200cهای موجودی',
+                'constraints': [models.UniqueConstraint(fields=('book', 'taken_at'), name='stock_snapshot_book_time_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:36
+
+import django.db.models.deletion
+from django.conf import settings
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_user_summaries(apps, schema_editor):
+    Transaction = apps.get_model('Book', 'Transaction')
+    UserSummary = apps.get_model('Book', 'UserSummary')
+
+    loans = models.Q(transaction_type='loan')
+    purchases = models.Q(transaction_type='purchase')
+    rows = (
+        Transaction.objects.values('user_id')
+        .annotate(
+            open_loans=models.Count('id', filter=loans & models.Q(is_completed=False)),
+            # قرض‌های قبلی زمان بازگشت ندارند و دیرکرد حساب نمی‌شوند
+            overdue_loans=models.Count(
+                'id', filter=loans & models.Q(is_completed=True, returned_at__gt=models.F('deadline_date'))
+            ),
+            total_purchased=Coalesce(models.Sum('quantity', filter=purchases), 0),
+            total_spent=Coalesce(
+                models.Sum('total_price', filter=purchases), Decimal('0'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        .order_by()
+    )
+    UserSummary.objects.bulk_create([UserSummary(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0009_stock_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='returned_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='زمان بازگشت'),
+        ),
+        migrations.CreateModel(
+            name='UserSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('open_loans', models.IntegerField(default=0, verbose_name='قرض\u200cهای باز')),
+                ('overdue_loans', models.IntegerField(default=0, verbose_name='قرض\u200cهای دیرکرد')),
+                ('total_purchased', models.IntegerField(default=0, verbose_name='تعداد کتاب\u200cهای خریده شده')),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='مجموع پرداختی')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'خلاصه تراکنش\u200cهای کاربر',
+                'verbose_name_plural': 'خلاصه تراکنش\u200cهای کاربران',
+            },
+        ),
+        migrations.RunPython(populate_user_summaries, migrations.RunPython.noop),
+    ]
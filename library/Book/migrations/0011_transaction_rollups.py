@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Book', '0010_user_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_transaction_id', models.BigIntegerField(default=0, verbose_name='آخرین تراکنش اعمال شده')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'نشانگر خلاصه تراکنش\u200cها',
+                'verbose_name_plural': 'نشانگر خلاصه تراکنش\u200cها',
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'ساعتی'), ('day', 'روزانه')], max_length=4, verbose_name='بازه')),
+                ('bucket', models.DateTimeField(verbose_name='شروع بازه')),
+                ('category_id', models.IntegerField(blank=True, null=True, verbose_name='دسته\u200cبندی')),
+                ('transaction_type', models.CharField(choices=[('loan', 'قرض'), ('purchase', 'خرید')], max_length=10, verbose_name='نوع تراکنش')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='تعداد تراکنش')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='تعداد کتاب')),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='مجموع مبلغ')),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='Book.book', verbose_name='کتاب')),
+            ],
+            options={
+                'verbose_name': 'خلاصه زمانی تراکنش\u200cها',
+                'verbose_name_plural': 'خلاصه\u200cهای زمانی تراکنش\u200cها',
+                'indexes': [models.Index(fields=['granularity', 'bucket'], name='txn_rollup_time_idx'), models.Index(fields=['granularity', 'category_id', 'bucket'], name='txn_rollup_category_idx'), models.Index(fields=['granularity', 'book', 'bucket'], name='txn_rollup_book_idx')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'book', 'transaction_type'), name='txn_rollup_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,182 @@
+import hashlib
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+_plan_cache = {}
+
+
+def _loads_related_object(field):
+    """آیا فیلد سریالایزر خود شیء مرتبط را می‌خواند (نه فقط کلید آن)؟"""
+    if isinstance(field, (serializers.BaseSerializer, serializers.ManyRelatedField)):
+        return True
+    if isinstance(field, serializers.RelatedField):
+        return not field.use_pk_only_optimization()
+    return False
+
+
+def _nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child
+    if isinstance(field, serializers.Serializer):
+        return field
+    return None
+
+
+def _collect_paths(serializer, model, prefix, prefetching, select, prefetch):
+    for field in serializer.fields.values():
+        if field.source in (None, '*') or field.write_only:
+            continue
+
+        parts = field.source.split('.')
+        current_model, path, is_prefetch = model, list(prefix), prefetching
+        for index, part in enumerate(parts):
+            try:
+                model_field = current_model._meta.get_field(part)
+            except FieldDoesNotExist:
+                break
+            if not model_field.is_relation:
+                break
+
+            is_last = index == len(parts) - 1
+            if is_last and not _loads_related_object(field):
+                break
+
+            path.append(part)
+            if model_field.many_to_many or model_field.one_to_many:
+                is_prefetch = True
+            (prefetch if is_prefetch else select).add('__'.join(path))
+            current_model = model_field.related_model
+
+            nested = _nested_serializer(field) if is_last else None
+            if nested is not None:
+                _collect_paths(nested, current_model, path, is_prefetch, select, prefetch)
+
+
+def get_eager_loading_plan(serializer_class, model):
+    """
+    استخراج مسیرهای select_related/prefetch_related از source های نقطه‌دار سریالایزر
+    (مثلاً book.category.name ← select_related('book__category')).
+    """
+    key = (serializer_class, model)
+    if key not in _plan_cache:
+        select, prefetch = set(), set()
+        _collect_paths(serializer_class(), model, [], False, select, prefetch)
+        # مسیرهایی که پیشوند مسیر دیگری هستند لازم نیستند
+        select = {path for path in select if not any(other.startswith(path + '__') for other in select)}
+        _plan_cache[key] = (tuple(sorted(select)), tuple(sorted(prefetch)))
+    return _plan_cache[key]
+
+
+def _is_deferred(queryset, path):
+    field_names, defer = queryset.query.deferred_loading
+    root = path.split('__', 1)[0]
+    if defer:
+        return root in field_names
+    return bool(field_names) and root not in field_names
+
+
+class EagerLoadingMixin:
+    """
+    میکسین ویوست که بر اساس سریالایزر اکشن جاری، select_related/prefetch_related لازم
+    را خودکار روی کوئری اعمال می‌کند تا لیست‌ها N+1 نشوند.
+    در filter_queryset اعمال می‌شود تا بعد از only/defer های get_queryset قرار بگیرد.
+    """
+
+    def filter_queryset(self, queryset):
+        return self.apply_eager_loading(super().filter_queryset(queryset))
+
+    def apply_eager_loading(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        select, prefetch = get_eager_loading_plan(serializer_class, queryset.model)
+
+        # روابطی که با only/defer کنار گذاشته شده‌اند قابل select_related نیستند
+        select = [path for path in select if not _is_deferred(queryset, path)]
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+    default_detail = ''
+
+
+class ConditionalGetMixin:
+    """
+    پشتیبانی از GET شرطی (ETag و Last-Modified) برای list و retrieve.
+    اعتبارسنج‌ها قبل از اجرای اکشن با یک کوئری سبک (MAX(updated_at) و COUNT برای لیست،
+    updated_at برای جزئیات) حساب می‌شوند و در صورت تطابق، 304 بدون سریالایز برگردانده می‌شود.
+    """
+    conditional_actions = ('list', 'retrieve')
+    # زمان تغییر روابطی که در خروجی سریالایزر می‌آیند (مثلاً نام دسته‌بندی کتاب)
+    conditional_related_timestamps = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._conditional_validators = None
+        if request.method in ('GET', 'HEAD') and self.action in self.conditional_actions:
+            self._conditional_validators = self.get_conditional_validators(request, *args, **kwargs)
+            if self._conditional_validators and self._is_not_modified(request, *self._conditional_validators):
+                raise NotModified()
+
+    def get_conditional_validators(self, request, *args, **kwargs):
+        if self.action == 'list':
+            aggregates = {'last_modified': Max('updated_at'), 'count': Count('pk')}
+            for index, path in enumerate(self.conditional_related_timestamps):
+                aggregates[f'related_{index}'] = Max(path)
+            values = self.filter_queryset(self.get_queryset()).aggregate(**aggregates)
+            count = values.pop('count')
+            timestamps = [value for value in values.values() if value]
+            state = [count] + [value.isoformat() if value else None for value in values.values()]
+        else:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            lookup = {self.lookup_field: kwargs[lookup_url_kwarg]}
+            fields = ['updated_at', *self.conditional_related_timestamps]
+            try:
+                row = self.get_queryset().filter(**lookup).values_list(*fields).first()
+            except (TypeError, ValueError):
+                return None
+            if row is None:
+                # 404 در مسیر عادی اکشن برگردانده می‌شود
+                return None
+            timestamps = [value for value in row if value]
+            state = [value.isoformat() if value else None for value in row]
+
+        role = getattr(request.user, 'user_type', None) or 'anonymous'
+        raw = f'{request.get_full_path()}|{role}|{state}'
+        etag = quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+        return etag, max(timestamps) if timestamps else None
+
+    @staticmethod
+    def _is_not_modified(request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or any(value.removeprefix('W/') == etag for value in etags)
+
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since is not None and last_modified is not None:
+            return int(last_modified.timestamp()) <= if_modified_since
+        return False
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, '_conditional_validators', None)
+        if validators and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
@@ -0,0 +1,124 @@
+import json
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+def _invert(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _encode_value(value):
+    # datetime کامل (با میکروثانیه) نگه داشته می‌شود تا ردیف‌های هم‌زمان جا نیفتند
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(CursorPagination):
+    """
+    صفحه‌بندی keyset روی چند ستون (مثلاً created_at,id).
+    به جای OFFSET و COUNT، هر صفحه با شرط «بعد از آخرین ردیف صفحه قبل» خوانده می‌شود،
+    پس هزینه صفحه N با صفحه اول برابر است. ستون آخر ترتیب باید یکتا باشد.
+    """
+    ordering = ('-created_at', '-id')
+    unique_field = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # اگر فیلترها (مثلاً ترتیب بر اساس ارتباط در جستجو) ترتیب صریحی گذاشته‌اند همان حفظ می‌شود
+        explicit = queryset.query.order_by
+        if explicit and all(isinstance(field, str) and '__' not in field for field in explicit):
+            ordering = tuple(explicit)
+        else:
+            ordering = tuple(super().get_ordering(request, queryset, view))
+
+        if not any(field.lstrip('-') in (self.unique_field, 'pk') for field in ordering):
+            ordering += (self.unique_field,)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self._decode_position(self.cursor.position) if self.cursor else None
+
+        ordering = [_invert(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._position(self.page[0])))
+
+    def _position(self, instance):
+        values = [_encode_value(getattr(instance, field.lstrip('-'))) for field in self.ordering]
+        return json.dumps(values, separators=(',', ':'))
+
+    def _decode_position(self, position):
+        if position is None:
+            return None
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def _after(ordering, values):
+        """شرط مقایسه لغت‌نامه‌ای (a, b) > (x, y) با رعایت جهت هر ستون"""
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[index]})
+            for previous, value in zip(ordering[:index], values[:index]):
+                clause &= Q(**{previous.lstrip('-'): value})
+            condition |= clause
+        return condition
+
+
+class BookKeysetPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+
+class BookPriceKeysetPagination(KeysetPagination):
+    """ترتیب پیش‌فرض BookViewSet"""
+    ordering = ('-price', 'id')
+
+
+class TransactionKeysetPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
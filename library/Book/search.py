@@ -0,0 +1,113 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+# فیلدهایی که در ایندکس متنی کتاب‌ها قرار می‌گیرند
+BOOK_SEARCH_FIELDS = ['title', 'author', 'description', 'isbn']
+
+# جدول مجازی FTS5 در SQLite (محتوای آن از جدول کتاب‌ها خوانده می‌شود)
+SQLITE_FTS_TABLE = 'book_book_fts'
+
+# نام ایندکس GIN در PostgreSQL
+POSTGRES_FTS_INDEX = 'book_book_fts_gin'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_table_cache = {}
+
+
+def postgres_document_sql(table=None):
+    """
+    سند متنی هر کتاب در PostgreSQL.
+    ایندکس و کوئری باید دقیقاً همین عبارت را استفاده کنند تا ایندکس GIN به کار برود.
+    """
+    prefix = f'"{table}".' if table else ''
+    columns = " || ' ' || ".join(
+        f"coalesce({prefix}\"{field}\", '')" for field in BOOK_SEARCH_FIELDS
+    )
+    return f"to_tsvector('simple', {columns})"
+
+
+def tokenize(search_text):
+    """تبدیل عبارت جستجو به توکن‌های امن برای موتور جستجوی متنی"""
+    return _TOKEN_RE.findall(search_text or '')
+
+
+def sqlite_fts_available(conn=None):
+    """بررسی وجود جدول FTS5 (ممکن است SQLite بدون FTS5 کامپایل شده باشد)"""
+    conn = conn or connection
+    cache_key = (conn.alias, conn.settings_dict['NAME'])
+    if cache_key not in _fts_table_cache:
+        with conn.cursor() as cursor:
+            _fts_table_cache[cache_key] = SQLITE_FTS_TABLE in conn.introspection.table_names(cursor)
+    return _fts_table_cache[cache_key]
+
+
+class BookFullTextSearchFilter(filters.SearchFilter):
+    """
+    جستجوی متنی کتاب‌ها با ایندکس FTS5 (SQLite) یا tsvector/GIN (PostgreSQL).
+    نتایج بر اساس میزان ارتباط مرتب می‌شوند مگر اینکه کاربر ordering ارسال کند.
+    روی دیتابیس‌های دیگر به همان جستجوی icontains معمولی برمی‌گردد.
+    """
+
+    def get_search_fields(self, view, request):
+        return BOOK_SEARCH_FIELDS
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = []
+        for term in self.get_search_terms(request):
+            tokens.extend(tokenize(term))
+        if not tokens:
+            return queryset
+
+        vendor = connection.vendor
+        if vendor == 'sqlite' and sqlite_fts_available():
+            queryset = self._filter_sqlite(queryset, tokens)
+        elif vendor == 'postgresql':
+            queryset = self._filter_postgres(queryset, tokens)
+        else:
+            return super().filter_queryset(request, queryset, view)
+
+        if api_settings.ORDERING_PARAM not in request.query_params:
+            queryset = queryset.order_by('-search_rank', 'id')
+        return queryset
+
+    def _filter_sqlite(self, queryset, tokens):
+        # هر توکن به صورت پیشوندی جستجو می‌شود و همه توکن‌ها باید وجود داشته باشند
+        match = ' '.join('"%s"*' % token for token in tokens)
+        book_table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s',
+                [match],
+            )
+        ).annotate(
+            # bm25 هرچه کمتر باشد مرتبط‌تر است؛ با منفی کردن، ترتیب نزولی مثل PostgreSQL می‌شود
+            search_rank=RawSQL(
+                f'SELECT -bm25({SQLITE_FTS_TABLE}) FROM {SQLITE_FTS_TABLE} '
+                f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = "{book_table}"."id"',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+    def _filter_postgres(self, queryset, tokens):
+        query = ' & '.join('%s:*' % token for token in tokens)
+        document = postgres_document_sql(queryset.model._meta.db_table)
+        return queryset.filter(
+            RawSQL(
+                f"{document} @@ to_tsquery('simple', %s)",
+                [query],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"ts_rank({document}, to_tsquery('simple', %s))",
+                [query],
+                output_field=FloatField(),
+            )
+        )
@@ -1,15 +1,15 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Category, Book, Transaction, Inventory
+from .analytics import GROUP_BY_FIELDS
+from .models import Category, Book, Transaction, Inventory, TransactionRollup, UserSummary
 
 class CategorySerializer(serializers.ModelSerializer):
-    books_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'books_count', 'created_at']
-    
-    def get_books_count(self, obj):
-        return obj.books.count()
+        read_only_fields = ['books_count']
 
 class BookSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -43,6 +43,10 @@ class BookRequestSerializer(serializers.Serializer):
     quantity = serializers.IntegerField(min_value=1, default=1)
 
 
+class CartCheckoutSerializer(serializers.Serializer):
+    items = BookRequestSerializer(many=True, allow_empty=False, max_length=100)
+
+
 class InventorySerializer(serializers.ModelSerializer):
     book_title = serializers.CharField(source='book.title', read_only=True)
     
@@ -70,3 +74,53 @@ class BookStockUpdateSerializer(serializers.ModelSerializer):
 
 
 
+
+
+class BookImportSerializer(serializers.ModelSerializer):
+    """
+    اعتبارسنجی ردیف‌های ورود گروهی کتاب.
+    category فقط به صورت عدد بررسی می‌شود و وجود آن یک‌جا برای کل دسته بررسی می‌شود،
+    پس این سریالایزر به دیتابیس دسترسی ندارد و در پروسس‌های جدا هم قابل اجراست.
+    """
+    category = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta:
+        model = Book
+        fields = [
+            'title', 'author', 'description', 'category', 'total_count',
+            'available_count', 'price', 'isbn', 'published_date'
+        ]
+
+    def validate(self, data):
+        available = data.get('available_count', Book._meta.get_field('available_count').default)
+        total = data.get('total_count', Book._meta.get_field('total_count').default)
+        if available > total:
+            raise serializers.ValidationError("تعداد موجود نمی‌تواند از تعداد کل بیشتر باشد")
+        return data
+
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserSummary
+        fields = ['open_loans', 'overdue_loans', 'total_purchased', 'total_spent']
+
+
+class TransactionAnalyticsQuerySerializer(serializers.Serializer):
+    MAX_HOURLY_RANGE = timedelta(days=31)
+
+    granularity = serializers.ChoiceField(choices=TransactionRollup.GRANULARITIES, default=TransactionRollup.DAY)
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    group_by = serializers.ChoiceField(choices=list(GROUP_BY_FIELDS), default='none')
+    transaction_type = serializers.ChoiceField(choices=Book.TRANSACTION_TYPES, required=False)
+    category = serializers.IntegerField(required=False)
+    book = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.now())
+        data.setdefault('start', data['end'] - timedelta(days=30))
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError({'start': 'شروع بازه باید قبل از پایان آن باشد'})
+        if data['granularity'] == TransactionRollup.HOUR and data['end'] - data['start'] > self.MAX_HOURLY_RANGE:
+            raise serializers.ValidationError({'start': 'بازه گزارش ساعتی حداکثر 31 روز است'})
+        return data
@@ -1,6 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Book, Transaction, Inventory
+from .models import Book, Category, Transaction, Inventory, ReplenishRequest, UserSummary
+from .cache import bump_catalog_version_on_commit
+from .stock import StockChange, record_stock_changes
+from .tasks import schedule_loan_expiry
 
 @receiver(post_save, sender=Book)
 def create_inventory_for_book(sender, instance, created, **kwargs):
@@ -10,8 +13,62 @@ def create_inventory_for_book(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Transaction)
 def auto_replenish_after_transaction(sender, instance, created, **kwargs):
     if created and instance.transaction_type == Book.PURCHASE:
-        try:
-            inventory = Inventory.objects.get(book=instance.book)
-            inventory.check_and_replenish()
-        except Inventory.DoesNotExist:
-            pass
\ No newline at end of file
+        # بررسی انبار در پس‌زمینه (drain_replenish_requests_task) انجام می‌شود، نه داخل درخواست خرید
+        ReplenishRequest.record([instance.book_id])
+
+@receiver(post_save, sender=Transaction)
+def update_user_summary(sender, instance, created, **kwargs):
+    if created:
+        UserSummary.apply_deltas(UserSummary.transaction_deltas([instance]))
+
+@receiver(post_save, sender=Transaction)
+def schedule_loan_expiry_after_transaction(sender, instance, created, **kwargs):
+    if created and instance.transaction_type == Book.LOAN:
+        schedule_loan_expiry([instance])
+
+@receiver(post_save, sender=Book)
+def update_category_books_count(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        Category.apply_books_count_deltas({instance.category_id: 1})
+    elif update_fields is None or 'category' in update_fields or 'category_id' in update_fields:
+        # اگر category_id هنگام خواندن لود نشده باشد (only/defer) تغییری قابل تشخیص نیست
+        if hasattr(instance, '_loaded_category_id'):
+            old_category_id = instance._loaded_category_id
+            if old_category_id != instance.category_id:
+                Category.apply_books_count_deltas({old_category_id: -1, instance.category_id: 1})
+    instance._loaded_category_id = instance.category_id
+
+@receiver(post_delete, sender=Book)
+def decrease_category_books_count(sender, instance, **kwargs):
+    if 'category_id' in instance.get_deferred_fields():
+        # دسته‌بندی لود نشده؛ با reconcile_category_counts اصلاح می‌شود
+        return
+    Category.apply_books_count_deltas({instance.category_id: -1})
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version_on_commit()
+
+
+@receiver(post_save, sender=Book)
+def update_stock_stats(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        record_stock_changes([StockChange(instance.pk, None, instance.available_count)])
+    elif update_fields is None or 'available_count' in update_fields:
+        old_available = getattr(instance, '_loaded_available_count', None)
+        if old_available is not None and old_available != instance.available_count:
+            record_stock_changes([StockChange(instance.pk, old_available, instance.available_count)])
+    instance._loaded_available_count = instance.available_count
+
+@receiver(post_delete, sender=Book)
+def remove_from_stock_stats(sender, instance, **kwargs):
+    if 'available_count' in instance.get_deferred_fields():
+        # مقدار موجودی لود نشده؛ اختلاف در reconcile دوره‌ای اصلاح می‌شود
+        return
+    record_stock_changes([StockChange(instance.pk, instance.available_count, None)])
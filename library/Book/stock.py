@@ -0,0 +1,101 @@
+from collections import namedtuple
+
+from django.utils import timezone
+
+from .models import (
+    Book, StockMovement, StockSnapshot, StockStats, current_stock_change_reason, stock_change_reason,
+)
+
+# old_available برابر None یعنی کتاب تازه ساخته شده و new_available برابر None یعنی حذف شده
+StockChange = namedtuple('StockChange', ['book_id', 'old_available', 'new_available'])
+
+
+def _buckets(available):
+    if available is None:
+        return 0, 0, 0
+    return 1, int(available < StockStats.LOW_STOCK_THRESHOLD), int(available == 0)
+
+
+def _movement(change, reason, now):
+    if reason is None:
+        if change.old_available is None:
+            reason = StockMovement.CREATE
+        elif change.new_available is None:
+            reason = StockMovement.DELETE
+        else:
+            reason = StockMovement.ADJUST
+    balance = change.new_available or 0
+    return StockMovement(
+        book_id=change.book_id,
+        delta=balance - (change.old_available or 0),
+        balance_after=balance,
+        reason=reason,
+        created_at=now,
+    )
+
+
+def record_stock_changes(changes, reason=None):
+    """
+    ثبت یک یا چند تغییر موجودی؛ همه مسیرهای تغییر موجودی (save معمولی از طریق سیگنال
+    و مسیرهای bulk به صورت مستقیم) باید از این تابع استفاده کنند.
+    آمار داشبورد به‌روز و برای هر تغییر یک ردیف StockMovement با یک bulk_create ثبت می‌شود.
+    """
+    changes = list(changes)
+    reason = reason or current_stock_change_reason()
+    now = timezone.now()
+
+    delta = [0, 0, 0]
+    movements = []
+    for change in changes:
+        old, new = _buckets(change.old_available), _buckets(change.new_available)
+        for index in range(3):
+            delta[index] += new[index] - old[index]
+        if change.old_available != change.new_available:
+            movements.append(_movement(change, reason, now))
+    StockStats.apply_delta(*delta)
+    StockMovement.objects.bulk_create(movements)
+
+
+# exact=False یعنی گردش‌های اطراف at فشرده شده‌اند و مقدار، موجودی لحظه as_of (زمان نزدیک‌ترین عکس) است
+StockAt = namedtuple('StockAt', ['available_count', 'as_of', 'exact'])
+
+
+def stock_at(book_id, at):
+    """
+    موجودی در دسترس یک کتاب در لحظه at. گردش‌های نگه داشته شده دقیق‌اند (balance_after مطلق است)؛
+    در بازه‌ای که فشرده شده فقط موجودی لحظه‌های StockSnapshot معلوم است و همان با exact=False برمی‌گردد.
+    هر مرحله فقط یک جستجوی ایندکس است.
+    """
+    movement = (
+        StockMovement.objects.filter(book_id=book_id, created_at__lte=at)
+        .order_by('-created_at', '-id').values_list('balance_after', flat=True).first()
+    )
+    if movement is not None:
+        # فشرده‌سازی همه گردش‌های قبل از cutoff را حذف می‌کند، پس گردش باقی‌مانده و بعد از آن کامل‌اند
+        return StockAt(movement, at, True)
+
+    snapshots = StockSnapshot.objects.filter(book_id=book_id)
+    previous = snapshots.filter(taken_at__lte=at).order_by('-taken_at').values_list('available_count', 'taken_at').first()
+    following = snapshots.filter(taken_at__gt=at).order_by('taken_at').values_list('available_count', 'taken_at').first()
+    if previous is not None:
+        # بدون عکس بعدی، بعد از previous گردشی حذف نشده و موجودی تا اولین گردش باقی‌مانده ثابت است
+        if following is None:
+            return StockAt(previous[0], at, True)
+        return StockAt(previous[0], previous[1], False)
+    if following is not None:
+        # کل تاریخچه تا عکس بعدی فشرده شده است
+        return StockAt(following[0], following[1], False)
+
+    # قبل از اولین گردش ثبت شده: موجودی قبل از اولین گردش بعد از at
+    next_movement = (
+        StockMovement.objects.filter(book_id=book_id, created_at__gt=at)
+        .order_by('created_at', 'id').values_list('balance_after', 'delta', 'reason').first()
+    )
+    if next_movement is not None:
+        balance_after, delta, reason = next_movement
+        # کتاب هنوز ساخته نشده بود
+        if reason in (StockMovement.CREATE, StockMovement.IMPORT):
+            return StockAt(None, at, True)
+        return StockAt(balance_after - delta, at, True)
+
+    return StockAt(Book.objects.filter(pk=book_id).values_list('available_count', flat=True).first(), at, True)
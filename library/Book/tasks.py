@@ -1,31 +1,317 @@
 # Book/tasks.py
+import logging
+from collections import Counter
+
+from datetime import timedelta
+
+from django.conf import settings
 from django.utils import timezone
 from celery import shared_task
-from .models import Transaction, Book
+from django.db.models import Case, F, Max, Min, PositiveIntegerField, Value, When
+from .models import (
+    Transaction, Book, Inventory, ReplenishRequest, StockMovement, StockSnapshot, StockStats, UserSummary,
+)
+from .analytics import ROLLUP_BATCH_SIZE, rollup_next_batch
+from .cache import bump_catalog_version_on_commit
+from .stock import StockChange, record_stock_changes
 from django.db import transaction
 
+logger = logging.getLogger(__name__)
+
+# تعداد تراکنش‌هایی که در هر تکه با یک UPDATE بازگردانده می‌شوند
+AUTO_RETURN_CHUNK_SIZE = 1000
+# تعداد درخواست‌های پر کردن انبار که در هر دسته پردازش می‌شوند
+REPLENISH_BATCH_SIZE = 500
+# تعداد کتاب‌هایی که گردش موجودی آن‌ها در هر دسته فشرده می‌شود
+STOCK_COMPACTION_BATCH_SIZE = 500
+
+
+def overdue_loans(now, book_id_min=None, book_id_max=None):
+    """تراکنش‌های قرضی (LOAN) که تکمیل نشده‌اند و مهلت آن‌ها گذشته است"""
+    queryset = Transaction.objects.filter(
+        transaction_type=Book.LOAN,
+        is_completed=False,
+        deadline_date__lte=now
+    )
+    if book_id_min is not None:
+        queryset = queryset.filter(book_id__gte=book_id_min)
+    if book_id_max is not None:
+        queryset = queryset.filter(book_id__lte=book_id_max)
+    return queryset
+
+
+def _return_loans(rows, now):
+    """
+    بازگرداندن قرض‌های قفل شده (id, book_id, quantity, user_id) با یک UPDATE برای تکمیل تراکنش‌ها
+    و یک UPDATE با CASE برای افزایش موجودی همه کتاب‌های مربوط.
+    """
+    if not rows:
+        return 0
+
+    # قرض در لحظه پایان مهلت پس گرفته شده است؛ تأخیر اجرای تسک دیرکرد کاربر حساب نمی‌شود
+    Transaction.objects.filter(pk__in=[row[0] for row in rows]).update(
+        is_completed=True, returned_at=F('deadline_date')
+    )
+
+    returned = Counter()
+    loans_per_user = Counter()
+    for _, book_id, quantity, user_id in rows:
+        returned[book_id] += quantity
+        loans_per_user[user_id] += 1
+
+    # قفل کتاب‌ها به ترتیب id برای جلوگیری از deadlock و خواندن موجودی قبلی برای آمار
+    previous = dict(
+        Book.objects.select_for_update().filter(pk__in=returned).order_by('id')
+        .values_list('id', 'available_count')
+    )
+    Book.objects.filter(pk__in=returned).update(
+        available_count=F('available_count') + Case(
+            *[When(pk=book_id, then=Value(quantity)) for book_id, quantity in returned.items()],
+            default=Value(0),
+            output_field=PositiveIntegerField(),
+        ),
+        updated_at=now,
+    )
+
+    record_stock_changes(
+        (
+            StockChange(book_id, previous[book_id], previous[book_id] + quantity)
+            for book_id, quantity in returned.items() if book_id in previous
+        ),
+        reason=StockMovement.RETURN,
+    )
+    UserSummary.apply_deltas({
+        user_id: (-count, 0, 0, 0) for user_id, count in loans_per_user.items()
+    })
+    bump_catalog_version_on_commit()
+    return len(rows)
+
+
+@transaction.atomic
+def return_overdue_chunk(now, chunk_size=AUTO_RETURN_CHUNK_SIZE, book_id_min=None, book_id_max=None):
+    """
+    بازگرداندن یک تکه از قرض‌های منقضی به صورت set-based.
+    هر تکه جداگانه commit می‌شود، پس اجرای قطع شده با اجرای دوباره از همان‌جا ادامه پیدا می‌کند.
+    """
+    # skip_locked باعث می‌شود worker های هم‌زمان روی ردیف‌های یکسان منتظر هم نمانند
+    rows = list(
+        overdue_loans(now, book_id_min, book_id_max)
+        .select_for_update(skip_locked=True)
+        .order_by('deadline_date', 'id')
+        .values_list('id', 'book_id', 'quantity', 'user_id')[:chunk_size]
+    )
+    return _return_loans(rows, now)
+
+
 # این وظیفه باید در settings.py تنظیم شود تا Celery Beat آن را اجرا کند.
 @shared_task
-def auto_return_loaned_books_task():
+def auto_return_loaned_books_task(book_id_min=None, book_id_max=None, chunk_size=AUTO_RETURN_CHUNK_SIZE):
     """
-    وظیفه زمانبندی شده برای بررسی تراکنش‌های قرضی ناتمام و منقضی شده (1 روز).
+    وظیفه زمانبندی شده برای بازگرداندن تراکنش‌های قرضی ناتمام و منقضی شده.
+    با book_id_min/book_id_max فقط یک بازه از کتاب‌ها پردازش می‌شود (برای تقسیم بین worker ها).
     """
-    
-    # پیدا کردن تراکنش‌های قرضی (LOAN) که تکمیل نشده‌اند و مهلت آن‌ها گذشته است.
-    # deadline_date__lte=timezone.now()
-    overdue_transactions = Transaction.objects.filter(
-        transaction_type=Book.LOAN,
-        is_completed=False,
-        deadline_date__lte=timezone.now() 
-    ).select_related('book') # بهینه‌سازی: لود همزمان book
-    
+    # زمان ثابت برای کل اجرا تا قرض‌هایی که حین اجرا منقضی می‌شوند حلقه را بی‌پایان نکنند
+    now = timezone.now()
     returned_count = 0
-    
-    for trans in overdue_transactions:
-        # فراخوانی متد اتمیک return_books از مدل
-        if trans.return_books(): 
-            returned_count += 1
-            
+
+    # با skip_locked یک تکه ممکن است کوتاه برگردد در حالی که قرض منقضی دیگری باقی است؛
+    # فقط تکه خالی یعنی چیزی (جز ردیف‌های قفل شده توسط worker دیگر) باقی نمانده
+    while True:
+        count = return_overdue_chunk(now, chunk_size, book_id_min, book_id_max)
+        returned_count += count
+        if not count:
+            break
+
     # این خروجی فقط برای لاگ Celery Worker است
     print(f"وظیفه بازگشت خودکار کتاب‌ها تکمیل شد. تعداد بازگشتی: {returned_count}")
-    return returned_count
\ No newline at end of file
+    return returned_count
+
+
+@shared_task
+def fan_out_auto_return_task(shards=4, chunk_size=AUTO_RETURN_CHUNK_SIZE):
+    """
+    تقسیم صف بزرگ قرض‌های منقضی بین چند worker بر اساس بازه id کتاب.
+    """
+    bounds = overdue_loans(timezone.now()).aggregate(low=Min('book_id'), high=Max('book_id'))
+    if bounds['low'] is None:
+        return 0
+
+    low, high = bounds['low'], bounds['high']
+    step = max((high - low + 1) // shards, 1)
+    ranges = []
+    start = low
+    while start <= high:
+        end = min(start + step - 1, high)
+        if len(ranges) == shards - 1:
+            end = high
+        ranges.append((start, end))
+        start = end + 1
+
+    for book_id_min, book_id_max in ranges:
+        auto_return_loaned_books_task.delay(book_id_min, book_id_max, chunk_size)
+    return len(ranges)
+
+
+@shared_task
+def expire_loan_task(transaction_id):
+    """
+    بازگرداندن یک قرض درست در زمان پایان مهلت آن (با ETA در صف Celery زمانبندی می‌شود).
+    تکرار اجرا بی‌اثر است؛ قرضی که قبلاً برگشته یا هنوز مهلتش نرسیده تغییری نمی‌کند.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            overdue_loans(now).filter(pk=transaction_id)
+            .select_for_update()
+            .values_list('id', 'book_id', 'quantity', 'user_id')
+        )
+        returned = _return_loans(rows, now)
+
+    if not returned:
+        # اجرای زودتر از موعد (مثلاً اختلاف ساعت worker)؛ دوباره برای زمان مهلت زمانبندی می‌شود
+        loan = Transaction.objects.filter(
+            pk=transaction_id, transaction_type=Book.LOAN, is_completed=False, deadline_date__gt=now
+        ).only('id', 'deadline_date').first()
+        if loan is not None:
+            expire_loan_task.apply_async((loan.pk,), eta=loan.deadline_date)
+    return returned
+
+
+def schedule_loan_expiry(loans):
+    """
+    زمانبندی بازگشت خودکار هر قرض در لحظه پایان مهلت، بعد از commit تراکنش دیتابیس.
+    اگر صف در دسترس نباشد، قرض در اجرای دوره‌ای auto_return_loaned_books_task برمی‌گردد.
+    """
+    if not settings.LIBRARY_LOAN_EXPIRY_ETA:
+        return
+    pending = [
+        (loan.pk, loan.deadline_date) for loan in loans
+        if loan.transaction_type == Book.LOAN and loan.deadline_date and not loan.is_completed
+    ]
+    if not pending:
+        return
+
+    def enqueue():
+        for transaction_id, deadline_date in pending:
+            try:
+                expire_loan_task.apply_async((transaction_id,), eta=deadline_date)
+            except Exception:
+                logger.warning('زمانبندی بازگشت خودکار قرض %s ممکن نشد', transaction_id, exc_info=True)
+
+    transaction.on_commit(enqueue)
+
+
+def replenish_books(book_ids):
+    """
+    پر کردن انبار چند کتاب به صورت دسته‌ای: قفل کتاب‌ها به ترتیب id، محاسبه در حافظه
+    و ذخیره همه تغییرات با bulk_update.
+    """
+    now = timezone.now()
+    books = list(
+        Book.objects.select_for_update()
+        .filter(pk__in=book_ids, inventory__auto_replenish=True)
+        .select_related('inventory')
+        .order_by('id')
+    )
+
+    changed_books, changed_inventories, changes = [], [], []
+    for book in books:
+        inventory = book.inventory
+        quantity = inventory.replenish_quantity()
+        if not quantity:
+            continue
+        changes.append(StockChange(book.pk, book.available_count, book.available_count + quantity))
+        book.available_count += quantity
+        book.total_count -= quantity
+        book.updated_at = now
+        inventory.last_replenished = now
+        changed_books.append(book)
+        changed_inventories.append(inventory)
+
+    if changed_books:
+        Book.objects.bulk_update(changed_books, ['available_count', 'total_count', 'updated_at'])
+        Inventory.objects.bulk_update(changed_inventories, ['last_replenished'])
+        record_stock_changes(changes, reason=StockMovement.REPLENISH)
+        bump_catalog_version_on_commit()
+    return len(changed_books)
+
+
+@shared_task
+def drain_replenish_requests_task(batch_size=REPLENISH_BATCH_SIZE):
+    """
+    پردازش صف ReplenishRequest در دسته‌های batch_size؛ هر دسته در تراکنش جداگانه
+    بررسی و سپس از صف حذف می‌شود. خروجی تعداد کتاب‌هایی است که انبارشان پر شد.
+    """
+    replenished = 0
+    while True:
+        with transaction.atomic():
+            pending = list(
+                ReplenishRequest.objects.select_for_update(skip_locked=True)
+                .order_by('id')
+                .values_list('id', 'book_id')[:batch_size]
+            )
+            if not pending:
+                break
+            replenished += replenish_books([book_id for _, book_id in pending])
+            ReplenishRequest.objects.filter(pk__in=[pk for pk, _ in pending]).delete()
+        if len(pending) < batch_size:
+            break
+    return replenished
+
+
+@shared_task
+def compact_stock_movements_task(retention_days=None, batch_size=STOCK_COMPACTION_BATCH_SIZE):
+    """
+    فشرده‌سازی دفتر گردش موجودی: برای هر کتاب که گردش قدیمی‌تر از دوره نگهداری دارد، موجودی لحظه
+    cutoff در StockSnapshot ثبت و آن گردش‌ها حذف می‌شوند. هر دسته کتاب در تراکنش جداگانه.
+    """
+    retention_days = retention_days or settings.STOCK_LEDGER_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    compacted = 0
+    last_book_id = 0
+
+    while True:
+        with transaction.atomic():
+            latest = dict(
+                StockMovement.objects.filter(created_at__lte=cutoff, book_id__gt=last_book_id)
+                .values('book_id')
+                .annotate(last_id=Max('id'))
+                .order_by('book_id')
+                .values_list('book_id', 'last_id')[:batch_size]
+            )
+            if not latest:
+                break
+
+            balances = StockMovement.objects.filter(pk__in=latest.values()).values_list('book_id', 'balance_after')
+            StockSnapshot.objects.bulk_create(
+                [StockSnapshot(book_id=book_id, available_count=balance, taken_at=cutoff) for book_id, balance in balances],
+                ignore_conflicts=True,
+            )
+            deleted, _ = StockMovement.objects.filter(book_id__in=list(latest), created_at__lte=cutoff).delete()
+            compacted += deleted
+            last_book_id = max(latest)
+        if len(latest) < batch_size:
+            break
+    return compacted
+
+
+@shared_task
+def rollup_transactions_task(batch_size=ROLLUP_BATCH_SIZE):
+    """اعمال تراکنش‌های جدید (بعد از نشانگر) در خلاصه‌های ساعتی و روزانه، دسته به دسته"""
+    processed = 0
+    while True:
+        count = rollup_next_batch(batch_size)
+        processed += count
+        if count < batch_size:
+            break
+    return processed
+
+
+@shared_task
+def reconcile_stock_stats_task():
+    """
+    محاسبه مجدد آمار موجودی داشبورد برای اصلاح اختلاف‌های احتمالی
+    (مثلاً تغییرات مستقیم با queryset.update که سیگنال ندارند).
+    """
+    stats = StockStats.rebuild()
+    return stats.as_dict()
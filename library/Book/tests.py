@@ -1,3 +1,1195 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from Accounts.models import CustomUser
+from Accounts.serializers import UserProfileSerializer
+from .analytics import rollup_next_batch, rollup_watermark
+from .cache import get_catalog_version
+from .checkout import InsufficientStock, checkout_conditional
+from .exports import iter_serialized_rows
+from .importers import BookImporter
+from .search import BookFullTextSearchFilter, sqlite_fts_available
+from .serializers import BookSerializer
+from .models import (
+    Category, Book, Inventory, ReplenishRequest, StockMovement, StockSnapshot, StockStats, Transaction, TransactionRollup,
+    UserSummary,
+)
+from .stock import stock_at
+from .views import StorekeeperDashboardView
+from .tasks import (
+    AUTO_RETURN_CHUNK_SIZE, auto_return_loaned_books_task, drain_replenish_requests_task, expire_loan_task,
+    overdue_loans, reconcile_stock_stats_task, schedule_loan_expiry,
+)
+
+
+class QueryCountAssertionsMixin:
+    """
+    کمک‌کننده تست: تعداد کوئری‌های یک endpoint لیستی نباید با تعداد ردیف‌های صفحه تغییر کند.
+    make_rows(n) باید n ردیف جدید بسازد.
+    """
+
+    def assertConstantQueryCount(self, url, make_rows, sizes=(2, 10), params=None):
+        counts = []
+        created = 0
+        for size in sizes:
+            # اجرای on_commit ها تا نسخه کش کاتالوگ مثل محیط واقعی عوض شود
+            with self.captureOnCommitCallbacks(execute=True):
+                make_rows(size - created)
+            created = size
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params or {})
+            self.assertEqual(response.status_code, 200, response.content)
+            counts.append(len(queries))
+        self.assertEqual(
+            len(set(counts)), 1,
+            f'{url}: query count grows with rows per page {dict(zip(sizes, counts))}',
+        )
+
+
+# بدون broker در تست‌ها؛ بازگشت قرض‌ها با ETA زمانبندی نمی‌شود
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class ListEndpointQueryCountTests(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user(
+            username='admin', password='pass', user_type=CustomUser.UserType.ADMIN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.category = Category.objects.create(name='رمان')
+
+    def make_books(self, count):
+        for index in range(count):
+            Book.objects.create(title=f'book {index}', author='author', category=self.category)
+
+    def make_transactions(self, count):
+        for index in range(count):
+            book = Book.objects.create(title=f'book {index}', author='author', category=self.category)
+            Transaction.objects.create(user=self.admin, book=book, transaction_type=Book.LOAN)
+
+    def test_book_list(self):
+        self.assertConstantQueryCount('/api/library/books/', self.make_books)
+
+    def test_category_books(self):
+        self.assertConstantQueryCount(
+            f'/api/library/categories/{self.category.pk}/books/', self.make_books
+        )
+
+    def test_inventory_list(self):
+        self.assertConstantQueryCount('/api/library/inventory/', self.make_books)
+
+    def test_transaction_list(self):
+        self.assertConstantQueryCount('/api/library/transactions/', self.make_transactions)
+
+
+class BookSearchTests(TestCase):
+    """جستجوی متنی کتاب‌ها: همگام ماندن ایندکس FTS5، ترتیب bm25 و بازگشت به icontains"""
+
+    def search(self, text, **params):
+        request = Request(APIRequestFactory().get('/', {'search': text, **params}))
+        queryset = BookFullTextSearchFilter().filter_queryset(request, Book.objects.all(), view=None)
+        return list(queryset.values_list('title', flat=True))
+
+    @skipUnless(connection.vendor == 'sqlite', 'جدول FTS5 مخصوص SQLite است')
+    def test_triggers_keep_index_in_sync(self):
+        if not sqlite_fts_available():
+            self.skipTest('SQLite بدون FTS5')
+        book = Book.objects.create(title='Dune', author='Herbert')
+        self.assertEqual(self.search('dun'), ['Dune'])
+
+        book.title = 'Solaris'
+        book.save()
+        self.assertEqual(self.search('dune'), [])
+        self.assertEqual(self.search('solaris'), ['Solaris'])
+
+        Book.objects.filter(pk=book.pk).update(author='Lem')
+        self.assertEqual(self.search('herbert'), [])
+        self.assertEqual(self.search('solaris lem'), ['Solaris'])
+
+        book.delete()
+        self.assertEqual(self.search('solaris'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'جدول FTS5 مخصوص SQLite است')
+    def test_results_are_ordered_by_relevance(self):
+        if not sqlite_fts_available():
+            self.skipTest('SQLite بدون FTS5')
+        Book.objects.create(title='Python Python', author='Python')
+        Book.objects.create(title='Cooking', author='someone', description='a long text that mentions python once')
+        Book.objects.create(title='Gardening', author='someone')
+
+        self.assertEqual(self.search('python'), ['Python Python', 'Cooking'])
+        # با ordering صریح ترتیب ارتباط اعمال نمی‌شود و ترتیب پیش‌فرض (جدیدترین) می‌ماند
+        self.assertEqual(self.search('python', ordering='-created_at'), ['Cooking', 'Python Python'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'جدول FTS5 مخصوص SQLite است')
+    def test_icontains_fallback_without_fts(self):
+        Book.objects.create(title='Dune', author='Herbert')
+        Book.objects.create(title='Solaris', author='Lem')
+        # وسط کلمه با FTS5 (جستجوی پیشوندی) پیدا نمی‌شود ولی با icontains پیدا می‌شود
+        with mock.patch('Book.search.sqlite_fts_available', return_value=False):
+            self.assertEqual(self.search('une'), ['Dune'])
+            self.assertEqual(self.search('lem'), ['Solaris'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN مخصوص SQLite است')
+class TransactionIndexUsageTests(TestCase):
+    """کوئری‌های پرتکرار تراکنش‌ها باید از ایندکس خودشان استفاده کنند، نه اسکن کامل جدول"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+        self.book = Book.objects.create(title='book', author='author')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_overdue_sweep_uses_open_loan_index(self):
+        now = timezone.now()
+        self.assertUsesIndex(overdue_loans(now), 'txn_open_loan_deadline_idx')
+        self.assertUsesIndex(
+            overdue_loans(now).order_by('deadline_date', 'id').values_list('id', 'book_id', 'quantity', 'user_id')[:AUTO_RETURN_CHUNK_SIZE],
+            'txn_open_loan_deadline_idx',
+        )
+
+    def test_user_history_uses_user_created_index(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(user=self.user).order_by('-created_at', '-id')[:20],
+            'txn_user_created_idx',
+        )
+
+    def test_book_history_uses_book_created_index(self):
+        self.assertUsesIndex(
+            Transaction.objects.filter(book=self.book).order_by('-created_at', '-id')[:20],
+            'txn_book_created_idx',
+        )
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class AdminChangelistQueryCountTests(QueryCountAssertionsMixin, TestCase):
+    """تعداد کوئری‌های changelist ادمین نباید با تعداد ردیف‌های صفحه زیاد شود"""
+
+    def setUp(self):
+        self.superuser = CustomUser.objects.create_superuser(
+            username='root', password='pass', email='root@example.com'
+        )
+        self.client.force_login(self.superuser)
+        self.category = Category.objects.create(name='رمان')
+
+    def make_categories(self, count):
+        for index in range(count):
+            category = Category.objects.create(name=f'category {index}')
+            Book.objects.create(title=f'book {index}', author='author', category=category)
+
+    def make_books(self, count):
+        for index in range(count):
+            Book.objects.create(title=f'book {index}', author='author', category=self.category)
+
+    def make_transactions(self, count):
+        for index in range(count):
+            user = CustomUser.objects.create_user(username=f'user{index}-{count}', password='pass')
+            book = Book.objects.create(title=f'book {index}', author='author', category=self.category)
+            Transaction.objects.create(user=user, book=book, transaction_type=Book.LOAN)
+
+    def make_users(self, count):
+        for index in range(count):
+            CustomUser.objects.create_user(username=f'member{index}-{count}', password='pass')
+
+    def test_category_changelist(self):
+        self.assertConstantQueryCount('/admin/Book/category/', self.make_categories)
+
+    def test_book_changelist(self):
+        self.assertConstantQueryCount('/admin/Book/book/', self.make_books)
+
+    def test_transaction_changelist(self):
+        self.assertConstantQueryCount('/admin/Book/transaction/', self.make_transactions)
+
+    def test_inventory_changelist(self):
+        self.assertConstantQueryCount('/admin/Book/inventory/', self.make_books)
+
+    def test_user_changelist(self):
+        self.assertConstantQueryCount('/admin/Accounts/customuser/', self.make_users)
+
+    def test_list_editable_saves_only_changed_fields(self):
+        book = Book.objects.create(title='book', author='author', category=self.category, available_count=3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/admin/Book/book/', {
+                'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 1,
+                'form-0-id': book.pk, 'form-0-available_count': 7,
+                'form-0-total_count': book.total_count, 'form-0-price': book.price,
+                '_save': 'Save',
+            })
+        self.assertEqual(response.status_code, 302)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "Book_book"')]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertIn('"available_count"', updates[0])
+        self.assertNotIn('"title"', updates[0])
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 7)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver', 'a.example', 'b.example'])
+class CatalogCacheTests(TestCase):
+    """کش پاسخ‌های لیستی کاتالوگ: پاسخ از کش، باطل شدن بعد از commit تغییرات و جدا بودن هر میزبان"""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_user(
+            username='admin', password='pass', user_type=CustomUser.UserType.ADMIN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.category = Category.objects.create(name='رمان')
+        self.book = Book.objects.create(title='book', author='author', category=self.category, price=10)
+
+    def titles(self, url='/api/library/books/', **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['title'] for row in response.data['results']]
+
+    def test_hit_until_book_save_commits(self):
+        self.assertEqual(self.titles(), ['book'])
+        # queryset.update سیگنال ندارد، پس پاسخ قبلی از کش برمی‌گردد
+        Book.objects.filter(pk=self.book.pk).update(title='stale')
+        self.assertEqual(self.titles(), ['book'])
+
+        self.book.refresh_from_db()
+        self.book.title = 'renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.book.save()
+        self.assertEqual(self.titles(), ['book'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(), ['renamed'])
+
+    def test_category_save_invalidates(self):
+        response = self.client.get('/api/library/categories/')
+        self.assertEqual([row['name'] for row in response.data['results']], ['رمان'])
+        self.category.name = 'شعر'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response = self.client.get('/api/library/categories/')
+        self.assertEqual([row['name'] for row in response.data['results']], ['شعر'])
+
+    def test_pagination_links_follow_host(self):
+        Book.objects.create(title='second', author='author', category=self.category, price=5)
+        links = {}
+        for host in ('a.example', 'b.example'):
+            response = self.client.get('/api/library/books/', {'page_size': 1}, HTTP_HOST=host)
+            links[host] = response.data['next']
+        self.assertTrue(links['a.example'].startswith('http://a.example/'), links)
+        self.assertTrue(links['b.example'].startswith('http://b.example/'), links)
+        response = self.client.get('/api/library/books/', {'page_size': 1}, HTTP_HOST='a.example', secure=True)
+        self.assertTrue(response.data['next'].startswith('https://a.example/'))
+
+
+class ConditionalGetTests(TestCase):
+    """ETag و Last-Modified برای list و retrieve کتاب‌ها و دسته‌بندی‌ها"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user(
+            username='admin', password='pass', user_type=CustomUser.UserType.ADMIN
+        )
+        self.librarian = CustomUser.objects.create_user(
+            username='librarian', password='pass', user_type=CustomUser.UserType.LIBRARIAN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.category = Category.objects.create(name='رمان')
+        self.book = Book.objects.create(title='book', author='author', category=self.category)
+        self.url = f'/api/library/books/{self.book.pk}/'
+
+    def test_if_none_match(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+
+        self.book.title = 'renamed'
+        self.book.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['title'], 'renamed')
+
+    def test_if_modified_since(self):
+        # Last-Modified دقت ثانیه دارد؛ زمان‌های قبلی (کتاب و دسته‌بندی آن) یک ساعت عقب برده می‌شوند
+        an_hour_ago = timezone.now() - timezone.timedelta(hours=1)
+        Book.objects.filter(pk=self.book.pk).update(updated_at=an_hour_ago)
+        Category.objects.filter(pk=self.category.pk).update(updated_at=an_hour_ago)
+        last_modified = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.book.refresh_from_db()
+        self.book.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_list_validators_change_with_rows_and_related(self):
+        url = '/api/library/books/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # نام دسته‌بندی در خروجی کتاب می‌آید
+        self.category.name = 'شعر'
+        self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # حذف یک کتاب MAX(updated_at) را لزوماً عوض نمی‌کند ولی COUNT را عوض می‌کند
+        Book.objects.create(title='other', author='author')
+        etag_with_two = self.client.get(url)['ETag']
+        Book.objects.filter(title='other').delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag_with_two).status_code, 200)
+
+    def test_validators_vary_by_role(self):
+        url = '/api/library/categories/'
+        admin_etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(self.librarian)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=admin_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], admin_etag)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_missing_object_is_404(self):
+        response = self.client.get(f'/api/library/books/{self.book.pk + 1000}/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class KeysetPaginationTests(TestCase):
+    """صفحه‌بندی keyset: رفت و برگشت با cursor، شکستن تساوی با id و ordering صریح"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_user(
+            username='admin', password='pass', user_type=CustomUser.UserType.ADMIN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        # چند کتاب با قیمت یکسان تا ترتیب فقط با id مشخص شود
+        for index, price in enumerate((5, 10, 10, 10, 10, 20, 10)):
+            Book.objects.create(title=f'book {index}', author='author', price=price)
+
+    def walk(self, url, params):
+        pages, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([row['id'] for row in response.data['results']])
+            if not response.data['next']:
+                return pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_round_trip_with_duplicate_sort_keys(self):
+        pages, last = self.walk('/api/library/books/', {'page_size': 2})
+        expected = list(Book.objects.order_by('-price', 'id').values_list('id', flat=True))
+        self.assertEqual([book_id for page in pages for book_id in page], expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+
+        # برگشت با previous همان صفحه‌ها را به ترتیب عکس می‌دهد
+        backwards, response = [], last
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            backwards.append([row['id'] for row in response.data['results']])
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_explicit_ordering_param(self):
+        pages, _ = self.walk('/api/library/books/', {'page_size': 3, 'ordering': 'price'})
+        expected = list(Book.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual([book_id for page in pages for book_id in page], expected)
+
+    def test_same_created_at_is_ordered_by_id(self):
+        book = Book.objects.first()
+        for _ in range(5):
+            Transaction.objects.create(user=self.admin, book=book, transaction_type=Book.PURCHASE)
+        Transaction.objects.update(created_at=timezone.now())
+
+        pages, _ = self.walk('/api/library/transactions/', {'page_size': 2})
+        expected = list(Transaction.objects.order_by('-id').values_list('id', flat=True))
+        self.assertEqual([item_id for page in pages for item_id in page], expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/library/books/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    """خروجی استریم NDJSON/CSV کاتالوگ"""
+
+    url = '/api/library/books/export/'
+
+    def setUp(self):
+        admin = CustomUser.objects.create_user(
+            username='admin', password='pass', user_type=CustomUser.UserType.ADMIN
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        self.books = [Book.objects.create(title=f'کتاب {index}', author='author') for index in range(5)]
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.ndjson"')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(book.pk for book in self.books))
+        self.assertIn('کتاب 0', {row['title'] for row in rows})
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'export_format': 'csv', 'author': 'author'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.csv"')
+        header, *rows = list(csv.reader(io.StringIO(self.content(response))))
+        self.assertIn('title', header)
+        self.assertEqual(len(rows), len(self.books))
+        self.assertEqual({row[header.index('title')] for row in rows}, {book.title for book in self.books})
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(self.url, {'export_format': 'xml'}).status_code, 400)
+
+    def test_rows_are_serialized_in_chunks(self):
+        serialized = []
+
+        class RecordingSerializer(BookSerializer):
+            def __init__(self, instance=None, **kwargs):
+                serialized.append(len(instance))
+                super().__init__(instance, **kwargs)
+
+        rows = iter_serialized_rows(Book.objects.all(), RecordingSerializer, chunk_size=2)
+        self.assertEqual(serialized, [])
+        # کوئری با iterator پیمایش می‌شود، نه با بارگذاری کامل نتایج
+        iterate = models.QuerySet.iterator
+        with mock.patch.object(models.QuerySet, 'iterator', autospec=True, side_effect=iterate) as iterator:
+            self.assertEqual(len(list(rows)), 5)
+        iterator.assert_called_once()
+        self.assertEqual(serialized, [2, 2, 1])
+
+
+class BookImporterTests(TestCase):
+    """ورود گروهی: گزارش خطای هر ردیف، ساخت Inventory و شمارنده‌ها و اعتبارسنجی در process pool"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='رمان')
+
+    def rows(self, count):
+        return [
+            {'title': f'book {index}', 'author': 'author', 'category': self.category.pk, 'available_count': 3}
+            for index in range(count)
+        ]
+
+    def test_errors_are_reported_per_row(self):
+        rows = self.rows(2) + [
+            {'author': 'author'},
+            {'title': 'bad category', 'author': 'author', 'category': self.category.pk + 1000},
+            'not an object',
+            {'title': 'too many', 'author': 'author', 'available_count': 200, 'total_count': 100},
+        ]
+        report = BookImporter(batch_size=3).run(rows)
+
+        self.assertEqual((report['total_rows'], report['created'], report['failed']), (6, 2, 4))
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4, 5, 6])
+        self.assertIn('title', report['errors'][0]['errors'])
+        self.assertEqual(report['errors'][1]['errors'], {'category': ['دسته‌بندی یافت نشد']})
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_created_books_get_inventory_and_counts(self):
+        report = BookImporter(batch_size=2).run(self.rows(5))
+        self.assertEqual(report['created'], 5)
+
+        self.assertEqual(Inventory.objects.filter(book__category=self.category).count(), 5)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.books_count, 5)
+        self.assertEqual(StockStats.objects.get().low_stock_books, 5)
+        self.assertEqual(StockMovement.objects.filter(reason=StockMovement.IMPORT).count(), 5)
+
+    def test_single_batch_is_validated_in_process(self):
+        with mock.patch('Book.importers.ProcessPoolExecutor') as executor:
+            report = BookImporter(workers=4).run(self.rows(3))
+        executor.assert_not_called()
+        self.assertEqual(report['created'], 3)
+
+    def test_process_pool_validation(self):
+        rows = self.rows(5)
+        rows[3] = {'author': 'author'}
+        report = BookImporter(batch_size=2, workers=2).run(rows)
+        self.assertEqual((report['created'], report['failed']), (4, 1))
+        self.assertEqual(report['errors'][0]['row'], 4)
+        self.assertEqual(Book.objects.count(), 4)
+
+
+class StockBulkUpdateTests(TestCase):
+    """به‌روزرسانی گروهی موجودی انباردار: یک bulk_update، نتیجه هر مورد و همه یا هیچ"""
+
+    url = '/api/library/storekeeper/dashboard/'
+
+    def setUp(self):
+        cache.clear()
+        storekeeper = CustomUser.objects.create_user(
+            username='storekeeper', password='pass', user_type=CustomUser.UserType.STOREKEEPER
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(storekeeper)
+        self.books = [
+            Book.objects.create(title=f'book {index}', author='author', available_count=10, total_count=20)
+            for index in range(3)
+        ]
+
+    def patch(self, updates):
+        return self.client.patch(self.url, {'updates': updates}, format='json')
+
+    def stock(self):
+        return list(Book.objects.order_by('pk').values_list('available_count', 'total_count'))
+
+    def test_success_uses_one_update(self):
+        first, second, _ = self.books
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch([
+                {'book_id': first.pk, 'available_count': 2},
+                {'book_id': second.pk, 'available_count': 30, 'total_count': 40},
+            ])
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([result['status'] for result in response.data['results']], ['success'] * 2)
+        self.assertEqual(response.data['summary'], {'total_updates': 2, 'successful_updates': 2, 'failed_updates': 0})
+        self.assertEqual(self.stock(), [(2, 20), (30, 40), (10, 20)])
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "Book_book"')]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertEqual(StockStats.objects.get().low_stock_books, 1)
+
+    def test_one_failure_applies_nothing(self):
+        first, second, third = self.books
+        movements = StockMovement.objects.count()
+        response = self.patch([
+            {'book_id': first.pk, 'available_count': 5},
+            {'book_id': second.pk, 'available_count': 25},
+            {'book_id': third.pk, 'total_count': -1},
+            {'book_id': third.pk + 1000, 'available_count': 1},
+            {'available_count': 1},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['error'] * 5)
+        self.assertEqual(results[0]['message'], 'به دلیل خطای سایر موارد اعمال نشد')
+        self.assertIn('non_field_errors', results[1]['message'])
+        self.assertIn('total_count', results[2]['message'])
+        self.assertEqual(results[3]['message'], 'کتاب یافت نشد')
+        self.assertEqual(results[4], {'book_id': None, 'status': 'error', 'message': 'شناسه کتاب ارائه نشده'})
+        self.assertEqual(response.data['summary']['successful_updates'], 0)
+        self.assertEqual(self.stock(), [(10, 20)] * 3)
+        self.assertEqual(StockMovement.objects.count(), movements)
+
+    def test_database_error_rolls_back(self):
+        with mock.patch('Book.views.record_stock_changes', side_effect=RuntimeError('boom')):
+            response = self.patch([{'book_id': book.pk, 'available_count': 1} for book in self.books])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual({result['message'] for result in response.data['results']}, {'خطای سیستمی: boom'})
+        self.assertEqual(self.stock(), [(10, 20)] * 3)
+
+    def test_max_stock_updates(self):
+        self.assertEqual(StorekeeperDashboardView.MAX_STOCK_UPDATES, 5000)
+        updates = [{'book_id': self.books[0].pk, 'available_count': 1}] * 5001
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(updates)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('results', response.data)
+        self.assertFalse([query for query in queries if 'Book_book' in query['sql']])
+
+        response = self.patch(updates[:5000])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary']['successful_updates'], 5000)
+        self.assertEqual(self.stock()[0], (1, 20))
+
+
+class CategoryBooksCountTests(TestCase):
+    """شمارنده books_count دسته‌بندی با سیگنال‌های Book (فعال در ready) و مسیرهای bulk"""
+
+    def setUp(self):
+        self.novels = Category.objects.create(name='رمان')
+        self.poems = Category.objects.create(name='شعر')
+
+    def counts(self):
+        return tuple(
+            Category.objects.get(pk=category.pk).books_count for category in (self.novels, self.poems)
+        )
+
+    def test_create_and_delete(self):
+        book = Book.objects.create(title='book', author='author', category=self.novels)
+        Book.objects.create(title='other', author='author', category=self.novels)
+        Book.objects.create(title='no category', author='author')
+        self.assertEqual(self.counts(), (2, 0))
+        # سیگنال‌های ready() انبار کتاب جدید را هم می‌سازند
+        self.assertTrue(Inventory.objects.filter(book=book).exists())
+
+        book.delete()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_category_reassignment(self):
+        book = Book.objects.create(title='book', author='author', category=self.novels)
+        book.category = self.poems
+        book.save()
+        self.assertEqual(self.counts(), (0, 1))
+
+        loaded = Book.objects.get(pk=book.pk)
+        loaded.category = None
+        loaded.save(update_fields=['category'])
+        self.assertEqual(self.counts(), (0, 0))
+
+        loaded.category = self.novels
+        loaded.save()
+        loaded.title = 'renamed'
+        loaded.save(update_fields=['title'])
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_bulk_import(self):
+        report = BookImporter().run([
+            {'title': 'a', 'author': 'author', 'category': self.novels.pk},
+            {'title': 'b', 'author': 'author', 'category': self.novels.pk},
+            {'title': 'c', 'author': 'author', 'category': self.poems.pk},
+            {'title': 'd', 'author': 'author'},
+        ])
+        self.assertEqual(report['created'], 4)
+        self.assertEqual(self.counts(), (2, 1))
+
+    def test_reconcile_repairs_drift(self):
+        Book.objects.create(title='book', author='author', category=self.novels)
+        Book.objects.update(category=self.poems)
+        self.assertEqual(self.counts(), (1, 0))
+
+        call_command('reconcile_category_counts', stdout=mock.Mock())
+        self.assertEqual(self.counts(), (0, 1))
+
+
+class StockStatsTests(TestCase):
+    """آمار موجودی داشبورد با هر تغییر به صورت افزایشی و فقط با جابه‌جایی بین دسته‌های آماری به‌روز می‌شود"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='رمان')
+        self.books = [
+            Book.objects.create(title=f'book {available}', author='author', available_count=available)
+            for available in (10, 3, 0)
+        ]
+
+    def stats(self):
+        stats = StockStats.objects.get()
+        return stats.total_books, stats.low_stock_books, stats.out_of_stock_books
+
+    def stats_updates(self, queries):
+        return [query['sql'] for query in queries if query['sql'].startswith('UPDATE "Book_stockstats"')]
+
+    def test_create_and_delete(self):
+        self.assertEqual(self.stats(), (3, 2, 1))
+        self.books[2].delete()
+        self.assertEqual(self.stats(), (2, 1, 0))
+        self.books[1].delete()
+        self.assertEqual(self.stats(), (1, 0, 0))
+
+    def test_update_between_buckets(self):
+        book = self.books[0]
+        for available, expected in ((2, (3, 3, 1)), (0, (3, 3, 2)), (7, (3, 2, 1))):
+            book.available_count = available
+            with CaptureQueriesContext(connection) as queries:
+                book.save(update_fields=['available_count'])
+            self.assertEqual(len(self.stats_updates(queries)), 1)
+            self.assertEqual(self.stats(), expected)
+        self.assertEqual(self.stats(), tuple(StockStats.compute().values()))
+
+    def test_unchanged_bucket_skips_stats(self):
+        book = Book.objects.get(pk=self.books[0].pk)
+        book.available_count = 8
+        book.category = self.category
+        with CaptureQueriesContext(connection) as queries:
+            book.save()
+        self.assertEqual(self.stats_updates(queries), [])
+
+        book.category = None
+        with CaptureQueriesContext(connection) as queries:
+            book.save(update_fields=['category'])
+        self.assertEqual(self.stats_updates(queries), [])
+        self.assertEqual(self.stats(), (3, 2, 1))
+
+    def test_reconcile_repairs_drift(self):
+        # queryset.update و حذف نمونه‌ای که موجودی آن لود نشده سیگنال آماری ندارند
+        Book.objects.filter(pk=self.books[0].pk).update(available_count=0)
+        Book.objects.only('id').get(pk=self.books[1].pk).delete()
+        self.assertEqual(self.stats(), (3, 2, 1))
+
+        self.assertEqual(
+            reconcile_stock_stats_task(), {'total_books': 2, 'low_stock_books': 2, 'out_of_stock_books': 2}
+        )
+        self.assertEqual(self.stats(), (2, 2, 2))
+
+    def test_missing_row_is_rebuilt(self):
+        StockStats.objects.all().delete()
+        Book.objects.create(title='new', author='author', available_count=1)
+        self.assertEqual(self.stats(), (4, 3, 1))
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class ConditionalCheckoutTests(TestCase):
+    """موتور UPDATE شرطی: موفقیت، عدم تغییر هیچ ردیف در کمبود موجودی و اثرهای جانبی"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+        self.book = Book.objects.create(title='book', author='author', available_count=3, price=10)
+
+    def test_decrements_stock_and_records_movement(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                book = checkout_conditional(self.book.pk, 2)
+
+        self.assertEqual(book.available_count, 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 1)
+        movement = StockMovement.objects.get(book=self.book, reason=StockMovement.CHECKOUT)
+        self.assertEqual((movement.delta, movement.balance_after), (-2, 1))
+        # available_count از 3 به 1 رسید: کتاب کم‌موجود شد ولی ناموجود نیست
+        stats = StockStats.objects.get()
+        self.assertEqual((stats.low_stock_books, stats.out_of_stock_books), (1, 0))
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_out_of_stock_updates_no_rows(self):
+        movements = StockMovement.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            with self.assertRaises(InsufficientStock):
+                with transaction.atomic():
+                    checkout_conditional(self.book.pk, 4)
+
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "Book_book"')]
+        self.assertEqual(len(updates), 1, updates)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 3)
+        self.assertEqual(StockMovement.objects.count(), movements)
+
+    def test_missing_book(self):
+        with self.assertRaises(Book.DoesNotExist):
+            with transaction.atomic():
+                checkout_conditional(self.book.pk + 1000, 1)
+
+    @override_settings(LIBRARY_CHECKOUT_ENGINE='conditional')
+    def test_request_book_creates_loan_and_updates_summary(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            '/api/library/transactions/request_book/',
+            {'book_id': self.book.pk, 'transaction_type': Book.LOAN, 'quantity': 1}, format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        loan = Transaction.objects.get(user=self.user)
+        self.assertEqual((loan.transaction_type, loan.quantity, loan.is_completed), (Book.LOAN, 1, False))
+        self.assertIsNotNone(loan.deadline_date)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 2)
+        self.assertEqual(UserSummary.objects.get(user=self.user).open_loans, 1)
+
+        response = client.post(
+            '/api/library/transactions/request_book/',
+            {'book_id': self.book.pk, 'transaction_type': Book.LOAN, 'quantity': 5}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UserSummary.objects.get(user=self.user).open_loans, 1)
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class CartCheckoutTests(TestCase):
+    """سبد همه یا هیچ: نتیجه هر خط، rollback کامل در کمبود یک خط و ترتیب قفل/به‌روزرسانی کتاب‌ها"""
+
+    url = '/api/library/transactions/checkout_cart/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.books = [
+            Book.objects.create(title=f'book {index}', author='author', available_count=3, price=10)
+            for index in range(3)
+        ]
+
+    def checkout(self, items):
+        return self.client.post(self.url, {'items': items}, format='json')
+
+    def available_counts(self):
+        return list(Book.objects.order_by('pk').values_list('available_count', flat=True))
+
+    def test_success_returns_result_per_line(self):
+        first, second, _ = self.books
+        response = self.checkout([
+            {'book_id': second.pk, 'transaction_type': Book.PURCHASE, 'quantity': 2},
+            {'book_id': first.pk, 'transaction_type': Book.LOAN, 'quantity': 1},
+        ])
+
+        self.assertEqual(response.status_code, 201, response.content)
+        results = response.data['results']
+        self.assertEqual([result['book_id'] for result in results], [second.pk, first.pk])
+        self.assertEqual({result['status'] for result in results}, {'success'})
+        self.assertEqual(results[0]['transaction']['quantity'], 2)
+        self.assertEqual(self.available_counts(), [2, 1, 3])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+        summary = UserSummary.objects.get(user=self.user)
+        self.assertEqual((summary.open_loans, summary.total_purchased), (1, 2))
+
+    def test_one_short_line_rolls_back_whole_cart(self):
+        first, second, third = self.books
+        movements = StockMovement.objects.count()
+        response = self.checkout([
+            {'book_id': first.pk, 'transaction_type': Book.LOAN, 'quantity': 1},
+            {'book_id': second.pk, 'transaction_type': Book.PURCHASE, 'quantity': 5},
+            {'book_id': third.pk, 'transaction_type': Book.LOAN, 'quantity': 1},
+        ])
+
+        self.assertEqual(response.status_code, 400, response.content)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['error'] * 3)
+        self.assertEqual(results[1]['message'], 'تعداد کتاب درخواستی بیش از حد موجود است!')
+        self.assertEqual(results[0]['message'], 'به دلیل خطای سایر اقلام سبد ثبت نشد')
+        # کم شدن موجودی کتاب اول (که قبل از کتاب دوم قفل شد) هم برگشته است
+        self.assertEqual(self.available_counts(), [3, 3, 3])
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(StockMovement.objects.count(), movements)
+        self.assertFalse(UserSummary.objects.filter(user=self.user, open_loans__gt=0).exists())
+
+    def test_lines_for_same_book_are_checked_together(self):
+        first = self.books[0]
+        response = self.checkout([
+            {'book_id': first.pk, 'transaction_type': Book.LOAN, 'quantity': 2},
+            {'book_id': first.pk, 'transaction_type': Book.PURCHASE, 'quantity': 2},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.available_counts(), [3, 3, 3])
+
+    def test_missing_book(self):
+        response = self.checkout([
+            {'book_id': self.books[0].pk, 'transaction_type': Book.LOAN, 'quantity': 1},
+            {'book_id': self.books[-1].pk + 1000, 'transaction_type': Book.LOAN, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][1]['message'], 'کتاب مورد نظر یافت نشد!')
+        self.assertEqual(self.available_counts(), [3, 3, 3])
+
+    def test_books_are_updated_in_id_order(self):
+        items = [
+            {'book_id': book.pk, 'transaction_type': Book.LOAN, 'quantity': 1}
+            for book in reversed(self.books)
+        ]
+        for engine in ('locking', 'conditional'):
+            with self.subTest(engine=engine), override_settings(LIBRARY_CHECKOUT_ENGINE=engine):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.checkout(items)
+                self.assertEqual(response.status_code, 201, response.content)
+                updated = [
+                    int(re.search(r'"Book_book"\."id" = (\d+)', query['sql']).group(1))
+                    for query in queries if query['sql'].startswith('UPDATE "Book_book"')
+                ]
+                self.assertEqual(updated, sorted(book.pk for book in self.books))
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class AutoReturnTaskTests(TestCase):
+
+    def test_short_chunk_does_not_end_sweep(self):
+        # تکه کوتاه (مثلاً به خاطر ردیف‌های قفل شده با skip_locked) نباید حلقه را تمام کند
+        with mock.patch('Book.tasks.return_overdue_chunk', side_effect=[2, 5, 0]) as chunk:
+            self.assertEqual(auto_return_loaned_books_task(chunk_size=5), 7)
+        self.assertEqual(chunk.call_count, 3)
+
+    def test_returns_all_overdue_loans(self):
+        user = CustomUser.objects.create_user(username='reader', password='pass')
+        book = Book.objects.create(title='book', author='author', available_count=5)
+        for _ in range(5):
+            Transaction.objects.create(user=user, book=book, transaction_type=Book.LOAN)
+        Transaction.objects.update(deadline_date=timezone.now() - timezone.timedelta(days=1))
+        # ساخت مستقیم تراکنش موجودی را کم نمی‌کند؛ وضعیت بعد از قرض دادن هر 5 نسخه
+        Book.objects.filter(pk=book.pk).update(available_count=0)
+
+        self.assertEqual(auto_return_loaned_books_task(chunk_size=2), 5)
+        self.assertFalse(overdue_loans(timezone.now()).exists())
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 5)
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class ExpireLoanTaskTests(TestCase):
+    """بازگشت یک قرض در لحظه پایان مهلت با تسک ETA"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+        self.book = Book.objects.create(title='book', author='author', available_count=5)
+        self.loan = Transaction.objects.create(user=self.user, book=self.book, transaction_type=Book.LOAN)
+        # ساخت مستقیم تراکنش موجودی را کم نمی‌کند
+        Book.objects.filter(pk=self.book.pk).update(available_count=4)
+
+    def expire_deadline(self):
+        Transaction.objects.filter(pk=self.loan.pk).update(deadline_date=timezone.now() - timezone.timedelta(seconds=1))
+
+    def test_restores_stock_at_deadline(self):
+        self.expire_deadline()
+        self.assertEqual(expire_loan_task(self.loan.pk), 1)
+
+        self.loan.refresh_from_db()
+        self.assertTrue(self.loan.is_completed)
+        self.assertIsNotNone(self.loan.returned_at)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 5)
+        movement = StockMovement.objects.get(book=self.book, reason=StockMovement.RETURN)
+        self.assertEqual((movement.delta, movement.balance_after), (1, 5))
+
+    def test_already_returned_loan_is_untouched(self):
+        self.expire_deadline()
+        expire_loan_task(self.loan.pk)
+        with mock.patch.object(expire_loan_task, 'apply_async') as apply_async:
+            self.assertEqual(expire_loan_task(self.loan.pk), 0)
+        apply_async.assert_not_called()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 5)
+        self.assertEqual(StockMovement.objects.filter(book=self.book, reason=StockMovement.RETURN).count(), 1)
+
+    def test_early_run_reschedules_for_deadline(self):
+        with mock.patch.object(expire_loan_task, 'apply_async') as apply_async:
+            self.assertEqual(expire_loan_task(self.loan.pk), 0)
+        apply_async.assert_called_once_with((self.loan.pk,), eta=self.loan.deadline_date)
+        self.loan.refresh_from_db()
+        self.assertFalse(self.loan.is_completed)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 4)
+
+    def test_schedule_after_commit(self):
+        with override_settings(LIBRARY_LOAN_EXPIRY_ETA=True), \
+                mock.patch.object(expire_loan_task, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks() as callbacks:
+                schedule_loan_expiry([self.loan])
+            apply_async.assert_not_called()
+            for callback in callbacks:
+                callback()
+        apply_async.assert_called_once_with((self.loan.pk,), eta=self.loan.deadline_date)
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class UserSummaryTests(TestCase):
+    """تغییرات افزایشی خلاصه کاربر، دیرکرد فقط برای بازگشت دستی بعد از مهلت و بازسازی کامل"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+        self.book = Book.objects.create(title='book', author='author', available_count=10, price=10)
+
+    def loan(self):
+        return Transaction.objects.create(user=self.user, book=self.book, transaction_type=Book.LOAN)
+
+    def summary(self):
+        summary = UserSummary.objects.get(user=self.user)
+        return (summary.open_loans, summary.overdue_loans, summary.total_purchased, summary.total_spent)
+
+    def test_transaction_deltas(self):
+        self.loan()
+        Transaction.objects.create(user=self.user, book=self.book, transaction_type=Book.PURCHASE, quantity=3)
+        self.assertEqual(self.summary(), (1, 0, 3, 30))
+
+    def test_manual_returns(self):
+        on_time, late = self.loan(), self.loan()
+        Transaction.objects.filter(pk=late.pk).update(deadline_date=timezone.now() - timezone.timedelta(hours=1))
+        late.refresh_from_db()
+
+        self.assertTrue(on_time.return_books())
+        self.assertEqual(self.summary(), (1, 0, 0, 0))
+        self.assertTrue(late.return_books())
+        self.assertEqual(self.summary(), (0, 1, 0, 0))
+        self.assertFalse(late.return_books())
+        self.assertEqual(self.summary(), (0, 1, 0, 0))
+
+    def test_auto_return_is_not_overdue(self):
+        self.loan()
+        Transaction.objects.update(deadline_date=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(auto_return_loaned_books_task(), 1)
+        self.assertEqual(self.summary(), (0, 0, 0, 0))
+
+        loan = Transaction.objects.get()
+        self.assertEqual(loan.returned_at, loan.deadline_date)
+
+    def test_rebuild_command_matches_deltas(self):
+        self.loan()
+        late = self.loan()
+        Transaction.objects.filter(pk=late.pk).update(deadline_date=timezone.now() - timezone.timedelta(hours=1))
+        late.refresh_from_db()
+        late.return_books()
+        expired = self.loan()
+        Transaction.objects.filter(pk=expired.pk).update(deadline_date=timezone.now() - timezone.timedelta(hours=1))
+        auto_return_loaned_books_task()
+        Transaction.objects.create(user=self.user, book=self.book, transaction_type=Book.PURCHASE, quantity=2)
+        expected = self.summary()
+        self.assertEqual(expected, (1, 1, 2, 20))
+
+        UserSummary.objects.filter(user=self.user).update(open_loans=7, overdue_loans=7)
+        idle = CustomUser.objects.create_user(username='idle', password='pass')
+        UserSummary.objects.create(user=idle, open_loans=1)
+        call_command('rebuild_user_summaries', stdout=mock.Mock())
+
+        self.assertEqual(self.summary(), expected)
+        self.assertFalse(UserSummary.objects.filter(user=idle).exists())
+
+    def test_profile_serializer_summary(self):
+        idle = CustomUser.objects.create_user(username='idle', password='pass')
+        self.assertEqual(
+            UserProfileSerializer(idle).data['summary'],
+            {'open_loans': 0, 'overdue_loans': 0, 'total_purchased': 0, 'total_spent': '0.00'},
+        )
+        self.loan()
+        user = CustomUser.objects.select_related('summary').get(pk=self.user.pk)
+        self.assertEqual(UserProfileSerializer(user).data['summary']['open_loans'], 1)
+
+
+@override_settings(LIBRARY_LOAN_EXPIRY_ETA=False)
+class ReplenishQueueTests(TestCase):
+    """خرید فقط درخواست بررسی انبار ثبت می‌کند؛ پر کردن انبار در drain_replenish_requests_task است"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+
+    def make_low_stock_book(self, title='book'):
+        book = Book.objects.create(title=title, author='author', available_count=10, total_count=100)
+        # زیر min_stock_level (پیش‌فرض 5)؛ update سیگنال ندارد و درخواستی ثبت نمی‌کند
+        Book.objects.filter(pk=book.pk).update(available_count=2)
+        return book
+
+    def purchase(self, book):
+        Transaction.objects.create(user=self.user, book=book, transaction_type=Book.PURCHASE)
+
+    def test_purchases_are_coalesced_and_replenished_by_drain(self):
+        book = self.make_low_stock_book()
+        self.purchase(book)
+        self.purchase(book)
+        ReplenishRequest.record([book.pk, book.pk])
+
+        self.assertEqual(list(ReplenishRequest.objects.values_list('book_id', flat=True)), [book.pk])
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 2)
+
+        self.assertEqual(drain_replenish_requests_task(), 1)
+        book.refresh_from_db()
+        # تا max_stock_level (پیش‌فرض 50) از انبار منتقل می‌شود
+        self.assertEqual((book.available_count, book.total_count), (50, 52))
+        self.assertFalse(ReplenishRequest.objects.exists())
+        movement = StockMovement.objects.get(book=book, reason=StockMovement.REPLENISH)
+        self.assertEqual((movement.delta, movement.balance_after), (48, 50))
+
+    def test_drain_processes_all_batches(self):
+        books = [self.make_low_stock_book(f'book {index}') for index in range(3)]
+        stocked = Book.objects.create(title='stocked', author='author', available_count=20)
+        ReplenishRequest.record([book.pk for book in books] + [stocked.pk])
+
+        self.assertEqual(drain_replenish_requests_task(batch_size=1), 3)
+        self.assertFalse(ReplenishRequest.objects.exists())
+        self.assertEqual(
+            list(Book.objects.filter(pk__in=[book.pk for book in books]).values_list('available_count', flat=True)),
+            [50, 50, 50],
+        )
+        stocked.refresh_from_db()
+        self.assertEqual(stocked.available_count, 20)
+
+
+class StockAtTests(TestCase):
+    """موجودی گذشته از روی گردش‌ها و عکس‌های موجودی، از جمله بازه‌های فشرده شده"""
+
+    book_id = 999
+
+    def setUp(self):
+        self.base = timezone.now() - timezone.timedelta(days=365)
+
+    def time(self, day):
+        return self.base + timezone.timedelta(days=day)
+
+    def move(self, day, delta, balance, reason=StockMovement.ADJUST):
+        StockMovement.objects.create(
+            book_id=self.book_id, delta=delta, balance_after=balance, reason=reason, created_at=self.time(day)
+        )
+
+    def snapshot(self, day, balance):
+        StockSnapshot.objects.create(book_id=self.book_id, available_count=balance, taken_at=self.time(day))
+
+    def test_between_compaction_cutoffs_is_not_exact(self):
+        # دو فشرده‌سازی (روز 10 و 30) و یک گردش نگه داشته شده در روز 50
+        self.snapshot(10, 5)
+        self.snapshot(30, 2)
+        self.move(50, 5, 7)
+
+        self.assertEqual(stock_at(self.book_id, self.time(5)), (5, self.time(10), False))
+        self.assertEqual(stock_at(self.book_id, self.time(20)), (5, self.time(10), False))
+        self.assertEqual(stock_at(self.book_id, self.time(40)), (2, self.time(40), True))
+        self.assertEqual(stock_at(self.book_id, self.time(60)), (7, self.time(60), True))
+
+    def test_uncompacted_ledger_is_exact(self):
+        self.move(10, 3, 3, reason=StockMovement.CREATE)
+        self.move(20, -1, 2, reason=StockMovement.CHECKOUT)
+
+        self.assertEqual(stock_at(self.book_id, self.time(5)), (None, self.time(5), True))
+        self.assertEqual(stock_at(self.book_id, self.time(15)), (3, self.time(15), True))
+        self.assertEqual(stock_at(self.book_id, self.time(25)), (2, self.time(25), True))
+
+
+class TransactionRollupWatermarkTests(TestCase):
+    """نشانگر خلاصه‌ها فقط از روی پیشوند پیوسته id ها جلو می‌رود"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='pass')
+        self.book = Book.objects.create(title='book', author='author', price=10)
+
+    def make_transaction(self, minutes_ago):
+        item = Transaction.objects.create(user=self.user, book=self.book, transaction_type=Book.PURCHASE)
+        Transaction.objects.filter(pk=item.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=minutes_ago))
+        return item
+
+    def rolled_up(self):
+        return TransactionRollup.objects.filter(granularity=TransactionRollup.DAY).aggregate(
+            total=models.Sum('count')
+        )['total'] or 0
+
+    def test_young_row_blocks_later_ids(self):
+        first = self.make_transaction(60)
+        young = self.make_transaction(1)
+        self.make_transaction(60)
+
+        self.assertEqual(rollup_next_batch(), 1)
+        self.assertEqual(rollup_watermark(), first.pk)
+
+        Transaction.objects.filter(pk=young.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=10))
+        self.assertEqual(rollup_next_batch(), 2)
+        self.assertEqual(self.rolled_up(), 3)
+
+    def test_missing_id_waits_for_gap_timeout(self):
+        first = self.make_transaction(60)
+        self.make_transaction(60).delete()
+        last = self.make_transaction(10)
+
+        # id وسط ممکن است تراکنشی باشد که هنوز commit نشده
+        self.assertEqual(rollup_next_batch(), 1)
+        self.assertEqual(rollup_watermark(), first.pk)
+
+        Transaction.objects.filter(pk=last.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=45))
+        self.assertEqual(rollup_next_batch(), 1)
+        self.assertEqual(rollup_watermark(), last.pk)
+        self.assertEqual(self.rolled_up(), 2)
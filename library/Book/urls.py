@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CategoryViewSet, BookViewSet, TransactionViewSet, InventoryViewSet,StorekeeperDashboardView
-from .views import BookStockUpdateViewSet
+from .views import BookStockUpdateViewSet, TransactionAnalyticsView
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet,basename='category')
 router.register(r'books', BookViewSet,basename='books')
@@ -15,4 +15,5 @@ router.register(r'storekeeper/books', BookStockUpdateViewSet, basename='storekee
 urlpatterns = [
     path('', include(router.urls)),
     path('storekeeper/dashboard/', StorekeeperDashboardView.as_view(), name='storekeeper-dashboard'),
+    path('analytics/transactions/', TransactionAnalyticsView.as_view(), name='transaction-analytics'),
 ]
\ No newline at end of file
@@ -1,42 +1,70 @@
-from rest_framework import viewsets, status, permissions, filters,mixins
+from rest_framework import viewsets, status, permissions, filters,mixins, serializers
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db import models
-from .models import Category, Book, Transaction, Inventory
+from .models import Category, Book, Transaction, Inventory, StockStats
 from .permissions import IsAdminOrLibrarian, IsAdminOrStorekeeper,IsStorekeeper,IsAdmin
+from .search import BookFullTextSearchFilter
+from .analytics import query_rollups, rollup_watermark
+from .stock import StockChange, record_stock_changes, stock_at
+from .cache import bump_catalog_version_on_commit, cached_catalog_response
+from .checkout import CartCheckoutError, InsufficientStock, checkout_cart, get_checkout_engine
+from .exports import streaming_export_response
+from .importers import IMPORT_FORMATS, BookImporter, parse_rows
+from .mixins import ConditionalGetMixin, EagerLoadingMixin
+from .pagination import BookKeysetPagination, BookPriceKeysetPagination, TransactionKeysetPagination
 from rest_framework.views import APIView
 from django.db import models, transaction
-from .serializers import (CategorySerializer, BookSerializer, TransactionSerializer,BookRequestSerializer, InventorySerializer,BookStoreSerializer, BookStockUpdateSerializer)
+from .serializers import (CategorySerializer, BookSerializer, TransactionSerializer,BookRequestSerializer, InventorySerializer,BookStoreSerializer, BookStockUpdateSerializer,
+                          CartCheckoutSerializer, TransactionAnalyticsQuerySerializer)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrLibrarian]
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'description']
     
+    def filter_queryset(self, queryset):
+        # در اکشن books پارامتر search مربوط به کتاب‌هاست، نه پیدا کردن خود دسته‌بندی
+        if self.action == 'books':
+            return queryset
+        return super().filter_queryset(queryset)
+    
+    @cached_catalog_response('categories')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
     @action(detail=True, methods=['get'], permission_classes=[IsAdminOrLibrarian])
     def books(self, request, pk=None):
         category = self.get_object()
         books = Book.objects.filter(category=category) 
-        page = self.paginate_queryset(books)
+        books = BookFullTextSearchFilter().filter_queryset(request, books, self)
+        books = self.apply_eager_loading(books, BookSerializer)
+        paginator = BookKeysetPagination()
+        page = paginator.paginate_queryset(books, request, view=self)
         if page is not None:
             serializer = BookSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return paginator.get_paginated_response(serializer.data)
             
         serializer = BookSerializer(books, many=True)
         return Response(serializer.data)
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ConditionalGetMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    conditional_related_timestamps = ('category__updated_at',)
+    # جستجو بعد از ordering اجرا می‌شود تا در نبود ordering صریح، نتایج بر اساس ارتباط مرتب شوند
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, BookFullTextSearchFilter]
     filterset_fields = ['category', 'author']
-    search_fields = ['title', 'author', 'description', 'isbn']
     ordering_fields = ['price']
     ordering = ['-price']
+    pagination_class = BookPriceKeysetPagination
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -52,7 +80,8 @@ class BookViewSet(viewsets.ModelViewSet):
         queryset = super().get_queryset()
         
         if self.request.user.user_type == 'storekeeper':
-            return queryset.only('id', 'title', 'author', 'total_count', 'available_count')
+            # updated_at لود می‌شود تا save() روی این نمونه‌ها (store_manage) آن را هم به‌روز کند
+            return queryset.only('id', 'title', 'author', 'total_count', 'available_count', 'updated_at')
         
         return queryset
     
@@ -63,18 +92,54 @@ class BookViewSet(viewsets.ModelViewSet):
             return BookStockUpdateSerializer
         return super().get_serializer_class()
     
+    @cached_catalog_response('books')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
     @action(detail=False, methods=['get'])
+    @cached_catalog_response('available_books')
     def available_books(self, request):
-        books = Book.objects.filter(available_count__gt=0)
+        books = self.apply_eager_loading(Book.objects.filter(available_count__gt=0))
         serializer = self.get_serializer(books, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @cached_catalog_response('store_view')
     def store_view(self, request):
         books = self.get_queryset()
         serializer = self.get_serializer(books, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """خروجی استریم کل کاتالوگ (NDJSON یا CSV) با همان فیلترهای لیست کتاب‌ها"""
+        books = self.filter_queryset(self.get_queryset())
+        return streaming_export_response(request, books, self.get_serializer_class(), 'books')
+    
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, JSONParser])
+    def bulk_import(self, request):
+        """ورود گروهی کتاب‌ها از فایل CSV/JSON یا لیست JSON در بدنه درخواست"""
+        upload = request.FILES.get('file')
+        if upload is not None:
+            import_format = request.data.get('import_format') or upload.name.rsplit('.', 1)[-1].lower()
+            if import_format not in IMPORT_FORMATS:
+                return Response(
+                    {'error': f'فرمت ورودی باید یکی از {", ".join(IMPORT_FORMATS)} باشد'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                rows = parse_rows(upload.read(), import_format)
+            except (ValueError, UnicodeDecodeError) as e:
+                return Response({'error': f'فایل قابل خواندن نیست: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            rows = request.data if isinstance(request.data, list) else request.data.get('books')
+        
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': 'هیچ ردیفی برای ورود ارسال نشده'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        report = BookImporter().run(rows)
+        return Response(report, status=status.HTTP_200_OK)
+    
     @action(detail=True, methods=['patch'])
     def store_manage(self, request, pk=None):
         book = self.get_object()
@@ -94,7 +159,7 @@ class BookViewSet(viewsets.ModelViewSet):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class InventoryViewSet(viewsets.ReadOnlyModelViewSet):
+class InventoryViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = InventorySerializer
     permission_classes = [IsAdminOrStorekeeper]
     
@@ -108,6 +173,12 @@ class InventoryViewSet(viewsets.ReadOnlyModelViewSet):
         
         return Inventory.objects.none()
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """خروجی استریم انبار (NDJSON یا CSV)"""
+        inventories = self.filter_queryset(self.get_queryset())
+        return streaming_export_response(request, inventories, self.get_serializer_class(), 'inventory')
+    
     @action(detail=True, methods=['post'], permission_classes=[IsAdminOrStorekeeper])
     def replenish(self, request, pk=None):
         inventory = self.get_object()
@@ -130,110 +201,81 @@ class InventoryViewSet(viewsets.ReadOnlyModelViewSet):
 
 class StorekeeperDashboardView(APIView):
     permission_classes = [IsStorekeeper]
+    pagination_class = BookKeysetPagination
+    MAX_STOCK_UPDATES = 5000
 
     def get(self, request):
-        # فقط یک query به دیتابیس با annotate برای کارایی بهتر
-        books_data = Book.objects.aggregate(
-            total_books=models.Count('id'),
-            low_stock_books=models.Count('id', filter=models.Q(available_count__lt=5)),
-            out_of_stock_books=models.Count('id', filter=models.Q(available_count=0))
-        )
+        # آمار از خلاصه‌ای خوانده می‌شود که با هر تغییر موجودی به‌روز می‌شود (بدون اسکن جدول)
+        books_data = StockStats.get().as_dict()
         
-        # گرفتن کتاب‌ها با pagination
-        books = Book.objects.only('id', 'title', 'author', 'total_count', 'available_count')
-        page = self.paginate_queryset(books)
+        try:
+            low_stock_limit = min(int(request.query_params.get('low_stock_limit', 10)), 100)
+        except ValueError:
+            low_stock_limit = 10
+        # کم‌موجودترین کتاب‌ها از ایندکس (available_count, id) خوانده می‌شوند
+        low_stock = Book.objects.filter(
+            available_count__lt=StockStats.LOW_STOCK_THRESHOLD
+        ).only('id', 'title', 'author', 'total_count', 'available_count').order_by('available_count', 'id')[:low_stock_limit]
+        low_stock_data = BookStoreSerializer(low_stock, many=True).data
+        
+        # گرفتن کتاب‌ها با pagination (keyset روی created_at,id)
+        books = Book.objects.only('id', 'title', 'author', 'total_count', 'available_count', 'created_at')
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(books, request, view=self)
         if page is not None:
             serializer = BookStoreSerializer(page, many=True)
-            return self.get_paginated_response({
+            return paginator.get_paginated_response({
                 'books': serializer.data,
-                'stats': books_data
+                'stats': books_data,
+                'low_stock': low_stock_data
             })
         
         serializer = BookStoreSerializer(books, many=True)
         return Response({
             'books': serializer.data,
-            'stats': books_data
+            'stats': books_data,
+            'low_stock': low_stock_data
         })
     
-    def paginate_queryset(self, queryset):
-        # پیاده‌سازی ساده pagination
-        page_size = self.request.query_params.get('page_size', 20)
-        page = self.request.query_params.get('page', 1)
-        
-        try:
-            page_size = int(page_size)
-            page = int(page)
-        except (ValueError, TypeError):
-            return None
-        
-        start = (page - 1) * page_size
-        end = start + page_size
-        
-        return list(queryset[start:end])
-
     def patch(self, request):
         updates = request.data.get('updates', [])
         
+        if not isinstance(updates, list):
+            return Response({'error': 'updates باید یک لیست باشد'}, status=status.HTTP_400_BAD_REQUEST)
+        
         # بررسی محدودیت تعداد به روزرسانی‌ها در یک درخواست
-        if len(updates) > 50:
+        if len(updates) > self.MAX_STOCK_UPDATES:
             return Response(
-                {'error': 'تعداد به روزرسانی‌ها نمی‌تواند بیشتر از ۵۰ مورد باشد'},
+                {'error': f'تعداد به روزرسانی‌ها نمی‌تواند بیشتر از {self.MAX_STOCK_UPDATES} مورد باشد'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        results = []
-        successful_updates = 0
-        
-        for update in updates:
-            book_id = update.get('book_id')
+        results = [None] * len(updates)
+        pending = []
+        for index, update in enumerate(updates):
+            book_id = update.get('book_id') if isinstance(update, dict) else None
             if not book_id:
-                results.append({
+                results[index] = {
                     'book_id': None, 
                     'status': 'error', 
                     'message': 'شناسه کتاب ارائه نشده'
-                })
+                }
                 continue
-                
-            try:
-                book = Book.objects.get(id=book_id)
-                
-                # بررسی اینکه کاربر به این کتاب دسترسی دارد
-                # (اگر نیاز به کنترل دسترسی دقیق‌تر دارید)
-                
-                serializer = BookStockUpdateSerializer(
-                    book, 
-                    data=update, 
-                    partial=True,
-                    context={'request': request}  # افزودن context برای دسترسی به request در serializer
-                )
-                
-                if serializer.is_valid():
-                    serializer.save()
-                    results.append({
-                        'book_id': book_id, 
-                        'status': 'success', 
-                        'message': 'موجودی با موفقیت به‌روز شد'
-                    })
-                    successful_updates += 1
-                else:
-                    results.append({
-                        'book_id': book_id, 
-                        'status': 'error', 
-                        'message': serializer.errors
-                    })
-            except Book.DoesNotExist:
-                results.append({
-                    'book_id': book_id, 
-                    'status': 'error', 
-                    'message': 'کتاب یافت نشد'
-                })
-            except Exception as e:
-                results.append({
+            pending.append((index, book_id, update))
+        
+        try:
+            with transaction.atomic():
+                successful_updates = self._apply_stock_updates(pending, results)
+        except Exception as e:
+            for index, book_id, _ in pending:
+                results[index] = {
                     'book_id': book_id, 
                     'status': 'error', 
                     'message': f'خطای سیستمی: {str(e)}'
-                })
+                }
+            successful_updates = 0
         
+        all_applied = successful_updates == len(updates)
         return Response({
             'results': results,
             'summary': {
@@ -241,18 +283,117 @@ class StorekeeperDashboardView(APIView):
                 'successful_updates': successful_updates,
                 'failed_updates': len(updates) - successful_updates
             }
-        }, status=status.HTTP_200_OK)
+        }, status=status.HTTP_200_OK if all_applied else status.HTTP_400_BAD_REQUEST)
+
+    def _apply_stock_updates(self, pending, results):
+        """
+        اعمال همه به‌روزرسانی‌ها با یک SELECT (id__in) و یک bulk_update.
+        قانون available_count <= total_count روی مقادیر نهایی هر کتاب در حافظه بررسی می‌شود.
+        همه یا هیچ: اگر حتی یک مورد خطا داشته باشد هیچ تغییری ذخیره نمی‌شود.
+        """
+        book_ids = set()
+        for _, book_id, _ in pending:
+            try:
+                book_ids.add(int(book_id))
+            except (TypeError, ValueError):
+                pass
+        
+        books = Book.objects.select_for_update().only(
+            'id', 'total_count', 'available_count'
+        ).in_bulk(book_ids)
+        stock_fields = BookStockUpdateSerializer().fields
+        changed = {}
+        successful_updates = 0
+        
+        for index, book_id, update in pending:
+            try:
+                book = books.get(int(book_id))
+            except (TypeError, ValueError):
+                book = None
+            if book is None:
+                results[index] = {
+                    'book_id': book_id, 
+                    'status': 'error', 
+                    'message': 'کتاب یافت نشد'
+                }
+                continue
+            
+            values, errors = {}, {}
+            for name, field in stock_fields.items():
+                if name in update:
+                    try:
+                        values[name] = field.run_validation(update[name])
+                    except serializers.ValidationError as e:
+                        errors[name] = e.detail
+            
+            total = values.get('total_count', book.total_count)
+            available = values.get('available_count', book.available_count)
+            if not errors and available > total:
+                errors['non_field_errors'] = ['تعداد موجود نمی‌تواند از تعداد کل بیشتر باشد']
+            
+            if errors:
+                results[index] = {
+                    'book_id': book_id, 
+                    'status': 'error', 
+                    'message': errors
+                }
+                continue
+            
+            book.total_count = total
+            book.available_count = available
+            changed[book.pk] = book
+            results[index] = {
+                'book_id': book_id, 
+                'status': 'success', 
+                'message': 'موجودی با موفقیت به‌روز شد'
+            }
+            successful_updates += 1
+        
+        if successful_updates < len(results):
+            for index, result in enumerate(results):
+                if result['status'] == 'success':
+                    results[index] = {
+                        'book_id': result['book_id'], 
+                        'status': 'error', 
+                        'message': 'به دلیل خطای سایر موارد اعمال نشد'
+                    }
+            return 0
+        
+        # bulk_update مقدار auto_now را تنظیم نمی‌کند
+        now = timezone.now()
+        for book in changed.values():
+            book.updated_at = now
+        Book.objects.bulk_update(
+            changed.values(), ['total_count', 'available_count', 'updated_at'], batch_size=500
+        )
+        if changed:
+            # bulk_update سیگنال ندارد؛ آمار موجودی بر اساس مقادیر زمان خواندن به‌روز می‌شود
+            record_stock_changes(
+                StockChange(book.pk, book._loaded_available_count, book.available_count)
+                for book in changed.values()
+            )
+            for book in changed.values():
+                book._loaded_available_count = book.available_count
+            bump_catalog_version_on_commit()
+        return successful_updates
 
-class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
+class TransactionViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
 
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    pagination_class = TransactionKeysetPagination
     
     def get_queryset(self):
         if self.request.user.user_type == 'admin':
             return Transaction.objects.all()
         return Transaction.objects.filter(user=self.request.user)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """خروجی استریم تاریخچه تراکنش‌ها (NDJSON یا CSV)"""
+        transactions = self.filter_queryset(self.get_queryset())
+        return streaming_export_response(request, transactions, self.get_serializer_class(), 'transactions')
+
     @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated]) 
     @transaction.atomic
     def request_book(self, request):
@@ -264,39 +405,112 @@ class TransactionViewSet(viewsets.ReadOnlyModelViewSet):
             quantity = serializer.validated_data['quantity']
             
             try:
-                book = Book.objects.select_for_update().get(id=book_id) 
-                
-                if book.available_count < quantity:
-                    return Response(
-                        {'error': 'تعداد کتاب درخواستی بیش از حد موجود است!'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                book.available_count -= quantity
-                book.save(update_fields=['available_count']) 
-                
-                transaction = Transaction.objects.create(
-                    user=request.user,
-                    book=book,
-                    transaction_type=transaction_type,
-                    quantity=quantity
+                # موتور کم کردن موجودی با LIBRARY_CHECKOUT_ENGINE انتخاب می‌شود (locking یا conditional)
+                book = get_checkout_engine()(book_id, quantity)
+            except InsufficientStock:
+                return Response(
+                    {'error': 'تعداد کتاب درخواستی بیش از حد موجود است!'},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                
-                result_serializer = TransactionSerializer(transaction)
-                return Response(result_serializer.data, status=status.HTTP_201_CREATED)
-                
             except Book.DoesNotExist:
                 return Response(
                     {'error': 'کتاب مورد نظر یافت نشد!'},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            
+            transaction = Transaction.objects.create(
+                user=request.user,
+                book=book,
+                transaction_type=transaction_type,
+                quantity=quantity
+            )
+            
+            result_serializer = TransactionSerializer(transaction)
+            return Response(result_serializer.data, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class BookStockUpdateViewSet(mixins.UpdateModelMixin,
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def checkout_cart(self, request):
+        """ثبت چند کتاب (قرض یا خرید) در یک درخواست اتمیک؛ یا همه اقلام ثبت می‌شوند یا هیچ‌کدام"""
+        serializer = CartCheckoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        items = serializer.validated_data['items']
+        try:
+            transactions = checkout_cart(request.user, items)
+        except CartCheckoutError as e:
+            return Response({'results': e.results}, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = [
+            {
+                'book_id': item['book_id'],
+                'status': 'success',
+                'transaction': data,
+            }
+            for item, data in zip(items, TransactionSerializer(transactions, many=True).data)
+        ]
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+class TransactionAnalyticsView(APIView):
+    """
+    گزارش قرض و فروش در بازه‌های ساعتی/روزانه؛ فقط از جدول خلاصه TransactionRollup خوانده می‌شود.
+    تراکنش‌های چند دقیقه اخیر (بعد از last_transaction_id) هنوز در خلاصه نیستند.
+    """
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        serializer = TransactionAnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        filters = {}
+        if 'transaction_type' in params:
+            filters['transaction_type'] = params['transaction_type']
+        if 'category' in params:
+            filters['category_id'] = params['category']
+        if 'book' in params:
+            filters['book_id'] = params['book']
+
+        results = query_rollups(params['granularity'], params['start'], params['end'], params['group_by'], filters)
+        return Response({
+            'granularity': params['granularity'],
+            'start': params['start'],
+            'end': params['end'],
+            'group_by': params['group_by'],
+            'last_transaction_id': rollup_watermark(),
+            'results': list(results),
+        })
+
+
+class BookStockUpdateViewSet(ConditionalGetMixin,
+                             mixins.UpdateModelMixin,
                              mixins.RetrieveModelMixin,
                              viewsets.GenericViewSet):
-    queryset = Book.objects.only('id', 'title', 'author', 'total_count', 'available_count')
+    queryset = Book.objects.only('id', 'title', 'author', 'total_count', 'available_count', 'updated_at')
     serializer_class = BookStockUpdateSerializer
     permission_classes = [IsStorekeeper]
 
+    @action(detail=True, methods=['get'])
+    def stock_at(self, request, pk=None):
+        """موجودی در دسترس کتاب در یک زمان گذشته (?at=2025-01-01T12:00:00) از روی دفتر گردش موجودی"""
+        book = self.get_object()
+        at = parse_datetime(request.query_params.get('at', ''))
+        if at is None:
+            return Response(
+                {'error': 'پارامتر at باید یک تاریخ و زمان معتبر باشد'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        result = stock_at(book.id, at)
+        return Response({
+            'book_id': book.id,
+            'at': at,
+            'available_count': result.available_count,
+            # در بازه‌های فشرده شده مقدار مربوط به زمان عکس موجودی (as_of) است، نه خود at
+            'as_of': result.as_of,
+            'exact': result.exact,
+        })
+
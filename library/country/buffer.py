@@ -0,0 +1,303 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import UserLocation
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PATTERN = 'locations-{pid}-{sequence}.jsonl'
+QUARANTINE_PATTERN = 'quarantine-{pid}.jsonl'
+# فاصله تلاش دوباره بعد از flush ناموفق (ثانیه)؛ با هر شکست پشت سر هم دو برابر می‌شود
+RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 60.0
+
+
+class BufferFull(Exception):
+    """صف به max_depth رسیده است (معمولاً چون دیتابیس در دسترس نیست)"""
+
+
+def _to_location(record):
+    values = dict(record)
+    if isinstance(values['created_at'], str):
+        values['created_at'] = parse_datetime(values['created_at'])
+    return UserLocation(**values)
+
+
+def insert_locations(records, batch_size):
+    """
+    درج رکوردها با bulk_create. اگر خطا مربوط به داده باشد (نه اتصال دیتابیس)، دسته نصف می‌شود تا
+    رکوردهای خراب جدا شوند؛ خروجی لیست رکوردهای رد شده است. خطاهای اتصال به فراخواننده می‌رسند.
+    """
+    locations, rejected = [], []
+    for record in records:
+        try:
+            locations.append((record, _to_location(record)))
+        except (KeyError, TypeError, ValueError):
+            rejected.append(record)
+
+    def insert(chunk):
+        if not chunk:
+            return []
+        try:
+            with transaction.atomic():
+                UserLocation.objects.bulk_create([location for _record, location in chunk], batch_size=batch_size)
+            return []
+        except (IntegrityError, DataError):
+            if len(chunk) == 1:
+                return [chunk[0][0]]
+            middle = len(chunk) // 2
+            return insert(chunk[:middle]) + insert(chunk[middle:])
+
+    return rejected + insert(locations)
+
+
+def quarantine(records, spool_dir):
+    """نگه داشتن رکوردهایی که قابل درج نیستند تا صف بعدی‌ها را برای همیشه متوقف نکنند"""
+    if not records:
+        return
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, QUARANTINE_PATTERN.format(pid=os.getpid()))
+        with open(path, 'a', encoding='utf-8') as output:
+            for record in records:
+                output.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+        logger.error('%s موقعیت کاربر قابل درج نبود و در %s ذخیره شد', len(records), path)
+    else:
+        for record in records:
+            logger.error('موقعیت کاربر قابل درج نبود: %s', json.dumps(record, default=str, ensure_ascii=False))
+
+
+def _spool_pid(path):
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LocationWriteBuffer:
+    """
+    صف write-behind موقعیت‌های کاربر در حافظه پروسه: رکوردها بعد از اعتبارسنجی اضافه می‌شوند و
+    با رسیدن به batch_size یا گذشتن flush_interval از قدیمی‌ترین رکورد، با یک bulk_create درج می‌شوند.
+    در max_depth رکورد جدید با BufferFull رد می‌شود و بعد از flush ناموفق تلاش دوباره با تأخیر فزاینده است.
+
+    اگر spool_dir تنظیم شده باشد هر رکورد قبل از پذیرفته شدن در فایل jsonl مخصوص همین پروسه نوشته
+    می‌شود و فایل فقط بعد از درج موفق حذف می‌شود (تحویل حداقل یک بار)؛ فایل‌های پروسه‌های از کار افتاده
+    با فرمان replay_location_spool درج می‌شوند.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=2.0, max_depth=5000, spool_dir=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        self.spool_dir = spool_dir
+
+        self._records = deque()
+        self._oldest_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._retry_at = 0.0
+        self._backoff = 0.0
+
+        self._spool = None
+        self._spool_sequence = 0
+        self._spool_segments = []
+
+        self.high_water = 0
+        self.flushed = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.rejected = 0
+        self.quarantined = 0
+        self.last_flush_at = None
+        self.last_flush_seconds = None
+
+    def _start(self):
+        # بعد از fork (مثلاً worker های gunicorn) thread و فایل spool برای پروسه جدید ساخته می‌شوند
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._records.clear()
+        self._spool, self._spool_segments = None, []
+        self._thread = threading.Thread(target=self._run, name='location-write-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _open_spool_segment(self):
+        self._spool_sequence += 1
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, SPOOL_PATTERN.format(pid=self._pid, sequence=self._spool_sequence))
+        self._spool = open(path, 'a', encoding='utf-8')
+        self._spool_segments.append(path)
+
+    def add(self, record):
+        """افزودن یک رکورد (دیکشنری فیلدهای UserLocation) به صف؛ اگر صف پر باشد BufferFull"""
+        with self._lock:
+            self._start()
+            if len(self._records) >= self.max_depth:
+                self.rejected += 1
+                raise BufferFull()
+            if self.spool_dir:
+                if self._spool is None:
+                    self._open_spool_segment()
+                self._spool.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+                self._spool.flush()
+            if not self._records:
+                self._oldest_at = time.monotonic()
+            self._records.append(record)
+            depth = len(self._records)
+            self.high_water = max(self.high_water, depth)
+
+        if depth >= self.batch_size:
+            self._wake.set()
+
+    def _take(self):
+        with self._lock:
+            records = list(self._records)
+            self._records.clear()
+            self._oldest_at = None
+            segments = self._spool_segments
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+            self._spool_segments = []
+            return records, segments
+
+    def _restore(self, records, segments):
+        with self._lock:
+            self._records.extendleft(reversed(records))
+            self._oldest_at = time.monotonic()
+            self._spool_segments[:0] = segments
+
+    def flush(self):
+        """
+        درج همه رکوردهای صف. در خطای اتصال رکوردها به صف برمی‌گردند، فایل‌های spool حفظ می‌شوند و
+        flush بعدی پس‌زمینه تا پایان backoff انجام نمی‌شود؛ رکوردهای خراب جدا (quarantine) می‌شوند.
+        """
+        with self._flush_lock:
+            records, segments = self._take()
+            if not records:
+                return 0
+            start = time.monotonic()
+            try:
+                bad = insert_locations(records, self.batch_size)
+            except Exception:
+                self.failed_flushes += 1
+                self._backoff = min(max(self._backoff * 2, RETRY_BACKOFF), MAX_RETRY_BACKOFF)
+                self._retry_at = time.monotonic() + self._backoff
+                self._restore(records, segments)
+                logger.exception('درج %s موقعیت کاربر از صف write-behind ناموفق بود', len(records))
+                return 0
+
+            self._backoff, self._retry_at = 0.0, 0.0
+            quarantine(bad, self.spool_dir)
+            for path in segments:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            inserted = len(records) - len(bad)
+            self.quarantined += len(bad)
+            self.flushed += inserted
+            self.flush_count += 1
+            self.last_flush_at = time.time()
+            self.last_flush_seconds = time.monotonic() - start
+            logger.debug('%s موقعیت کاربر در %.3f ثانیه درج شد', inserted, self.last_flush_seconds)
+            return inserted
+
+    def _due(self):
+        with self._lock:
+            now = time.monotonic()
+            return bool(self._records) and now >= self._retry_at and (
+                len(self._records) >= self.batch_size
+                or now - self._oldest_at >= self.flush_interval
+            )
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._due():
+                close_old_connections()
+                self.flush()
+
+    def stats(self):
+        """متریک‌های صف در همین پروسه"""
+        with self._lock:
+            depth = len(self._records)
+            oldest_age = time.monotonic() - self._oldest_at if self._records else 0
+            spooled_segments = len(self._spool_segments)
+            retry_in = max(self._retry_at - time.monotonic(), 0)
+        return {
+            'pid': os.getpid(),
+            'depth': depth,
+            'max_depth': self.max_depth,
+            'high_water': self.high_water,
+            'oldest_age_seconds': round(oldest_age, 3),
+            'flushed': self.flushed,
+            'flush_count': self.flush_count,
+            'failed_flushes': self.failed_flushes,
+            'retry_in_seconds': round(retry_in, 3),
+            'rejected': self.rejected,
+            'quarantined': self.quarantined,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_seconds': self.last_flush_seconds,
+            'spool_segments': spooled_segments,
+        }
+
+
+def replay_spool(spool_dir, include_live=False, batch_size=500):
+    """
+    درج فایل‌های spool باقی‌مانده از پروسه‌هایی که قبل از flush متوقف شده‌اند؛
+    فایل پروسه‌های در حال اجرا (مگر با include_live) دست نمی‌خورد و رکوردهای خراب quarantine می‌شوند.
+    خروجی: (تعداد فایل، تعداد رکورد درج شده)
+    """
+    files, total = 0, 0
+    for path in sorted(glob.glob(os.path.join(spool_dir, SPOOL_PATTERN.format(pid='*', sequence='*')))):
+        pid = _spool_pid(path)
+        if not include_live and pid is not None and _process_alive(pid):
+            continue
+        with open(path, encoding='utf-8') as spool:
+            # خط آخر ممکن است هنگام توقف پروسه نیمه‌کاره نوشته شده باشد
+            records = []
+            for line in spool:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning('خط نامعتبر در %s نادیده گرفته شد', path)
+        bad = insert_locations(records, batch_size)
+        quarantine(bad, spool_dir)
+        os.remove(path)
+        files += 1
+        total += len(records) - len(bad)
+    return files, total
+
+
+location_buffer = LocationWriteBuffer(
+    batch_size=settings.GEO_LOCATION_BUFFER_SIZE,
+    flush_interval=settings.GEO_LOCATION_FLUSH_INTERVAL,
+    max_depth=settings.GEO_LOCATION_BUFFER_MAX_DEPTH,
+    spool_dir=settings.GEO_LOCATION_SPOOL_DIR,
+)
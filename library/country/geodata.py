@@ -0,0 +1,429 @@
+import hashlib
+import importlib.metadata
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from heapq import nlargest
+
+from django.conf import settings
+from geonamescache import GeonamesCache
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'GEOD'
+FORMAT_VERSION = 2
+# magic, version, md5 محتوا، سپس تعدادها و offset بخش‌ها
+_HEADER = struct.Struct('<4sI16s12I')
+COUNTRY_FIELDS = 6   # name, code, province_start, province_count, suggestion_start, suggestion_count
+PROVINCE_FIELDS = 4  # name, city_start, city_count, hidden
+SUGGESTION_FIELDS = 5  # key, kind, name, province, weight
+HIDDEN_PROVINCE = 'Unknown'
+
+CITY = 'city'
+PROVINCE = 'province'
+SUGGESTION_KINDS = (CITY, PROVINCE)
+# حداکثر تعداد پیشنهاد در هر پاسخ جستجوی پیشوندی
+TYPEAHEAD_LIMIT = 20
+_MAX_WEIGHT = 0xFFFFFFFF
+
+_PERSIAN_LETTERS = str.maketrans({
+    '\u064a': '\u06cc',  # ي عربی ← ی فارسی
+    '\u0649': '\u06cc',  # ى
+    '\u0643': '\u06a9',  # ك ← ک
+    '\u0629': '\u0647',  # ة ← ه
+    '\u06d5': '\u0647',  # ە (باقی‌مانده ۀ بعد از حذف همزه)
+    '\u0640': None,       # کشیده
+    '\u200c': ' ',        # نیم‌فاصله
+    '\u200e': None,
+    '\u200f': None,
+})
+
+
+def normalize_name(text):
+    """
+    کلید مقایسه نام‌ها: بدون حساسیت به حروف بزرگ/کوچک و اعراب (لاتین و عربی)،
+    با یکسان‌سازی ی/ک عربی و فارسی، همزه‌ها و نیم‌فاصله.
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+    return ' '.join(stripped.translate(_PERSIAN_LETTERS).casefold().split())
+
+
+def _is_arabic_script(text):
+    return any('\u0600' <= ch <= '\u06ff' or '\ufb50' <= ch <= '\ufeff' for ch in text)
+
+
+def build_suggestions(manager):
+    """
+    پیشنهادهای جستجوی پیشوندی هر کشور: {code: [(key, kind, name, province, weight), ...]} مرتب بر اساس key.
+    برای شهرها نام اصلی و نام‌های جایگزین به خط عربی/فارسی کلید می‌شوند؛ وزن، جمعیت است.
+    """
+    suggestions = defaultdict(dict)
+    province_weights = defaultdict(int)
+    for city_data in manager.cities_data.values():
+        country_code = city_data['countrycode']
+        province_name = city_data.get('admin1name') or ''
+        population = city_data.get('population') or 0
+        names = [city_data['name']]
+        names.extend(name for name in city_data.get('alternatenames', ()) if _is_arabic_script(name))
+        for name in names:
+            key = normalize_name(name)
+            if key:
+                entry = (key, CITY, city_data['name'], province_name)
+                suggestions[country_code][entry] = max(suggestions[country_code].get(entry, 0), population)
+        if province_name and province_name != HIDDEN_PROVINCE:
+            province_weights[(country_code, province_name)] += population
+
+    for (country_code, province_name), weight in province_weights.items():
+        suggestions[country_code][(normalize_name(province_name), PROVINCE, province_name, '')] = weight
+
+    return {
+        country_code: sorted((*entry, min(weight, _MAX_WEIGHT)) for entry, weight in entries.items())
+        for country_code, entries in suggestions.items()
+    }
+
+
+def _top_suggestions(candidates, limit):
+    """پرجمعیت‌ترین پیشنهادها؛ یک شهر که با چند نام جایگزین پیدا شده فقط یک بار برگردانده می‌شود"""
+    results, seen = [], set()
+    for kind, name, province_name, _weight in nlargest(limit * 4, candidates, key=lambda row: row[3]):
+        if (kind, name, province_name) not in seen:
+            seen.add((kind, name, province_name))
+            results.append((kind, name, province_name))
+            if len(results) == limit:
+                break
+    return tuple(results)
+
+
+class TypeaheadMixin:
+    """جستجوی پیشوندی و دقیق نام‌ها؛ نتیجه هر کلید در حافظه پروسه نگه داشته می‌شود"""
+
+    def _matches(self, country_code, low_key, high_key, kind):
+        if not hasattr(self, '_cached_matches'):
+            self._cached_matches = lru_cache(maxsize=8192)(self._key_range_matches)
+        return self._cached_matches(country_code, low_key, high_key, kind)
+
+    def autocomplete(self, country_code, query, kind=None, limit=10):
+        """شهرها/استان‌هایی از کشور که نامشان با query شروع می‌شود (حداکثر limit مورد)"""
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+        matches = self._matches(country_code, prefix, prefix + '\U0010ffff', kind)
+        return [
+            {'name': name, 'province': province_name, 'type': match_kind}
+            for match_kind, name, province_name in matches[:min(limit, TYPEAHEAD_LIMIT)]
+        ]
+
+    def lookup(self, country_code, name, kind):
+        """
+        نام‌های اصلی (name, province) شهرها یا استان‌هایی که نام یا نام جایگزینشان پس از
+        نرمال‌سازی دقیقاً برابر name است؛ مثلاً «طهران» یا «tehran» به Tehran می‌رسد.
+        """
+        key = normalize_name(name)
+        if not key:
+            return []
+        return [
+            (match_name, province_name)
+            for _kind, match_name, province_name in self._matches(country_code, key, key + '\0', kind)
+        ]
+
+    def find_country(self, value):
+        """کشور با کد دو حرفی یا نام (بدون حساسیت به حروف و اعراب)؛ در غیر این صورت None"""
+        if not hasattr(self, '_country_keys'):
+            keys = {}
+            for country in self.get_countries():
+                keys[normalize_name(country['name'])] = country
+                keys[country['code'].casefold()] = country
+            self._country_keys = keys
+        return self._country_keys.get(normalize_name(value))
+
+
+class GeoDataManager(TypeaheadMixin):
+    """
+    داده‌های جغرافیایی geonamescache با ایندکس تودرتوی کشور ← استان ← شهر که یک بار ساخته می‌شود؛
+    هر سه متد فقط یک جستجوی دیکشنری هستند.
+    """
+
+    def __init__(self):
+        self.gc = GeonamesCache()
+        self.countries_data = self.gc.get_countries()
+        self.cities_data = self.gc.get_cities()
+        # داده فقط با نسخه بسته geonamescache تغییر می‌کند
+        self.dataset_version = f"geonamescache-{importlib.metadata.version('geonamescache')}"
+        self._build_index()
+
+    def _build_index(self):
+        self._countries = tuple(sorted(
+            ({'name': data['name'], 'code': code} for code, data in self.countries_data.items()),
+            key=lambda x: x['name']
+        ))
+
+        cities = defaultdict(list)
+        for city_data in self.cities_data.values():
+            province_name = city_data.get('admin1name')
+            if province_name:
+                cities[(city_data['countrycode'], province_name)].append(city_data['name'])
+        self._cities = {key: tuple(sorted(names)) for key, names in cities.items()}
+
+        provinces = defaultdict(list)
+        for country_code, province_name in self._cities:
+            if province_name != HIDDEN_PROVINCE:
+                provinces[country_code].append(province_name)
+        self._provinces = {code: tuple(sorted(names)) for code, names in provinces.items()}
+
+    def get_countries(self):
+        """دریافت لیست همه کشورها"""
+        return list(self._countries)
+
+    def get_provinces(self, country_code):
+        """دریافت استان‌های یک کشور"""
+        return list(self._provinces.get(country_code, ()))
+
+    def get_cities(self, country_code, province_name):
+        """دریافت شهرهای یک استان"""
+        return list(self._cities.get((country_code, province_name), ()))
+
+    def _key_range_matches(self, country_code, low_key, high_key, kind):
+        if not hasattr(self, '_suggestions'):
+            self._suggestions = {
+                code: ([row[0] for row in rows], rows) for code, rows in build_suggestions(self).items()
+            }
+        keys, rows = self._suggestions.get(country_code, ((), ()))
+        low = bisect_left(keys, low_key)
+        high = bisect_left(keys, high_key, low)
+        candidates = (row[1:] for row in rows[low:high] if kind is None or row[1] == kind)
+        return _top_suggestions(candidates, TYPEAHEAD_LIMIT)
+
+
+def compile_geo_data(manager):
+    """
+    تبدیل ایندکس GeoDataManager به فایل باینری فشرده: جدول رشته‌ها (offset ها + بایت‌های utf-8)
+    و آرایه‌های uint32 کشورها، استان‌ها، شهرها و پیشنهادهای جستجوی پیشوندی که همه به ترتیب مرتب شده‌اند.
+    """
+    string_ids = {}
+    strings = []
+
+    def sid(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    provinces_by_country = defaultdict(list)
+    for country_code, province_name in manager._cities:
+        provinces_by_country[country_code].append(province_name)
+
+    suggestions_by_country = build_suggestions(manager)
+    countries, provinces, cities, suggestions = array('I'), array('I'), array('I'), array('I')
+    for country in manager._countries:
+        names = sorted(provinces_by_country.get(country['code'], ()))
+        rows = suggestions_by_country.get(country['code'], ())
+        countries.extend((
+            sid(country['name']), sid(country['code']), len(provinces) // PROVINCE_FIELDS, len(names),
+            len(suggestions) // SUGGESTION_FIELDS, len(rows),
+        ))
+        for key, kind, name, province_name, weight in rows:
+            suggestions.extend((sid(key), SUGGESTION_KINDS.index(kind), sid(name), sid(province_name), weight))
+        for province_name in names:
+            city_names = manager._cities[(country['code'], province_name)]
+            provinces.extend((
+                sid(province_name), len(cities), len(city_names), int(province_name == HIDDEN_PROVINCE)
+            ))
+            cities.extend(sid(name) for name in city_names)
+
+    codes = [country['code'] for country in manager._countries]
+    country_by_code = array('I', sorted(range(len(codes)), key=codes.__getitem__))
+
+    blob = bytearray()
+    string_offsets = array('I', [0])
+    for value in strings:
+        blob += value.encode('utf-8')
+        string_offsets.append(len(blob))
+    blob += b'\0' * (-len(blob) % 4)
+
+    sections = [string_offsets, blob, countries, country_by_code, provinces, cities, suggestions]
+    if sys.byteorder != 'little':
+        for section in sections:
+            if isinstance(section, array):
+                section.byteswap()
+    payloads = [bytes(section) if isinstance(section, bytearray) else section.tobytes() for section in sections]
+
+    offsets, position = [], _HEADER.size
+    for payload in payloads:
+        offsets.append(position)
+        position += len(payload)
+    body = b''.join(payloads)
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, hashlib.md5(body).digest(),
+        len(strings), len(countries) // COUNTRY_FIELDS, len(provinces) // PROVINCE_FIELDS, len(cities),
+        len(suggestions) // SUGGESTION_FIELDS, *offsets,
+    )
+    return header + body
+
+
+def write_geo_data(path, manager=None):
+    """ساخت فایل در مسیر موقت و جایگزینی اتمیک؛ پروسه‌هایی که فایل قبلی را map کرده‌اند آسیبی نمی‌بینند"""
+    data = compile_geo_data(manager or GeoDataManager())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as output:
+        output.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+class MappedGeoData(TypeaheadMixin):
+    """
+    همان API مربوط به GeoDataManager روی فایل باینری map شده در حافظه؛ صفحه‌های فایل بین همه
+    پروسه‌ها مشترک است و فقط رشته‌هایی که خوانده می‌شوند decode می‌شوند.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self._mm = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, digest, n_strings, n_countries, n_provinces, n_cities, n_suggestions,
+         *offsets) = _HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path}: فایل داده جغرافیایی نامعتبر یا قدیمی است')
+        if sys.byteorder != 'little':
+            raise ValueError('فایل داده جغرافیایی فقط روی سیستم little-endian قابل map است')
+
+        self.dataset_version = digest.hex()
+        view = memoryview(self._mm)
+        str_offsets, blob, countries, by_code, provinces, cities, suggestions = offsets
+        self._string_offsets = view[str_offsets:str_offsets + (n_strings + 1) * 4].cast('I')
+        self._blob = blob
+        self._countries = view[countries:countries + n_countries * COUNTRY_FIELDS * 4].cast('I')
+        self._country_by_code = view[by_code:by_code + n_countries * 4].cast('I')
+        self._provinces = view[provinces:provinces + n_provinces * PROVINCE_FIELDS * 4].cast('I')
+        self._cities = view[cities:cities + n_cities * 4].cast('I')
+        self._suggestions = view[suggestions:suggestions + n_suggestions * SUGGESTION_FIELDS * 4].cast('I')
+        self._n_countries = n_countries
+
+    def _string(self, string_id):
+        start = self._blob + self._string_offsets[string_id]
+        end = self._blob + self._string_offsets[string_id + 1]
+        return self._mm[start:end].decode('utf-8')
+
+    def _find_country(self, country_code):
+        low, high = 0, self._n_countries
+        while low < high:
+            middle = (low + high) // 2
+            index = self._country_by_code[middle]
+            code = self._string(self._countries[index * COUNTRY_FIELDS + 1])
+            if code < country_code:
+                low = middle + 1
+            elif code > country_code:
+                high = middle
+            else:
+                return index
+        return None
+
+    def _country_provinces(self, country_code):
+        index = self._find_country(country_code)
+        if index is None:
+            return range(0)
+        base = index * COUNTRY_FIELDS
+        start = self._countries[base + 2]
+        return range(start, start + self._countries[base + 3])
+
+    def get_countries(self):
+        """دریافت لیست همه کشورها"""
+        return [
+            {'name': self._string(self._countries[base]), 'code': self._string(self._countries[base + 1])}
+            for base in range(0, self._n_countries * COUNTRY_FIELDS, COUNTRY_FIELDS)
+        ]
+
+    def get_provinces(self, country_code):
+        """دریافت استان‌های یک کشور"""
+        return [
+            self._string(self._provinces[index * PROVINCE_FIELDS])
+            for index in self._country_provinces(country_code)
+            if not self._provinces[index * PROVINCE_FIELDS + 3]
+        ]
+
+    def get_cities(self, country_code, province_name):
+        """دریافت شهرهای یک استان"""
+        provinces = self._country_provinces(country_code)
+        low, high = provinces.start, provinces.stop
+        while low < high:
+            middle = (low + high) // 2
+            name = self._string(self._provinces[middle * PROVINCE_FIELDS])
+            if name < province_name:
+                low = middle + 1
+            elif name > province_name:
+                high = middle
+            else:
+                base = middle * PROVINCE_FIELDS
+                start = self._provinces[base + 1]
+                return [self._string(city) for city in self._cities[start:start + self._provinces[base + 2]]]
+        return []
+
+    def _suggestion_bound(self, low, high, key):
+        # اولین پیشنهاد در [low, high) که کلیدش از key کوچک‌تر نیست
+        while low < high:
+            middle = (low + high) // 2
+            if self._string(self._suggestions[middle * SUGGESTION_FIELDS]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _key_range_matches(self, country_code, low_key, high_key, kind):
+        index = self._find_country(country_code)
+        if index is None:
+            return ()
+        start = self._countries[index * COUNTRY_FIELDS + 4]
+        stop = start + self._countries[index * COUNTRY_FIELDS + 5]
+        low = self._suggestion_bound(start, stop, low_key)
+        high = self._suggestion_bound(low, stop, high_key)
+        if low == high:
+            return ()
+
+        # ستون‌های نوع و وزن با یک برش گام‌دار خوانده می‌شوند و رشته‌ها فقط برای پرجمعیت‌ترین ردیف‌ها decode می‌شوند
+        weights = self._suggestions[low * SUGGESTION_FIELDS + 4:high * SUGGESTION_FIELDS:SUGGESTION_FIELDS].tolist()
+        candidates = zip(range(low, high), weights)
+        if kind is not None:
+            kinds = self._suggestions[low * SUGGESTION_FIELDS + 1:high * SUGGESTION_FIELDS:SUGGESTION_FIELDS].tolist()
+            kind_id = SUGGESTION_KINDS.index(kind)
+            candidates = (candidate for candidate, row_kind in zip(candidates, kinds) if row_kind == kind_id)
+        top = nlargest(TYPEAHEAD_LIMIT * 4, candidates, key=lambda candidate: candidate[1])
+        return _top_suggestions((
+            (
+                SUGGESTION_KINDS[self._suggestions[row * SUGGESTION_FIELDS + 1]],
+                self._string(self._suggestions[row * SUGGESTION_FIELDS + 2]),
+                self._string(self._suggestions[row * SUGGESTION_FIELDS + 3]),
+                weight,
+            )
+            for row, weight in top
+        ), TYPEAHEAD_LIMIT)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_geo_manager():
+    """
+    داده جغرافیایی در اولین استفاده بارگذاری می‌شود (نه هنگام import).
+    اگر فایل GEO_DATA_PATH ساخته شده باشد map می‌شود، وگرنه ایندکس در حافظه همین پروسه ساخته می‌شود.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                path = settings.GEO_DATA_PATH
+                if path and os.path.exists(path):
+                    _manager = MappedGeoData(path)
+                else:
+                    logger.warning('فایل %s پیدا نشد؛ داده جغرافیایی در حافظه بارگذاری می‌شود (build_geo_data)', path)
+                    _manager = GeoDataManager()
+    return _manager
@@ -0,0 +1,164 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from country import views
+from country.geodata import GeoDataManager, MappedGeoData, get_geo_manager
+from country.serializers import CitySerializer, CountrySerializer, ProvinceSerializer
+
+
+class LegacyGeoScan:
+    """پیاده‌سازی قبلی (اسکن همه شهرها در هر درخواست) برای مقایسه زمان و خروجی (در تست‌ها)"""
+
+    def __init__(self, manager):
+        self.countries_data = manager.countries_data
+        self.cities_data = manager.cities_data
+
+    def get_countries(self):
+        countries = []
+        for code, data in self.countries_data.items():
+            countries.append({'name': data['name'], 'code': code})
+        return sorted(countries, key=lambda x: x['name'])
+
+    def get_provinces(self, country_code):
+        provinces = set()
+        for city_data in self.cities_data.values():
+            if (city_data['countrycode'] == country_code and
+                city_data.get('admin1name') and
+                city_data['admin1name'] != 'Unknown'):
+                provinces.add(city_data['admin1name'])
+        return sorted(list(provinces))
+
+    def get_cities(self, country_code, province_name):
+        cities = []
+        for city_data in self.cities_data.values():
+            if (city_data['countrycode'] == country_code and
+                city_data.get('admin1name') and
+                city_data['admin1name'] == province_name):
+                cities.append(city_data['name'])
+        return sorted(cities)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def legacy_countries_list(request):
+    """نسخه قبلی view (سریالایز در هر درخواست) فقط برای مقایسه"""
+    return Response(CountrySerializer(get_geo_manager().get_countries(), many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def legacy_provinces_list(request, country_code):
+    provinces = get_geo_manager().get_provinces(country_code.upper())
+    return Response(ProvinceSerializer([{'name': p} for p in provinces], many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def legacy_cities_list(request, country_code, province_name):
+    cities = get_geo_manager().get_cities(country_code.upper(), province_name)
+    return Response(CitySerializer([{'name': c} for c in cities], many=True).data)
+
+
+class Command(BaseCommand):
+    help = 'مقایسه زمان هر درخواست جغرافیایی بین اسکن قبلی، ایندکس در حافظه و فایل map شده'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--country', default='IR')
+        parser.add_argument('--province', help='پیش‌فرض: اولین استان کشور')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=500, help='تعداد درخواست برای مقایسه throughput')
+        parser.add_argument('--prefixes', nargs='+', default=['t', 'te', 'teh', 'ت', 'ته', 'تهر'],
+                            help='پیشوندهای جستجوی autocomplete')
+
+    def handle(self, *args, **options):
+        build_start = time.perf_counter()
+        manager = GeoDataManager()
+        self.stdout.write(f'index build: {(time.perf_counter() - build_start) * 1000:.1f}ms')
+        legacy = LegacyGeoScan(manager)
+
+        country_code = options['country'].upper()
+        provinces = manager.get_provinces(country_code)
+        province_name = options['province'] or (provinces[0] if provinces else '')
+        calls = (
+            ('countries', 'get_countries', ()),
+            ('provinces', 'get_provinces', (country_code,)),
+            ('cities', 'get_cities', (country_code, province_name)),
+        )
+
+        implementations = [('legacy', legacy), ('indexed', manager)]
+        path = settings.GEO_DATA_PATH
+        if path and os.path.exists(path):
+            implementations.append(('mapped', MappedGeoData(path)))
+        else:
+            self.stdout.write(f'{path} پیدا نشد؛ برای مقایسه نسخه map شده ابتدا build_geo_data را اجرا کنید')
+
+        # یکسان بودن خروجی‌ها در country/tests.py بررسی می‌شود؛ اینجا فقط زمان اندازه‌گیری می‌شود
+        for label, method, args in calls:
+            timings = []
+            for name, implementation in implementations:
+                elapsed = self._measure(getattr(implementation, method), args, options['repeat'])
+                timings.append(f'{name}={elapsed * 1000:9.4f}ms')
+            self.stdout.write(f'{label:<10} ' + ' '.join(timings))
+
+        # جستجوی پیشوندی: اولین درخواست هر پیشوند (بدون cache) و درخواست‌های تکراری
+        for prefix in options['prefixes']:
+            expected = manager.autocomplete(country_code, prefix)
+            timings = []
+            for name, implementation in implementations[1:]:
+                start = time.perf_counter()
+                result = implementation.autocomplete(country_code, prefix)
+                cold = time.perf_counter() - start
+                if result != expected:
+                    self.stderr.write(f'autocomplete {prefix!r}: خروجی {name} با ایندکس در حافظه یکسان نیست')
+                warm = self._measure(implementation.autocomplete, (country_code, prefix), options['repeat'])
+                timings.append(f'{name}={cold * 1000:9.4f}ms/{warm * 1000:.4f}ms')
+            self.stdout.write(f'{"q=" + prefix:<10} ' + ' '.join(timings) + f' ({len(expected)} نتیجه)')
+
+        self._bench_responses(country_code, province_name, options['requests'])
+
+    def _bench_responses(self, country_code, province_name, count):
+        """درخواست در ثانیه: view قبلی، پاسخ آماده (200)، پاسخ آماده gzip و پاسخ 304"""
+        factory = APIRequestFactory()
+        endpoints = (
+            ('countries', legacy_countries_list, views.countries_list, {}),
+            ('provinces', legacy_provinces_list, views.provinces_list, {'country_code': country_code}),
+            ('cities', legacy_cities_list, views.cities_list,
+             {'country_code': country_code, 'province_name': province_name}),
+        )
+        for label, legacy_view, view, kwargs in endpoints:
+            legacy = legacy_view(factory.get('/'), **kwargs).render()
+            current = view(factory.get('/'), **kwargs)
+            if current.content != legacy.content:
+                self.stderr.write(f'{label}: بدنه پاسخ آماده با view قبلی یکسان نیست')
+
+            etag = current['ETag']
+            scenarios = (
+                ('legacy', legacy_view, {}),
+                ('rendered', view, {}),
+                ('gzip', view, {'HTTP_ACCEPT_ENCODING': 'gzip'}),
+                ('304', view, {'HTTP_IF_NONE_MATCH': etag}),
+            )
+            rates = []
+            for name, func, headers in scenarios:
+                request = factory.get('/', **headers)
+                start = time.perf_counter()
+                for _ in range(count):
+                    response = func(request, **kwargs)
+                    if hasattr(response, 'render'):
+                        response.render()
+                rates.append(f'{name}={count / (time.perf_counter() - start):9.0f}/s')
+            self.stdout.write(f'{label:<10} ' + ' '.join(rates) + f' ({len(current.content)} بایت)')
+
+    @staticmethod
+    def _measure(func, args, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(*args)
+        return (time.perf_counter() - start) / repeat
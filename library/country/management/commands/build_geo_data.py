@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from country.geodata import write_geo_data
+
+
+class Command(BaseCommand):
+    help = 'ساخت فایل باینری داده‌های جغرافیایی (GEO_DATA_PATH) در زمان deploy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='پیش‌فرض: GEO_DATA_PATH')
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.GEO_DATA_PATH
+        size = write_geo_data(path)
+        self.stdout.write(self.style.SUCCESS(f'{path} ساخته شد ({size / 1024:.0f} KB).'))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from country.buffer import replay_spool
+
+
+class Command(BaseCommand):
+    help = 'درج موقعیت‌های باقی‌مانده در فایل‌های spool صف write-behind (بعد از توقف ناگهانی پروسه‌ها)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool-dir', default=None, help='پیش‌فرض: GEO_LOCATION_SPOOL_DIR')
+        parser.add_argument('--include-live', action='store_true',
+                            help='فایل پروسه‌هایی که هنوز در حال اجرا هستند هم درج شوند')
+
+    def handle(self, *args, **options):
+        spool_dir = options['spool_dir'] or settings.GEO_LOCATION_SPOOL_DIR
+        if not spool_dir:
+            raise CommandError('GEO_LOCATION_SPOOL_DIR تنظیم نشده است')
+        files, records = replay_spool(spool_dir, include_live=options['include_live'])
+        self.stdout.write(self.style.SUCCESS(f'{records} موقعیت از {files} فایل درج شد.'))
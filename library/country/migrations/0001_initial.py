@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100)),
+                ('country_code', models.CharField(max_length=2)),
+                ('province', models.CharField(max_length=100)),
+                ('city', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+            options={
+                'verbose_name': 'موقعیت کاربر',
+                'verbose_name_plural': 'موقعیت\u200cهای کاربران',
+            },
+        ),
+    ]
@@ -1,11 +1,13 @@
 from django.db import models
+from django.utils import timezone
 
 class UserLocation(models.Model):
     country = models.CharField(max_length=100)
     country_code = models.CharField(max_length=2)
     province = models.CharField(max_length=100)
     city = models.CharField(max_length=100)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # زمان دریافت درخواست؛ در حالت write-behind ردیف چند ثانیه بعد درج می‌شود
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         verbose_name = "موقعیت کاربر"
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import re
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from .geodata import get_geo_manager
+from .serializers import CitySerializer, CountrySerializer, ProvinceSerializer
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+# پاسخ‌های کوچک‌تر از این اندازه فشرده نمی‌شوند
+GZIP_MIN_LENGTH = 200
+
+
+class RenderedPayload:
+    """بدنه JSON آماده یک پاسخ به همراه نسخه gzip و ETag هر دو"""
+
+    __slots__ = ('body', 'gzipped', 'etag', 'gzip_etag')
+
+    def __init__(self, data):
+        self.body = JSONRenderer().render(data)
+        digest = hashlib.md5(self.body).hexdigest()
+        self.etag = f'"{digest}"'
+        self.gzipped = None
+        self.gzip_etag = None
+        if len(self.body) >= GZIP_MIN_LENGTH:
+            # mtime ثابت تا خروجی gzip در همه پروسه‌ها یکسان باشد
+            compressed = gzip.compress(self.body, mtime=0)
+            if len(compressed) < len(self.body):
+                self.gzipped = compressed
+                self.gzip_etag = f'"{digest}-gzip"'
+
+
+class RenderedGeoResponses:
+    """
+    پاسخ‌های لیست کشور/استان/شهر یک بار برای هر نسخه داده سریالایز و به بایت تبدیل می‌شوند
+    و بعد از آن هر درخواست فقط یک جستجوی دیکشنری است.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def _render(self, key):
+        manager = get_geo_manager()
+        kind, *args = key
+        if kind == 'countries':
+            serializer = CountrySerializer(manager.get_countries(), many=True)
+        elif kind == 'provinces':
+            serializer = ProvinceSerializer([{'name': p} for p in manager.get_provinces(*args)], many=True)
+        else:
+            serializer = CitySerializer([{'name': c} for c in manager.get_cities(*args)], many=True)
+        return serializer.data
+
+    def get(self, *key):
+        version = get_geo_manager().dataset_version
+        payload = self._payloads.get(key) if version == self._version else None
+        if payload is not None:
+            return payload
+
+        data = self._render(key)
+        payload = RenderedPayload(data)
+        # لیست‌های خالی (کد کشور یا استان نامعتبر) نگه داشته نمی‌شوند تا cache با ورودی دلخواه بزرگ نشود
+        if data:
+            with self._lock:
+                if version != self._version:
+                    self._version, self._payloads = version, {}
+                self._payloads[key] = payload
+        return payload
+
+
+rendered_geo_responses = RenderedGeoResponses()
+
+
+def geo_response(request, *key):
+    """پاسخ آماده با ETag قوی و Cache-Control طولانی؛ در صورت تطابق If-None-Match پاسخ 304 برمی‌گردد"""
+    payload = rendered_geo_responses.get(*key)
+    use_gzip = payload.gzipped is not None and _accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = payload.gzip_etag if use_gzip else payload.etag
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(payload.gzipped if use_gzip else payload.body, content_type='application/json')
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.GEO_RESPONSE_MAX_AGE)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
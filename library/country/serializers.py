@@ -1,4 +1,6 @@
+from django.conf import settings
 from rest_framework import serializers
+from .geodata import CITY, PROVINCE, SUGGESTION_KINDS, TYPEAHEAD_LIMIT, get_geo_manager
 from .models import UserLocation
 
 class CountrySerializer(serializers.Serializer):
@@ -11,8 +13,52 @@ class ProvinceSerializer(serializers.Serializer):
 class CitySerializer(serializers.Serializer):
     name = serializers.CharField()
 
+class GeoSuggestionSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    province = serializers.CharField(allow_blank=True)
+    type = serializers.ChoiceField(choices=SUGGESTION_KINDS)
+
+class GeoAutocompleteQuerySerializer(serializers.Serializer):
+    """پارامترهای جستجوی پیشوندی شهر و استان"""
+    q = serializers.CharField(max_length=100, trim_whitespace=True)
+    type = serializers.ChoiceField(choices=SUGGESTION_KINDS, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=TYPEAHEAD_LIMIT, default=10)
+
 class UserLocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserLocation
-        fields = ['id', 'country', 'province', 'city', 'created_at']
-        read_only_fields = ['created_at']
\ No newline at end of file
+        fields = ['id', 'country', 'country_code', 'province', 'city', 'created_at']
+        read_only_fields = ['created_at']
+        extra_kwargs = {'country_code': {'required': False}}
+
+    def validate(self, data):
+        """
+        فقط در حالت GEO_LOCATION_WRITE_BEHIND (که خطای درج بعداً قابل گزارش نیست): کشور، استان و شهر با
+        ایندکس جغرافیایی یکسان‌سازی (مثلاً «طهران» یا «tehran» ← Tehran) و مقدار ناشناخته رد می‌شود.
+        در حالت عادی نام‌ها همان‌طور که ارسال شده‌اند ذخیره می‌شوند.
+        """
+        if not settings.GEO_LOCATION_WRITE_BEHIND:
+            return data
+        manager = get_geo_manager()
+
+        country = manager.find_country(data.get('country_code') or data['country'])
+        if country is None:
+            raise serializers.ValidationError({'country': 'کشور نامعتبر است'})
+        data['country'], data['country_code'] = country['name'], country['code']
+
+        # برای کشورهایی که استان‌هایشان در داده موجود نیست فقط شهر بررسی می‌شود
+        has_provinces = bool(manager.get_provinces(country['code']))
+        if has_provinces:
+            provinces = manager.lookup(country['code'], data['province'], PROVINCE)
+            if not provinces:
+                raise serializers.ValidationError({'province': 'استان در این کشور پیدا نشد'})
+            data['province'] = provinces[0][0]
+
+        cities = [
+            name for name, province in manager.lookup(country['code'], data['city'], CITY)
+            if not has_provinces or province == data['province']
+        ]
+        if not cities:
+            raise serializers.ValidationError({'city': 'شهر در این کشور/استان پیدا نشد'})
+        data['city'] = cities[0]
+        return data
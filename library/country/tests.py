@@ -1,3 +1,453 @@
-from django.test import TestCase
+import atexit
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from . import views
+from .management.commands.bench_geo import LegacyGeoScan
+from .buffer import BufferFull, LocationWriteBuffer, replay_spool
+from . import geodata
+from .geodata import CITY, PROVINCE, GeoDataManager, MappedGeoData, get_geo_manager
+from .models import UserLocation
+from .prerendered import RenderedGeoResponses
+
+
+def make_geo_manager(version='test-1', extra_countries=0):
+    """GeoDataManager روی داده کوچک ساختگی به جای geonamescache"""
+    manager = GeoDataManager.__new__(GeoDataManager)
+    manager.dataset_version = version
+    manager.countries_data = {'IR': {'name': 'Iran'}, 'DE': {'name': 'Germany'}}
+    for index in range(extra_countries):
+        manager.countries_data[f'X{index}'] = {'name': f'Country number {index}'}
+    manager.cities_data = {
+        '1': {'name': 'Tehran', 'countrycode': 'IR', 'admin1name': 'Tehran Province', 'population': 8000000,
+              'alternatenames': ['طهران', 'تهران', 'Teheran']},
+        '2': {'name': 'Shiraz', 'countrycode': 'IR', 'admin1name': 'Fars', 'population': 1500000,
+              'alternatenames': ['شيراز']},
+        '3': {'name': 'Berlin', 'countrycode': 'DE', 'admin1name': 'Berlin', 'population': 3400000,
+              'alternatenames': []},
+    }
+    manager._build_index()
+    return manager
+
+
+def make_typeahead_manager():
+    """داده ساختگی با نام‌های جایگزین به خط عربی (ي و ك) برای جستجوی پیشوندی"""
+    manager = make_geo_manager()
+    manager.cities_data.update({
+        '4': {'name': 'Karaj', 'countrycode': 'IR', 'admin1name': 'Tehran Province', 'population': 1900000,
+              'alternatenames': ['كرج']},
+        '5': {'name': 'Kish', 'countrycode': 'IR', 'admin1name': 'Fars', 'population': 40000,
+              'alternatenames': ['كيش']},
+        '6': {'name': 'Kashan', 'countrycode': 'IR', 'admin1name': 'Fars', 'population': 300000,
+              'alternatenames': ['کاشان']},
+    })
+    manager._build_index()
+    return manager
+
+
+def make_index_manager():
+    """داده ساختگی با حالت‌های خاص ایندکس: استان Unknown، شهر بدون استان و نام‌های تکراری"""
+    manager = make_typeahead_manager()
+    manager.cities_data.update({
+        '7': {'name': 'Hidden', 'countrycode': 'IR', 'admin1name': 'Unknown', 'population': 10},
+        '8': {'name': 'Nowhere', 'countrycode': 'IR', 'admin1name': '', 'population': 10},
+        '9': {'name': 'Kish', 'countrycode': 'IR', 'admin1name': 'Fars', 'population': 10},
+        '10': {'name': 'Munich', 'countrycode': 'DE', 'admin1name': 'Bavaria', 'population': 1500000},
+        '11': {'name': 'Lonely', 'countrycode': 'FR', 'population': 10},
+    })
+    manager._build_index()
+    return manager
+
+
+class GeoIndexTests(SimpleTestCase):
+    """ایندکس تودرتوی GeoDataManager همان خروجی اسکن قبلی همه شهرها را می‌دهد"""
+
+    def test_index_matches_legacy_scan(self):
+        manager = make_index_manager()
+        legacy = LegacyGeoScan(manager)
+        self.assertEqual(manager.get_countries(), legacy.get_countries())
+        for country_code in ('IR', 'DE', 'FR', 'XX', 'ir'):
+            self.assertEqual(manager.get_provinces(country_code), legacy.get_provinces(country_code))
+            for province_name in ('Fars', 'Tehran Province', 'Bavaria', 'Unknown', '', 'Missing'):
+                with self.subTest(country_code=country_code, province_name=province_name):
+                    self.assertEqual(
+                        manager.get_cities(country_code, province_name),
+                        legacy.get_cities(country_code, province_name),
+                    )
+        self.assertEqual(manager.get_provinces('IR'), ['Fars', 'Tehran Province'])
+        self.assertEqual(manager.get_cities('IR', 'Unknown'), ['Hidden'])
+
+    def test_results_are_copies(self):
+        manager = make_index_manager()
+        manager.get_provinces('IR').append('Injected')
+        manager.get_countries().clear()
+        self.assertEqual(manager.get_provinces('IR'), ['Fars', 'Tehran Province'])
+        self.assertTrue(manager.get_countries())
+
+
+class MappedGeoDataTests(SimpleTestCase):
+    """فایل ساخته شده با build_geo_data همان خروجی GeoDataManager را می‌دهد"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'geo_data.bin')
+
+    def build(self, manager):
+        with mock.patch('country.geodata.GeoDataManager', return_value=manager):
+            call_command('build_geo_data', output=self.path, stdout=mock.Mock())
+        return MappedGeoData(self.path)
+
+    def assertSameData(self, manager, mapped, country_codes, prefixes):
+        self.assertEqual(mapped.get_countries(), manager.get_countries())
+        for country_code in country_codes:
+            provinces = manager.get_provinces(country_code)
+            self.assertEqual(mapped.get_provinces(country_code), provinces)
+            for province_name in [*provinces, 'Unknown', 'Missing']:
+                self.assertEqual(
+                    mapped.get_cities(country_code, province_name), manager.get_cities(country_code, province_name)
+                )
+            for prefix in prefixes:
+                for kind in (None, CITY, PROVINCE):
+                    with self.subTest(country_code=country_code, prefix=prefix, kind=kind):
+                        self.assertEqual(
+                            mapped.autocomplete(country_code, prefix, kind=kind, limit=20),
+                            manager.autocomplete(country_code, prefix, kind=kind, limit=20),
+                        )
+
+    def test_parity_with_in_memory_index(self):
+        manager = make_index_manager()
+        mapped = self.build(manager)
+        self.assertSameData(manager, mapped, ['IR', 'DE', 'FR', 'XX'], ['k', 'کا', 'كي', 'teh', 'ش', 'zz', 'b'])
+        self.assertEqual(mapped.lookup('IR', 'طهران', CITY), manager.lookup('IR', 'طهران', CITY))
+        self.assertEqual(mapped.find_country('iran'), manager.find_country('iran'))
+
+    def test_parity_with_geonamescache(self):
+        manager = GeoDataManager()
+        mapped = self.build(manager)
+        self.assertSameData(manager, mapped, ['IR', 'US', 'DE', 'AQ'], ['t', 'tehr', 'ته', 'san ', 'ber', 'q'])
+
+    def test_rejects_unknown_file(self):
+        with open(self.path, 'wb') as output:
+            output.write(b'\0' * 128)
+        with self.assertRaises(ValueError):
+            MappedGeoData(self.path)
+
+    def test_missing_file_falls_back_to_in_memory_index(self):
+        manager = make_geo_manager()
+        with mock.patch.object(geodata, '_manager', None), \
+                mock.patch('country.geodata.GeoDataManager', return_value=manager), \
+                override_settings(GEO_DATA_PATH=self.path):
+            with self.assertLogs('country.geodata', 'WARNING'):
+                self.assertIs(get_geo_manager(), manager)
+            # فقط یک بار ساخته می‌شود
+            self.assertIs(get_geo_manager(), manager)
+
+        self.build(manager)
+        with mock.patch.object(geodata, '_manager', None), override_settings(GEO_DATA_PATH=self.path):
+            self.assertIsInstance(get_geo_manager(), MappedGeoData)
+
+
+class TypeaheadTests(SimpleTestCase):
+    """جستجوی پیشوندی: یکسان‌سازی حروف عربی و فارسی و ترتیب بر اساس جمعیت"""
+
+    def setUp(self):
+        self.manager = make_typeahead_manager()
+
+    def names(self, query, **kwargs):
+        return [row['name'] for row in self.manager.autocomplete('IR', query, **kwargs)]
+
+    def test_persian_and_arabic_letters_are_unified(self):
+        # ی و ک فارسی در جستجو، ي و ك عربی در داده و برعکس
+        self.assertEqual(self.names('شیر'), ['Shiraz'])
+        self.assertEqual(self.names('کرج'), ['Karaj'])
+        self.assertEqual(self.names('كيش'), ['Kish'])
+        self.assertEqual(self.names('كاش'), ['Kashan'])
+        self.assertEqual(self.manager.lookup('IR', 'كرج', CITY), [('Karaj', 'Tehran Province')])
+
+    def test_case_and_diacritics_are_ignored(self):
+        self.assertEqual(self.names('KAR'), ['Karaj'])
+        self.assertEqual(self.names('  shíraz '), ['Shiraz'])
+        self.assertEqual(self.names(''), [])
+
+    def test_prefix_results_are_ordered_by_population(self):
+        self.assertEqual(self.names('k'), ['Karaj', 'Kashan', 'Kish'])
+        self.assertEqual(self.names('k', limit=2), ['Karaj', 'Kashan'])
+        # وزن استان مجموع جمعیت شهرهای آن است
+        self.assertEqual(
+            self.manager.autocomplete('IR', 'teh'),
+            [
+                {'name': 'Tehran Province', 'province': '', 'type': PROVINCE},
+                {'name': 'Tehran', 'province': 'Tehran Province', 'type': CITY},
+            ],
+        )
+        self.assertEqual(self.names('teh', kind=CITY), ['Tehran'])
+
+
+class GeoUrlTests(SimpleTestCase):
+    """endpoint های کشور از URLconf اصلی پروژه (/api/country/) در دسترس‌اند"""
+
+    def setUp(self):
+        manager = make_typeahead_manager()
+        patchers = [
+            mock.patch('country.views.get_geo_manager', return_value=manager),
+            mock.patch('country.prerendered.get_geo_manager', return_value=manager),
+            mock.patch('country.prerendered.rendered_geo_responses', RenderedGeoResponses()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_autocomplete(self):
+        response = self.client.get('/api/country/countries/ir/autocomplete/', {'q': 'كر', 'type': 'city'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'name': 'Karaj', 'province': 'Tehran Province', 'type': 'city'}])
+
+        self.assertEqual(self.client.get('/api/country/countries/ir/autocomplete/').status_code, 400)
+        response = self.client.get('/api/country/countries/ir/autocomplete/', {'q': 'k', 'limit': 100})
+        self.assertEqual(response.status_code, 400)
+
+    def test_geo_lists(self):
+        response = self.client.get('/api/country/countries/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({'name': 'Iran', 'code': 'IR'}, json.loads(response.content))
+        response = self.client.get('/api/country/countries/ir/provinces/Fars/cities/')
+        self.assertEqual(json.loads(response.content), [{'name': 'Kashan'}, {'name': 'Kish'}, {'name': 'Shiraz'}])
+
+
+class GeoResponseTests(SimpleTestCase):
+    """پاسخ‌های آماده لیست کشورها: ETag نسخه معمولی و gzip، پاسخ 304 و باطل شدن با تغییر نسخه داده"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.manager = make_geo_manager(extra_countries=20)
+        patchers = [
+            mock.patch('country.prerendered.get_geo_manager', side_effect=lambda: self.manager),
+            mock.patch('country.prerendered.rendered_geo_responses', RenderedGeoResponses()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, view=views.countries_list, **kwargs):
+        headers = {key: kwargs.pop(key) for key in list(kwargs) if key.startswith('HTTP_')}
+        return view(self.factory.get('/', **headers), **kwargs)
+
+    @override_settings(GEO_RESPONSE_MAX_AGE=3600)
+    def test_identity_response(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn({'name': 'Iran', 'code': 'IR'}, json.loads(response.content))
+
+    def test_gzip_variant_has_its_own_etag(self):
+        identity = self.get()
+        compressed = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), identity.content)
+        self.assertNotEqual(compressed['ETag'], identity['ETag'])
+
+    def test_not_modified(self):
+        identity = self.get()
+        compressed = self.get(HTTP_ACCEPT_ENCODING='gzip')
+
+        response = self.get(HTTP_IF_NONE_MATCH=identity['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], identity['ETag'])
+
+        response = self.get(HTTP_IF_NONE_MATCH=compressed['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 304)
+        # ETag نسخه gzip برای کلاینتی که gzip نمی‌پذیرد معتبر نیست
+        response = self.get(HTTP_IF_NONE_MATCH=compressed['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_dataset_version_change_rerenders(self):
+        before = self.get(views.provinces_list, country_code='ir')
+        self.assertEqual(json.loads(before.content), [{'name': 'Fars'}, {'name': 'Tehran Province'}])
+
+        self.manager = make_geo_manager(version='test-2')
+        self.manager.cities_data['4'] = {
+            'name': 'Isfahan', 'countrycode': 'IR', 'admin1name': 'Isfahan', 'population': 2000000,
+        }
+        self.manager._build_index()
+        after = self.get(views.provinces_list, country_code='ir')
+        self.assertEqual(len(json.loads(after.content)), 3)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        response = self.get(views.provinces_list, country_code='ir', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_same_version_is_served_from_memory(self):
+        self.get(views.cities_list, country_code='IR', province_name='Fars')
+        with mock.patch('country.prerendered.CitySerializer') as serializer:
+            response = self.get(views.cities_list, country_code='IR', province_name='Fars')
+        serializer.assert_not_called()
+        self.assertEqual(json.loads(response.content), [{'name': 'Shiraz'}])
+
+
+class SaveLocationTests(TestCase):
+    """save_location در حالت عادی (ذخیره همان مقادیر ارسالی) و write-behind (یکسان‌سازی و رد مقدار ناشناخته)"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        patcher = mock.patch('country.serializers.get_geo_manager', return_value=make_geo_manager())
+        self.get_geo_manager = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        return views.save_location(self.factory.post('/', data, format='json'))
+
+    def test_sync_mode_saves_names_as_sent(self):
+        for payload in (
+            {'country': 'iran', 'province': 'tehran province', 'city': 'طهران'},
+            {'country': 'ایران', 'province': 'فارس', 'city': 'مرودشت'},
+        ):
+            response = self.post(payload)
+            self.assertEqual(response.status_code, 201, response.data)
+            location = UserLocation.objects.get(pk=response.data['id'])
+            self.assertEqual(
+                (location.country, location.province, location.city, location.country_code),
+                (payload['country'], payload['province'], payload['city'], ''),
+            )
+        self.get_geo_manager.assert_not_called()
+        self.assertEqual(self.post({'country': 'Iran', 'province': '', 'city': 'Shiraz'}).status_code, 400)
+
+    @override_settings(GEO_LOCATION_WRITE_BEHIND=True)
+    def test_write_behind_accepts_known_location(self):
+        with mock.patch('country.views.location_buffer') as buffer:
+            response = self.post({'country': 'IR', 'province': 'Fars', 'city': 'شيراز'})
+        self.assertEqual(response.status_code, 202, response.data)
+        record = buffer.add.call_args.args[0]
+        self.assertEqual((record['country'], record['province'], record['city']), ('Iran', 'Fars', 'Shiraz'))
+        self.assertIn('created_at', record)
+        self.assertFalse(UserLocation.objects.exists())
+
+    @override_settings(GEO_LOCATION_WRITE_BEHIND=True)
+    def test_write_behind_rejects_unknown_location(self):
+        with mock.patch('country.views.location_buffer') as buffer:
+            self.assertEqual(self.post({'country': 'Narnia', 'province': 'x', 'city': 'y'}).status_code, 400)
+            self.assertEqual(self.post({'country': 'IR', 'province': 'Fars', 'city': 'Tehran'}).status_code, 400)
+        buffer.add.assert_not_called()
+
+    @override_settings(GEO_LOCATION_WRITE_BEHIND=True)
+    def test_full_buffer_returns_503(self):
+        with mock.patch('country.views.location_buffer') as buffer:
+            buffer.add.side_effect = BufferFull()
+            response = self.post({'country': 'IR', 'province': 'Fars', 'city': 'Shiraz'})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+class LocationWriteBufferTests(TransactionTestCase):
+    """flush صف با thread پس‌زمینه و اتصال دیتابیس خودش؛ برای همین TransactionTestCase"""
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+
+    def make_buffer(self, **kwargs):
+        buffer = LocationWriteBuffer(**kwargs)
+        # flush هنگام خروج پروسه بعد از حذف دیتابیس تست اجرا می‌شد
+        self.addCleanup(atexit.unregister, buffer.flush)
+        return buffer
+
+    def record(self, city='Tehran'):
+        return {'country': 'Iran', 'country_code': 'IR', 'province': '', 'city': city, 'created_at': timezone.now()}
+
+    def spool_files(self, prefix='locations-'):
+        return [name for name in os.listdir(self.spool_dir) if name.startswith(prefix)]
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def test_flush_on_size(self):
+        buffer = self.make_buffer(batch_size=3, flush_interval=3600, spool_dir=self.spool_dir)
+        buffer.add(self.record())
+        buffer.add(self.record())
+        self.assertEqual(UserLocation.objects.count(), 0)
+        self.assertEqual(len(self.spool_files()), 1)
+
+        buffer.add(self.record())
+        self.assertTrue(self.wait_for(lambda: UserLocation.objects.count() == 3))
+        self.assertTrue(self.wait_for(lambda: buffer.stats()['depth'] == 0 and not self.spool_files()))
+        self.assertEqual(buffer.stats()['high_water'], 3)
+
+    def test_restore_on_failure(self):
+        buffer = self.make_buffer(batch_size=100, flush_interval=3600, spool_dir=self.spool_dir)
+        buffer.add(self.record())
+        buffer.add(self.record())
+
+        with mock.patch.object(UserLocation.objects, 'bulk_create', side_effect=OperationalError('down')):
+            with self.assertLogs('country.buffer', 'ERROR'):
+                self.assertEqual(buffer.flush(), 0)
+        stats = buffer.stats()
+        self.assertEqual((stats['depth'], stats['failed_flushes']), (2, 1))
+        self.assertGreater(stats['retry_in_seconds'], 0)
+        # thread پس‌زمینه تا پایان backoff دوباره تلاش نمی‌کند
+        buffer.flush_interval = 0
+        self.assertFalse(buffer._due())
+        self.assertEqual(len(self.spool_files()), 1)
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(UserLocation.objects.count(), 2)
+        self.assertEqual(buffer.stats()['retry_in_seconds'], 0)
+        self.assertEqual(self.spool_files(), [])
+
+    def test_max_depth_rejects_new_records(self):
+        buffer = self.make_buffer(batch_size=100, flush_interval=3600, max_depth=2)
+        buffer.add(self.record())
+        buffer.add(self.record())
+        with self.assertRaises(BufferFull):
+            buffer.add(self.record())
+        self.assertEqual(buffer.stats()['rejected'], 1)
+        self.assertEqual(buffer.stats()['depth'], 2)
+
+    def test_bad_record_is_quarantined(self):
+        buffer = self.make_buffer(batch_size=100, flush_interval=3600, spool_dir=self.spool_dir)
+        buffer.add(self.record('Tehran'))
+        buffer.add(self.record(None))
+        buffer.add(self.record('Shiraz'))
+
+        with self.assertLogs('country.buffer', 'ERROR'):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(set(UserLocation.objects.values_list('city', flat=True)), {'Tehran', 'Shiraz'})
+        self.assertEqual(buffer.stats()['quarantined'], 1)
+        self.assertEqual(buffer.stats()['depth'], 0)
+        [quarantine] = self.spool_files('quarantine-')
+        with open(os.path.join(self.spool_dir, quarantine), encoding='utf-8') as lines:
+            self.assertIsNone(json.loads(lines.read())['city'])
+
+    def test_replay_spool(self):
+        path = os.path.join(self.spool_dir, f'locations-{os.getpid()}-1.jsonl')
+        with open(path, 'w', encoding='utf-8') as spool:
+            for city in ('Tehran', 'Shiraz'):
+                spool.write(json.dumps(self.record(city), default=str) + '\n')
+            spool.write('{"country": "Ir')  # خط نیمه‌کاره هنگام توقف پروسه
+
+        # فایل پروسه‌ای که هنوز اجرا می‌شود دست نمی‌خورد
+        self.assertEqual(replay_spool(self.spool_dir), (0, 0))
+        self.assertTrue(os.path.exists(path))
+
+        with self.assertLogs('country.buffer', 'WARNING'):
+            self.assertEqual(replay_spool(self.spool_dir, include_live=True), (1, 2))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(set(UserLocation.objects.values_list('city', flat=True)), {'Tehran', 'Shiraz'})
@@ -6,6 +6,8 @@ urlpatterns = [
     path('countries/<str:country_code>/provinces/', views.provinces_list, name='provinces-list'),
     path('countries/<str:country_code>/provinces/<str:province_name>/cities/', 
          views.cities_list, name='cities-list'),
+    path('countries/<str:country_code>/autocomplete/', views.geo_autocomplete, name='geo-autocomplete'),
     path('save-location/', views.save_location, name='save-location'),
+    path('save-location/buffer/', views.location_buffer_stats, name='save-location-buffer'),
     path('saved-locations/', views.UserLocationListView.as_view(), name='saved-locations'),
 ]
\ No newline at end of file
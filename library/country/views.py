@@ -2,86 +2,85 @@ from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from geonamescache import GeonamesCache
+from django.conf import settings
+from django.utils import timezone
+from Book.permissions import IsAdmin
+from .buffer import BufferFull, location_buffer
+from .geodata import get_geo_manager
+from .prerendered import geo_response
 from .models import UserLocation
 from .serializers import (
-    CountrySerializer, 
-    ProvinceSerializer, 
-    CitySerializer, 
+    GeoAutocompleteQuerySerializer,
+    GeoSuggestionSerializer,
     UserLocationSerializer
 )
 
-class GeoDataManager:
-    def __init__(self):
-        self.gc = GeonamesCache()
-        self.countries_data = self.gc.get_countries()
-        self.cities_data = self.gc.get_cities()
-    
-    def get_countries(self):
-        """دریافت لیست همه کشورها"""
-        countries = []
-        for code, data in self.countries_data.items():
-            countries.append({
-                'name': data['name'],
-                'code': code
-            })
-        return sorted(countries, key=lambda x: x['name'])
-    
-    def get_provinces(self, country_code):
-        """دریافت استان‌های یک کشور"""
-        provinces = set()
-        for city_data in self.cities_data.values():
-            if (city_data['countrycode'] == country_code and 
-                city_data.get('admin1name') and 
-                city_data['admin1name'] != 'Unknown'):
-                provinces.add(city_data['admin1name'])
-        return sorted(list(provinces))
-    
-    def get_cities(self, country_code, province_name):
-        """دریافت شهرهای یک استان"""
-        cities = []
-        for city_data in self.cities_data.values():
-            if (city_data['countrycode'] == country_code and 
-                city_data.get('admin1name') and 
-                city_data['admin1name'] == province_name):
-                cities.append(city_data['name'])
-        return sorted(cities)
-
-geo_manager = GeoDataManager()
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def countries_list(request):
     """لیست همه کشورها"""
-    countries = geo_manager.get_countries()
-    serializer = CountrySerializer(countries, many=True)
-    return Response(serializer.data)
+    return geo_response(request, 'countries')
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def provinces_list(request, country_code):
     """لیست استان‌های یک کشور"""
-    provinces = geo_manager.get_provinces(country_code.upper())
-    serializer = ProvinceSerializer([{'name': p} for p in provinces], many=True)
-    return Response(serializer.data)
+    return geo_response(request, 'provinces', country_code.upper())
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def cities_list(request, country_code, province_name):
     """لیست شهرهای یک استان"""
-    cities = geo_manager.get_cities(country_code.upper(), province_name)
-    serializer = CitySerializer([{'name': c} for c in cities], many=True)
+    return geo_response(request, 'cities', country_code.upper(), province_name)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def geo_autocomplete(request, country_code):
+    """
+    پیشنهاد شهر و استان بر اساس پیشوند نام (?q=&type=city|province&limit=)؛
+    بدون حساسیت به حروف بزرگ/کوچک و اعراب و با یکسان‌سازی حروف عربی و فارسی.
+    """
+    query = GeoAutocompleteQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    suggestions = get_geo_manager().autocomplete(
+        country_code.upper(), params['q'], kind=params.get('type'), limit=params['limit']
+    )
+    serializer = GeoSuggestionSerializer(suggestions, many=True)
     return Response(serializer.data)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def save_location(request):
-    """ذخیره موقعیت کاربر"""
+    """
+    ذخیره موقعیت کاربر.
+    در حالت GEO_LOCATION_WRITE_BEHIND نام‌ها با ایندکس جغرافیایی یکسان‌سازی و کشور/استان/شهر ناشناخته
+    با 400 رد می‌شود، رکورد معتبر فقط به صف
+    اضافه می‌شود و پاسخ 202 (بدون id) برمی‌گردد؛ اگر صف پر باشد پاسخ 503 با Retry-After است.
+    """
     serializer = UserLocationSerializer(data=request.data)
-    if serializer.is_valid():
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    if settings.GEO_LOCATION_WRITE_BEHIND:
+        record = {**serializer.validated_data, 'created_at': timezone.now()}
+        try:
+            location_buffer.add(record)
+        except BufferFull:
+            return Response(
+                {'error': 'سرور موقتاً قادر به ثبت موقعیت نیست، لطفاً دوباره تلاش کنید'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(max(int(settings.GEO_LOCATION_FLUSH_INTERVAL), 1))},
+            )
+        return Response(UserLocationSerializer(record).data, status=status.HTTP_202_ACCEPTED)
+    serializer.save()
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def location_buffer_stats(request):
+    """عمق و متریک‌های صف write-behind موقعیت‌ها در پروسه‌ای که درخواست را پاسخ داده"""
+    return Response({'enabled': settings.GEO_LOCATION_WRITE_BEHIND, **location_buffer.stats()})
 
 class UserLocationListView(generics.ListAPIView):
     """لیست موقعیت‌های ذخیره شده"""
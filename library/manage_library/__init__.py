@@ -0,0 +1,4 @@
+# بارگذاری Celery app همراه Django تا shared_task ها به همین app و تنظیماتش وصل شوند
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,10 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'manage_library.settings')
+
+# تنظیمات CELERY_* (از جمله CELERY_BEAT_SCHEDULE) از settings.py خوانده می‌شوند
+app = Celery('manage_library')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
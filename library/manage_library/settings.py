@@ -106,6 +106,42 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# نسخه کش کاتالوگ (Book/cache.py) باید بین همه worker های وب و Celery مشترک باشد تا تغییری که در
+# تسک‌ها یا worker دیگر انجام می‌شود کش همه پروسه‌ها را باطل کند؛ LocMemCache فقط برای توسعه و تست است.
+# CACHE_URL: redis://host:6379/1 یا memcached://host:11211
+CACHE_URL = os.getenv('CACHE_URL', '' if DEBUG else 'redis://localhost:6379/1')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': 'library',
+        }
+    }
+elif CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': CACHE_URL.removeprefix('memcached://'),
+            'KEY_PREFIX': 'library',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'library-default',
+        }
+    }
+
+# مدت نگهداری پاسخ‌های کش شده کاتالوگ (ثانیه)؛ با تغییر داده‌ها نسخه کش زودتر باطل می‌شود
+CATALOG_CACHE_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -170,6 +206,33 @@ SIMPLE_JWT = {
 }
 
 
+# موتور کم کردن موجودی در request_book:
+# 'locking' (select_for_update و بررسی در پایتون) یا 'conditional' (UPDATE شرطی اتمیک بدون قفل صریح)
+LIBRARY_CHECKOUT_ENGINE = os.getenv('LIBRARY_CHECKOUT_ENGINE', 'locking')
+
+# زمانبندی بازگشت هر قرض با تسک ETA در لحظه پایان مهلت (manage_library/celery.py).
+# در حالت DEBUG (بدون broker) پیش‌فرض خاموش است؛ آن‌وقت و برای قرض‌های جا مانده، اجرای ساعتی
+# auto_return_loaned_books_task در celery beat قرض‌های منقضی را برمی‌گرداند.
+LIBRARY_LOAN_EXPIRY_ETA = os.getenv('LIBRARY_LOAN_EXPIRY_ETA', str(not DEBUG)) == 'True'
+
+# گردش‌های موجودی قدیمی‌تر از این تعداد روز در StockSnapshot فشرده می‌شوند
+STOCK_LEDGER_RETENTION_DAYS = 90
+
+# فایل باینری داده‌های جغرافیایی که با build_geo_data ساخته می‌شود و همه پروسه‌ها آن را map می‌کنند
+GEO_DATA_PATH = os.getenv('GEO_DATA_PATH', str(BASE_DIR / 'country' / 'geo_data.bin'))
+# مدت cache پاسخ‌های لیست کشور/استان/شهر در مرورگر و proxy (ثانیه)
+GEO_RESPONSE_MAX_AGE = int(os.getenv('GEO_RESPONSE_MAX_AGE', 7 * 24 * 3600))
+
+# حالت write-behind برای save_location: درخواست‌ها در صف پروسه جمع و دسته‌ای با bulk_create درج می‌شوند
+GEO_LOCATION_WRITE_BEHIND = os.getenv('GEO_LOCATION_WRITE_BEHIND', 'False') == 'True'
+GEO_LOCATION_BUFFER_SIZE = int(os.getenv('GEO_LOCATION_BUFFER_SIZE', 500))
+GEO_LOCATION_FLUSH_INTERVAL = float(os.getenv('GEO_LOCATION_FLUSH_INTERVAL', 2.0))
+# سقف صف در هر پروسه؛ بعد از آن درخواست‌ها با 503 رد می‌شوند (مثلاً وقتی دیتابیس در دسترس نیست)
+GEO_LOCATION_BUFFER_MAX_DEPTH = int(os.getenv('GEO_LOCATION_BUFFER_MAX_DEPTH', 5000))
+# پوشه فایل‌های spool برای حفظ صف در صورت توقف ناگهانی پروسه (خالی یعنی غیرفعال)
+GEO_LOCATION_SPOOL_DIR = os.getenv('GEO_LOCATION_SPOOL_DIR') or None
+
+
 # CELERY CONFIGURATION (Requires Redis or RabbitMQ as broker)
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0') 
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -177,12 +240,36 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# تسک‌های ETA تا زمان اجرا در صف می‌مانند؛ visibility_timeout باید از طولانی‌ترین مهلت قرض بیشتر باشد
+# وگرنه Redis آن‌ها را دوباره تحویل می‌دهد
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': int(timedelta(days=2).total_seconds())}
 
-# CELERY BEAT (Scheduler) - تنظیم برای اجرای وظیفه بازگشت خودکار هر 24 ساعت
+# CELERY BEAT (Scheduler) - با LIBRARY_LOAN_EXPIRY_ETA بازگشت خودکار اصلی با تسک‌های ETA است و این اجرا
+# پشتیبان قرض‌های جا مانده؛ در غیر این صورت همین اجرای ساعتی قرض‌های منقضی را برمی‌گرداند
 CELERY_BEAT_SCHEDULE = {
-    'auto-return-loaned-books-every-day': {
+    'auto-return-loaned-books-backstop': {
         'task': 'Book.tasks.auto_return_loaned_books_task', 
-        'schedule': timedelta(hours=24), 
+        'schedule': timedelta(hours=1), 
+        'args': (),
+    },
+    'drain-replenish-requests-every-30-seconds': {
+        'task': 'Book.tasks.drain_replenish_requests_task',
+        'schedule': timedelta(seconds=30),
+        'args': (),
+    },
+    'compact-stock-movements-every-day': {
+        'task': 'Book.tasks.compact_stock_movements_task',
+        'schedule': timedelta(hours=24),
+        'args': (),
+    },
+    'rollup-transactions-every-5-minutes': {
+        'task': 'Book.tasks.rollup_transactions_task',
+        'schedule': timedelta(minutes=5),
+        'args': (),
+    },
+    'reconcile-stock-stats-every-hour': {
+        'task': 'Book.tasks.reconcile_stock_stats_task',
+        'schedule': timedelta(hours=1),
         'args': (),
     },
 }
@@ -42,7 +42,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('Accounts.urls')),
     path('api/library/', include('Book.urls')),
-    # path("api/country/", include('country.urls')),
+    path("api/country/", include('country.urls')),
     path("api/", include('rest_framework.urls')),
     path("swagger<format>/", schema_view.without_ui(cache_timeout=0),name="schema-json"),
     path("swagger/", schema_view.with_ui('swagger',cache_timeout=0), name="schema-swagger-ui"),